@@ -4,6 +4,7 @@ Configuration overrides for settings.py
 
 import os
 import sys
+import tempfile
 from django.urls import reverse_lazy
 from ivatar.settings import BASE_DIR
 
@@ -26,10 +27,14 @@ INSTALLED_APPS.extend([
 
 MIDDLEWARE.extend([
     'django.middleware.locale.LocaleMiddleware',
+    'ivatar.db_router.ReplicaPinningMiddleware',
 ])
 MIDDLEWARE.insert(
     0, 'ivatar.middleware.MultipleProxyMiddleware',
 )
+MIDDLEWARE.insert(
+    1, 'ivatar.middleware.MetricsMiddleware',
+)
 
 AUTHENTICATION_BACKENDS = (
     # Enable this to allow LDAP authentication.
@@ -139,9 +144,147 @@ if 'POSTGRESQL_DATABASE' in os.environ:
         'HOST': 'postgresql',
     }
 
+# Read replicas for the avatar lookups, see ivatar/db_router.py: comma
+# separated hosts, sharing name and credentials with the default database
+for (index, host) in enumerate(filter(None, os.environ.get(
+        'DATABASE_REPLICAS', '').split(','))):
+    DATABASES['replica%i' % index] = dict(  # pragma: no cover
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['ivatar.db_router.ReplicaRouter']
+# Seconds a client reads from the primary after changing something
+REPLICA_PIN_SECONDS = 10
+
+# Caches, one per purpose, each limited to CACHE_<PURPOSE>_MAX_ENTRIES
+# entries. They're in-process unless MEMCACHED_LOCATION (comma separated
+# host:port) points to shared memcached servers; then the renders and
+# proxy caches keep an in-process LRU tier in front of them, see
+# ivatar/cache.py. memcached has no per-purpose limit, all purposes share
+# the memory of its servers, unless MEMCACHED_<PURPOSE>_LOCATION gives a
+# purpose servers of its own
+CACHE_LOCAL_TIMEOUT = int(os.environ.get('CACHE_LOCAL_TIMEOUT', 60))
+CACHES = {}
+for (purpose, max_entries) in (
+        ('default', 10000), ('renders', 5000), ('proxy', 1000),
+        ('lookups', 10000), ('sessions', 10000)):
+    max_entries = int(os.environ.get(
+        'CACHE_%s_MAX_ENTRIES' % purpose.upper(), max_entries))
+    CACHES[purpose] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': purpose,
+        'OPTIONS': {'MAX_ENTRIES': max_entries},
+    }
+    if 'MEMCACHED_LOCATION' in os.environ:
+        CACHES[purpose] = {  # pragma: no cover
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ.get(
+                'MEMCACHED_%s_LOCATION' % purpose.upper(),
+                os.environ['MEMCACHED_LOCATION']).split(','),
+            'KEY_PREFIX': '' if purpose == 'default' else purpose,
+        }
+        if purpose in ('renders', 'proxy'):
+            CACHES[purpose + '_shared'] = CACHES[purpose]
+            CACHES[purpose] = {
+                'BACKEND': 'ivatar.cache.TieredCache',
+                'LOCATION': purpose + '_shared',
+                'OPTIONS': {
+                    'MAX_ENTRIES': max_entries,
+                    'LOCAL_TIMEOUT': CACHE_LOCAL_TIMEOUT,
+                },
+            }
+
+# Sessions are only cached in a shared cache: with per-process caches,
+# processes would serve each others' outdated sessions
+SESSION_ENGINE = os.environ.get(
+    'SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db'
+    if 'MEMCACHED_LOCATION' in os.environ
+    else 'django.contrib.sessions.backends.db')
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Per-stage timing of the avatar views, see ivatar/timing.py
+STAGE_TIMING = 'STAGE_TIMING' in os.environ
+
+# Import the default avatar generators at startup instead of on first
+# use, see ivatar/generators.py
+PRELOAD_GENERATORS = 'PRELOAD_GENERATORS' in os.environ
+
+# Clients allowed to scrape /metrics, see ivatar/metrics.py
+METRICS_ALLOWED_IPS = os.environ.get(
+    'METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# Lookup of federated domains (SRV records), see ivatar/federation.py
+FEDERATION_NEGATIVE_TTL = 300
+FEDERATION_MAX_TTL = 86400
+FEDERATION_DNS_TIMEOUT = 2
+FEDERATION_PROBE_TIMEOUT = 3
+
+# Maximum number of addresses per request to /tools/batch/
+BATCH_MAX_ADDRESSES = 10000
+# The distinct domains of a request to /tools/batch/ are resolved by
+# BATCH_RESOLVE_WORKERS threads, for at most BATCH_RESOLVE_TIMEOUT seconds;
+# only the first BATCH_MAX_DOMAINS are, the others are flagged unresolved
+BATCH_RESOLVE_WORKERS = 16
+BATCH_RESOLVE_TIMEOUT = 10
+BATCH_MAX_DOMAINS = 100
+# Requests to /tools/batch/ allowed per client and BATCH_RATE_PERIOD seconds
+BATCH_RATE_LIMIT = 10
+BATCH_RATE_PERIOD = 60
+# Maximum number of digests per request to /avatars/
+BULK_MAX_DIGESTS = 500
+
+# Maximum number of tiles and default number of columns of /sprite/
+SPRITE_MAX_TILES = 100
+SPRITE_COLUMNS = 10
+# Largest sprite image (width x height) built per request, ~16 MB as RGBA
+SPRITE_MAX_PIXELS = 2048 * 2048
+# Rendered tiles are keyed by photo and modification time, see /sprite/
+TILE_CACHE_TIMEOUT = 86400
+# Seconds images fetched by /gravatarproxy/ are cached
+GRAVATAR_PROXY_CACHE_TIMEOUT = 3600
+
+# Seconds the per-user counts of photos, addresses and OpenIDs (see
+# UserSummary) are cached; only with a shared cache, other processes
+# wouldn't notice changes in their own one
+USER_SUMMARY_TIMEOUT = 3600 if 'MEMCACHED_LOCATION' in os.environ else 0
+
+# Seconds the OpenID associations of a server are cached; only with a
+# shared cache, as for USER_SUMMARY_TIMEOUT. Run ./manage.py cleanup_openid
+# regularly to remove expired ones
+OPENID_ASSOCIATION_CACHE_TIMEOUT = \
+    300 if 'MEMCACHED_LOCATION' in os.environ else 0
+# Where OpenID associations and nonces are kept: in the database, or only
+# in the OPENID_STORE_CACHE cache with
+# 'ivatar.ivataraccount.models.CacheOpenIDStore' (needs a cache shared by
+# all application servers)
+OPENID_STORE = os.environ.get(
+    'OPENID_STORE', 'ivatar.ivataraccount.models.DjangoOpenIDStore')
+OPENID_STORE_CACHE = 'default'
+
+# Seconds the photo import waits for Gravatar and Libravatar, together
+EXTERNAL_PHOTO_TIMEOUT = 5
+# Addresses per batch of ./manage.py discover_photos
+PHOTO_DISCOVERY_BATCH_SIZE = 50
+
+# Thumbnails on the profile page, see ThumbnailView
+THUMBNAIL_SIZE = 100
+THUMBNAIL_MAX_AGE = 86400
+
+# Uploaded exports wait here until the user chose what to import
+EXPORT_STAGING_DIR = os.environ.get(
+    'EXPORT_STAGING_DIR',
+    os.path.join(tempfile.gettempdir(), 'ivatar-exports'))
+EXPORT_STAGING_TIMEOUT = 3600
+
+# Outgoing mails are queued, see ./manage.py send_queued_mail
+MAIL_QUEUE_BATCH_SIZE = 50
+MAIL_QUEUE_MAX_ATTEMPTS = 8
+# Seconds before the first retry, doubled on every further attempt
+MAIL_QUEUE_RETRY_DELAY = 60
+
 if os.path.isfile(os.path.join(BASE_DIR, 'config_local.py')):
     from config_local import *  # noqa # flake8: noqa # NOQA # pragma: no cover
 
+# python-openid keeps its discovery state (objects) in the session, which
+# the JSON serializer can't handle
 SESSION_SERIALIZER = 'django.contrib.sessions.serializers.PickleSerializer'
 
 USE_X_FORWARDED_HOST = True
@@ -0,0 +1,127 @@
+'''
+Two-tier cache backend
+
+TieredCache keeps an in-process LRU cache (Django's LocMemCache) in
+front of a shared cache, so hot entries are served without a network
+round-trip. Writes go to both tiers, but other processes only notice
+them once their local copy expired, after at most LOCAL_TIMEOUT
+seconds; hence it's only used for data which is immutable (eg. renders
+keyed by photo and modification time) or may be stale for that long.
+
+Configured in CACHES like:
+
+    'renders': {
+        'BACKEND': 'ivatar.cache.TieredCache',
+        'LOCATION': 'renders_shared',  # alias of the shared cache
+        'OPTIONS': {'MAX_ENTRIES': 5000, 'LOCAL_TIMEOUT': 60},
+    }
+'''
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+DEFAULT_LOCAL_TIMEOUT = 60
+
+
+class TieredCache(BaseCache):
+    '''
+    Cache backend with a local LRU tier in front of a shared cache
+    '''
+
+    def __init__(self, location, params):
+        options = dict(params.get('OPTIONS', {}))
+        self.local_timeout = options.pop(
+            'LOCAL_TIMEOUT', DEFAULT_LOCAL_TIMEOUT)
+        super().__init__(dict(params, OPTIONS=options))
+        self.shared_alias = location
+        self.local = LocMemCache('tiered:' + location, dict(
+            params, TIMEOUT=self.local_timeout, OPTIONS=options))
+
+    @property
+    def shared(self):
+        '''
+        The shared tier; caches[] hands out one instance per thread
+        '''
+        return caches[self.shared_alias]
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self.shared.add(key, value, timeout, version):
+            return False
+        self.local.set(key, value, self._local_timeout(timeout), version)
+        return True
+
+    def get(self, key, default=None, version=None):
+        value = self.local.get(key, self, version)
+        if value is not self:
+            return value
+        value = self.shared.get(key, self, version)
+        if value is self:
+            return default
+        self.local.set(key, value, version=version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = self.local.get_many(keys, version)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            shared = self.shared.get_many(missing, version)
+            self.local.set_many(shared, version=version)
+            found.update(shared)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        self.local.set(key, value, self._local_timeout(timeout), version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        self.local.set_many(
+            {key: value for (key, value) in data.items() if key not in failed},
+            self._local_timeout(timeout), version)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.touch(key, self._local_timeout(timeout), version)
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.local.delete(key, version)
+        self.shared.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        self.local.delete_many(keys, version)
+        self.shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self.local.has_key(key, version) or \
+            self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version)
+        self.local.delete(key, version)
+        return value
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+
+class CacheProxy:  # pylint: disable=too-few-public-methods
+    '''
+    Proxy to the cache of an alias, like django.core.cache.cache is for
+    the default one; usable at import time and from any thread
+    '''
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __getattr__(self, name):
+        return getattr(caches[self.alias], name)
@@ -5,7 +5,8 @@ Default: useful variables for the base page templates.
 from ipware import get_client_ip
 from ivatar.settings import IVATAR_VERSION, SITE_NAME, MAX_PHOTO_SIZE
 from ivatar.settings import BASE_URL, SECURE_BASE_URL
-from ivatar.settings import MAX_NUM_UNCONFIRMED_EMAILS
+from ivatar.settings import MAX_NUM_UNCONFIRMED_EMAILS, MAX_NUM_PHOTOS
+from ivatar.ivataraccount.models import UserSummary
 
 
 def basepage(request):
@@ -26,10 +27,14 @@ def basepage(request):
     context['BASE_URL'] = BASE_URL
     context['SECURE_BASE_URL'] = SECURE_BASE_URL
     context['max_emails'] = False
+    context['max_photos'] = False
     if request.user:
         if not request.user.is_anonymous:
-            unconfirmed = request.user.unconfirmedemail_set.count()
-            if unconfirmed >= MAX_NUM_UNCONFIRMED_EMAILS:
+            summary = UserSummary.for_user(request.user)
+            context['user_summary'] = summary
+            if summary['unconfirmed_emails'] >= MAX_NUM_UNCONFIRMED_EMAILS:
                 context['max_emails'] = True
+            if summary['photos'] >= MAX_NUM_PHOTOS:
+                context['max_photos'] = True
 
     return context
@@ -0,0 +1,102 @@
+'''
+Routing of the avatar lookups to read replicas
+
+Every database besides "default" in DATABASES is a read replica (see
+DATABASE_REPLICAS in config.py). Only code running inside
+replica_reads() reads from them, which are the digest to photo lookups
+and blob reads of the avatar views; everything else, in particular the
+account pages, keeps using the primary and always sees its own writes.
+
+As replicas lag behind, a client that just changed something (any
+unsafe request) gets a cookie from ReplicaPinningMiddleware, keeping its
+avatar requests on the primary for REPLICA_PIN_SECONDS. That way users
+see their new photo right away.
+'''
+import random
+import threading
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS
+
+from ivatar.settings import DATABASES, REPLICA_PIN_SECONDS
+
+PIN_COOKIE = 'ivatar_pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+REPLICAS = [alias for alias in DATABASES if alias != DEFAULT_DB_ALIAS]
+
+_state = threading.local()  # pylint: disable=invalid-name
+
+
+@contextmanager
+def replica_reads(request=None):
+    '''
+    Send the reads inside the block to a replica, unless the client of
+    the request is pinned to the primary
+    '''
+    previous = getattr(_state, 'replica', None)
+    if REPLICAS and not (request and PIN_COOKIE in request.COOKIES):
+        _state.replica = random.choice(REPLICAS)
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+class ReplicaRouter:
+    '''
+    Database router reading from a replica inside replica_reads(), from
+    the primary otherwise, and always writing to the primary
+    '''
+
+    def db_for_read(self, model, **hints):  # pylint: disable=no-self-use,unused-argument
+        '''
+        The replica chosen by replica_reads(), the primary otherwise
+        '''
+        return getattr(_state, 'replica', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Writes go to the primary, even for objects read from a replica
+        '''
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):  # pylint: disable=no-self-use,unused-argument
+        '''
+        All databases hold the same data
+        '''
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Replicas get their schema from the primary
+        '''
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinningMiddleware:  # pylint: disable=too-few-public-methods
+    '''
+    Middleware pinning clients to the primary after unsafe requests
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if REPLICAS and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=REPLICA_PIN_SECONDS, httponly=True)
+        return response
+
+
+class ReplicaReadMixin:  # pylint: disable=too-few-public-methods
+    '''
+    View mixin running the whole request inside replica_reads()
+    '''
+
+    def dispatch(self, request, *args, **kwargs):
+        '''
+        Dispatch inside replica_reads()
+        '''
+        with replica_reads(request):
+            return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,133 @@
+'''
+Normalisation and digests of e-mail addresses and OpenIDs
+
+The single place defining how identities are hashed, shared by the
+models, the importers and the tools. The batch_*() helpers hash many
+identities at once, every distinct one only once; there is no cache
+beyond a call, as the identities come from the users.
+'''
+import hashlib
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+DIGEST_RE = re.compile(r'[0-9a-f]{32}|[0-9a-f]{64}')
+
+
+def normalize_email(email):
+    '''
+    Return the normalised (stripped, lower case) address
+    '''
+    return email.strip().lower()
+
+
+def normalize_openid(openid):
+    '''
+    Return the normalised OpenID, with lower case scheme and host name
+    '''
+    url = urlsplit(openid.strip())
+    if url.username and url.hostname:
+        password = url.password or ''
+        netloc = url.username + ':' + password + '@' + url.hostname
+    else:
+        netloc = url.hostname or ''
+    return urlunsplit(
+        (url.scheme.lower(), netloc, url.path, url.query, url.fragment))
+
+
+def email_domain(email):
+    '''
+    Return the (normalised) domain of the address
+    '''
+    return normalize_email(email).split('@')[-1]
+
+
+def openid_domain(openid):
+    '''
+    Return the host name of the OpenID
+    '''
+    return urlsplit(openid.strip()).hostname or ''
+
+
+def _hash_email(value):
+    '''
+    Helper returning the (MD5, SHA256) digests of a normalised address
+    '''
+    value = value.encode('utf-8')
+    return (hashlib.md5(value).hexdigest(), hashlib.sha256(value).hexdigest())
+
+
+def _hash_openid(value):
+    '''
+    Helper returning the SHA256 digest of a normalised OpenID
+    '''
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def email_digests(email):
+    '''
+    Return the (MD5, SHA256) digests of the address
+    '''
+    return _hash_email(normalize_email(email))
+
+
+def openid_digest(openid):
+    '''
+    Return the SHA256 digest of the OpenID
+    '''
+    return _hash_openid(normalize_openid(openid))
+
+
+def _batch(values, normalize, digest):
+    '''
+    Helper returning {value: digest of the normalised value}
+    '''
+    digests = {}
+    result = {}
+    for value in values:
+        normalized = normalize(value)
+        if normalized not in digests:
+            digests[normalized] = digest(normalized)
+        result[value] = digests[normalized]
+    return result
+
+
+def batch_email_digests(emails):
+    '''
+    Return {address: (MD5, SHA256)} of the addresses, hashing addresses
+    which only differ before normalisation once
+    '''
+    return _batch(emails, normalize_email, _hash_email)
+
+
+def batch_openid_digests(openids):
+    '''
+    Return {OpenID: SHA256} of the OpenIDs, hashing OpenIDs which only
+    differ before normalisation once
+    '''
+    return _batch(openids, normalize_openid, _hash_openid)
+
+
+def split_digests(digests):
+    '''
+    Return the (MD5s, SHA256s) sets of the valid digests, in lower case
+    '''
+    md5s = set()
+    sha256s = set()
+    for digest in digests:
+        digest = digest.lower()
+        if DIGEST_RE.fullmatch(digest):
+            (md5s if len(digest) == 32 else sha256s).add(digest)
+    return (md5s, sha256s)
+
+
+def user_identity(email=None, openid=None):
+    '''
+    Return the (digest, domain) pair of the address, like
+    libravatar.parse_user_identity()
+    '''
+    if email:
+        return (email_digests(email)[0], email_domain(email))
+    if openid:
+        return (openid_digest(openid), openid_domain(openid))
+    return (None, None)
+
@@ -0,0 +1,332 @@
+'''
+Federated avatar lookup
+
+Domains can delegate their avatars to another server by publishing SRV
+records (_avatars._tcp for http, _avatars-sec._tcp for https). Without
+caching every lookup costs a DNS round-trip, so the SRV records (not the
+selected server - weighted selection has to happen per lookup) are kept
+in-process and in the shared Django cache for as long as their TTL says.
+Domains without records, and failed lookups, are cached for
+FEDERATION_NEGATIVE_TTL seconds.
+'''
+import hashlib
+import http.client
+import ipaddress
+import random
+import socket
+import ssl
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import DNS
+from libravatar import parse_options
+
+from ivatar.settings import BASE_URL, SECURE_BASE_URL, logger
+from ivatar.settings import FEDERATION_NEGATIVE_TTL, FEDERATION_MAX_TTL
+from ivatar.settings import FEDERATION_DNS_TIMEOUT, FEDERATION_PROBE_TIMEOUT
+from ivatar.cache import CacheProxy
+from ivatar.digests import user_identity
+from ivatar.metrics import count_cache
+
+SERVICES = {False: '_avatars._tcp', True: '_avatars-sec._tcp'}
+DEFAULT_PORTS = {False: 80, True: 443}
+CACHE_PREFIX = 'federation:'
+# Upper bound of domains kept in-process, the shared cache has no limit
+MAX_LOCAL_ENTRIES = 10000
+
+SRVRecord = namedtuple('SRVRecord', ['priority', 'weight', 'port', 'target'])
+
+
+def query_srv(name):
+    '''
+    Return (records, ttl) of the SRV records of the given name
+
+    Raises DNS.DNSError if the lookup fails.
+    '''
+    answer = DNS.DnsRequest(
+        name, qtype='SRV', timeout=FEDERATION_DNS_TIMEOUT).req()
+    if answer.header['status'] not in ('NOERROR', 'NXDOMAIN'):
+        raise DNS.DNSError('%s: %s' % (name, answer.header['status']))
+    records = []
+    ttl = None
+    for rr in answer.answers:  # pylint: disable=invalid-name
+        if rr['typename'] != 'SRV':
+            continue
+        records.append(SRVRecord(*rr['data']))
+        ttl = rr['ttl'] if ttl is None else min(ttl, rr['ttl'])
+    return (records, ttl)
+
+
+def select_server(records, https, rand=random):
+    '''
+    Pick a server as described in RFC 2782 and return it as host[:port]
+
+    The lowest priority wins, servers of the same priority are chosen
+    randomly in proportion to their weight. The port is only kept if it
+    isn't the default one of the scheme.
+    '''
+    if not records:
+        return None
+    priority = min(record.priority for record in records)
+    candidates = [record for record in records if record.priority == priority]
+    total = sum(record.weight for record in candidates)
+    if total:
+        choice = rand.randint(1, total)
+        for record in candidates:
+            choice -= record.weight
+            if choice <= 0:
+                break
+    else:
+        record = rand.choice(candidates)
+
+    return server_name(record, https)
+
+
+def server_name(record, https):
+    '''
+    Return host[:port] of the SRV record
+
+    A target of "." means the service is decidedly not available.
+    '''
+    target = record.target.rstrip('.')
+    if not target:
+        return None
+    if record.port != DEFAULT_PORTS[https]:
+        return '%s:%i' % (target, record.port)
+    return target
+
+
+class FederationResolver:
+    '''
+    Resolve the avatar server a domain delegates to, with caching
+    '''
+
+    def __init__(self, query=query_srv, shared_cache=CacheProxy('lookups'),
+                 clock=time.time):
+        self.query = query
+        self.shared_cache = shared_cache
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._local = {}
+
+    def records(self, domain, https):
+        '''
+        Return the SRV records of the domain, from the cache if possible
+        '''
+        name = '%s.%s' % (SERVICES[https], domain.lower())
+        now = self.clock()
+
+        with self._lock:
+            entry = self._local.get(name)
+        if not entry or entry[0] <= now:
+            entry = self.shared_cache.get(CACHE_PREFIX + name)
+            if entry and entry[0] > now:
+                self._store_local(name, entry)
+        if entry and entry[0] > now:
+            count_cache('federation', True)
+            return entry[1]
+        count_cache('federation', False)
+
+        try:
+            (records, ttl) = self.query(name)
+        except DNS.DNSError as exc:
+            logger.warning('SRV lookup of %s failed: %s', name, exc)
+            (records, ttl) = ([], None)
+        if not records or ttl is None:
+            ttl = FEDERATION_NEGATIVE_TTL
+        ttl = min(ttl, FEDERATION_MAX_TTL)
+
+        entry = (now + ttl, records)
+        self._store_local(name, entry)
+        if ttl > 0:
+            self.shared_cache.set(CACHE_PREFIX + name, entry, ttl)
+        return records
+
+    def _store_local(self, name, entry):
+        with self._lock:
+            if len(self._local) >= MAX_LOCAL_ENTRIES:
+                self._local.clear()
+            self._local[name] = entry
+
+    def server(self, domain, https=False):
+        '''
+        Return host[:port] of the delegated server or None
+        '''
+        if not domain:
+            return None
+        return select_server(self.records(domain, https), https)
+
+    def clear(self):
+        '''
+        Forget the in-process cache
+        '''
+        with self._lock:
+            self._local.clear()
+
+
+RESOLVER = FederationResolver()
+
+
+def federated_url(email=None, openid=None, https=False, default=None,
+                  size=None, base_url=None):
+    '''
+    Return the avatar URL of the given address, honouring delegation
+
+    Works like libravatar.libravatar_url(), but with cached lookups and
+    falling back to base_url (by default our own) for domains that do
+    not delegate.
+    '''
+    (avatar_hash, domain) = user_identity(email, openid)
+    if not avatar_hash:
+        return None
+    server = RESOLVER.server(domain, https)
+    if server:
+        base_url = '%s://%s/avatar/' % ('https' if https else 'http', server)
+    elif not base_url:
+        base_url = SECURE_BASE_URL if https else BASE_URL
+    return base_url + avatar_hash + parse_options(default, size)
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    '''
+    HTTP connection to an already vetted address of the host
+    '''
+
+    def __init__(self, host, address, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection(
+            (self.address, self.port), self.timeout)
+
+
+class PinnedHTTPSConnection(PinnedHTTPConnection):
+    '''
+    HTTPS connection to an already vetted address, verified against the host
+    '''
+    default_port = http.client.HTTPS_PORT
+
+    def connect(self):
+        super().connect()
+        self.sock = ssl.create_default_context().wrap_socket(
+            self.sock, server_hostname=self.host)
+
+
+def probe_server(url, address, timeout=FEDERATION_PROBE_TIMEOUT):
+    '''
+    Fetch the URL from the given address and return
+    (HTTP status, error, latency in ms)
+
+    The host name of the URL isn't resolved again, so it can't be made to
+    point elsewhere after the address was checked, and redirects are not
+    followed, as they could lead anywhere.
+    '''
+    parts = urlsplit(url)
+    connection_class = (PinnedHTTPSConnection if parts.scheme == 'https'
+                        else PinnedHTTPConnection)
+    start = time.perf_counter()
+    status = None
+    error = None
+    try:
+        connection = connection_class(
+            parts.hostname, address, port=parts.port, timeout=timeout)
+        try:
+            connection.request('GET', '%s?%s' % (parts.path, parts.query))
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        status = response.status
+        if 300 <= status < 400:
+            error = 'redirect to %s not followed' % response.getheader(
+                'Location')
+        elif status >= 400:
+            error = response.reason
+    except (OSError, ValueError, http.client.HTTPException) as exc:
+        error = str(exc)
+    return (status, error, (time.perf_counter() - start) * 1000)
+
+
+def public_address(host, port):
+    '''
+    Return an address of the host if it only resolves to public addresses
+
+    The targets of SRV records are chosen by whoever controls the domain,
+    so they must not get us to connect to private, loopback or link-local
+    addresses (ours or our network's). The address returned is the one to
+    connect to, resolving the host again could give another one.
+    '''
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError):
+        return None
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if getattr(address, 'ipv4_mapped', None):
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            return None
+    return infos[0][4][0] if infos else None
+
+
+def check_domain(domain, query=query_srv, probe=probe_server,
+                 resolve=public_address):
+    '''
+    Check the avatar delegation of a domain, bypassing the caches
+
+    Both SRV records are looked up in parallel, then every target found
+    is probed in parallel as well, so the check takes as long as the
+    slowest lookup plus the slowest probe. Targets which don't resolve to
+    public addresses only are not probed, the others are probed at the
+    address which was checked. Returns a list with one dict
+    per service.
+    '''
+    domain = domain.lower().rstrip('.')
+    # Any hash will do, the default image makes sure we get an answer
+    test_hash = hashlib.md5(('check@' + domain).encode('utf-8')).hexdigest()
+
+    def lookup(https):
+        start = time.perf_counter()
+        service = {
+            'name': '%s.%s' % (SERVICES[https], domain),
+            'https': https,
+            'records': [],
+            'ttl': None,
+            'error': None,
+        }
+        try:
+            (records, service['ttl']) = query(service['name'])
+        except DNS.DNSError as exc:
+            records = []
+            service['error'] = str(exc)
+        service['dns_ms'] = (time.perf_counter() - start) * 1000
+        for record in sorted(records):
+            server = server_name(record, https)
+            service['records'].append({
+                'priority': record.priority,
+                'weight': record.weight,
+                'port': record.port,
+                'target': record.target,
+                'url': server and '%s://%s/avatar/%s?s=80&d=mm' % (
+                    'https' if https else 'http', server, test_hash),
+            })
+        return service
+
+    def check(record):
+        address = resolve(record['target'].rstrip('.'), record['port'])
+        if not address:
+            return (None, 'not probed, no public address', None)
+        return probe(record['url'], address)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        services = list(executor.map(lookup, (False, True)))
+        records = [
+            record for service in services for record in service['records']
+            if record['url']]
+        for (record, result) in zip(records, executor.map(check, records)):
+            (record['status'], record['error'], record['latency_ms']) = result
+    return services
@@ -0,0 +1,35 @@
+'''
+Lazily loaded generators of the default avatars
+
+monsterid, pydenticon and especially robohash (with its image sets) are
+costly to import, but only needed for default=monsterid, identicon, retro
+and robohash. Hence they're imported on first use. With a pre-forking
+server loading the application in its master process (eg. gunicorn
+--preload), set PRELOAD_GENERATORS to import them there once, so all
+workers share them copy-on-write.
+'''
+from functools import lru_cache
+
+from django.utils.module_loading import import_string
+
+GENERATORS = {
+    'monsterid': 'monsterid.id.build_monster',
+    'identicon': 'pydenticon.Generator',
+    'robohash': 'robohash.Robohash',
+}
+
+
+@lru_cache(maxsize=None)
+def get_generator(name):
+    '''
+    Return the generator, importing it on first use
+    '''
+    return import_string(GENERATORS[name])
+
+
+def preload():
+    '''
+    Import all generators now
+    '''
+    for name in GENERATORS:
+        get_generator(name)
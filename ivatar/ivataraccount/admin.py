@@ -6,7 +6,7 @@ from django.contrib import admin
 from . models import Photo, ConfirmedEmail, UnconfirmedEmail
 from . models import ConfirmedOpenId, UnconfirmedOpenId
 from . models import OpenIDNonce, OpenIDAssociation
-from . models import UserPreference
+from . models import UserPreference, QueuedMail
 
 # Register models in admin
 admin.site.register(Photo)
@@ -17,3 +17,4 @@ admin.site.register(UnconfirmedOpenId)
 admin.site.register(UserPreference)
 admin.site.register(OpenIDNonce)
 admin.site.register(OpenIDAssociation)
+admin.site.register(QueuedMail)
@@ -0,0 +1,112 @@
+'''
+Server side staging of uploaded Libravatar exports
+
+The photos of an uploaded export are kept in EXPORT_STAGING_DIR until
+the user has chosen what to import, so they don't need to travel to the
+browser and back. Every upload gets a directory named after a random
+token, holding the photos and a manifest; it's removed once imported or
+after EXPORT_STAGING_TIMEOUT seconds. With several application servers,
+the directory needs to be shared.
+'''
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+
+from ivatar.settings import EXPORT_STAGING_DIR, EXPORT_STAGING_TIMEOUT
+
+MANIFEST = 'manifest.json'
+TOKEN_RE = re.compile(r'[A-Za-z0-9_-]{32,64}')
+PHOTO_ID_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def _path(token, *names):
+    '''
+    Helper method returning a path below the staging directory
+    '''
+    if not TOKEN_RE.fullmatch(token or ''):
+        raise KeyError(token)
+    return os.path.join(EXPORT_STAGING_DIR, token, *names)
+
+
+def stage(user, items):
+    '''
+    Stage the items yielded by iter_export() for the user, return the
+    token and the manifest
+    '''
+    cleanup()
+    token = secrets.token_urlsafe(32)
+    os.makedirs(_path(token), mode=0o700)
+    manifest = {
+        'user_id': user.pk,
+        'created': time.time(),
+        'emails': [],
+        'photos': [],
+    }
+    try:
+        for (kind, item) in items:
+            if kind == 'email':
+                manifest['emails'].append(item['email'])
+            elif kind == 'photo' and PHOTO_ID_RE.fullmatch(item['id'] or ''):
+                with open(_path(token, 'photo-' + item['id']), 'wb') as outfile:
+                    outfile.write(item['data'])
+                manifest['photos'].append({
+                    'id': item['id'], 'format': item['format']})
+        with open(_path(token, MANIFEST), 'w') as outfile:
+            json.dump(manifest, outfile)
+    except BaseException:
+        discard(token)
+        raise
+    return (token, manifest)
+
+
+def load(token, user):
+    '''
+    Return the manifest of the staged export, raise KeyError if it
+    doesn't exist, expired or belongs to somebody else
+    '''
+    try:
+        with open(_path(token, MANIFEST)) as infile:
+            manifest = json.load(infile)
+    except (OSError, ValueError):
+        raise KeyError(token)
+    if manifest['user_id'] != user.pk or \
+            manifest['created'] + EXPORT_STAGING_TIMEOUT < time.time():
+        raise KeyError(token)
+    return manifest
+
+
+def read_photo(token, user, photo_id):
+    '''
+    Return the data of a staged photo, raise KeyError if there is none
+    '''
+    manifest = load(token, user)
+    if photo_id not in [photo['id'] for photo in manifest['photos']]:
+        raise KeyError(photo_id)
+    with open(_path(token, 'photo-' + photo_id), 'rb') as infile:
+        return infile.read()
+
+
+def discard(token):
+    '''
+    Remove a staged export
+    '''
+    shutil.rmtree(_path(token), ignore_errors=True)
+
+
+def cleanup():
+    '''
+    Remove all expired staged exports
+    '''
+    if not os.path.isdir(EXPORT_STAGING_DIR):
+        os.makedirs(EXPORT_STAGING_DIR, mode=0o700, exist_ok=True)
+        return
+    expired = time.time() - EXPORT_STAGING_TIMEOUT
+    for token in os.listdir(EXPORT_STAGING_DIR):
+        try:
+            if os.path.getmtime(_path(token)) < expired:
+                discard(token)
+        except (KeyError, OSError):
+            continue
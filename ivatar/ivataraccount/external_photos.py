@@ -0,0 +1,66 @@
+'''
+Discovery of photos of an email address on other services
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from urllib.request import urlopen
+
+from libravatar import BASE_URL as LIBRAVATAR_BASE_URL
+
+from ivatar.federation import federated_url
+from ivatar.settings import AVATAR_MAX_SIZE, EXTERNAL_PHOTO_TIMEOUT
+from .gravatar import get_photo as get_gravatar_photo
+
+
+def get_libravatar_photo(email, timeout=EXTERNAL_PHOTO_TIMEOUT):
+    '''
+    Fetch photo from Libravatar (or the federated server of the domain),
+    given an email address
+    '''
+    libravatar_service_url = federated_url(
+        email=email,
+        default=404,
+        size=AVATAR_MAX_SIZE,
+        base_url=LIBRAVATAR_BASE_URL,
+    )
+    if not libravatar_service_url:
+        return False
+    try:
+        urlopen(libravatar_service_url, timeout=timeout)
+    except OSError as exc:
+        print('Exception caught during photo import: {}'.format(exc))
+        return False
+    return {
+        'service_url': libravatar_service_url,
+        'thumbnail_url': libravatar_service_url + '&s=80',
+        'image_url': libravatar_service_url + '&s=512',
+        'width': 80,
+        'height': 80,
+        'service_name': 'Libravatar',
+    }
+
+
+PROBES = (get_gravatar_photo, get_libravatar_photo)
+
+
+def discover_external_photos(email, timeout=EXTERNAL_PHOTO_TIMEOUT):
+    '''
+    Return the photos found on Gravatar and Libravatar, in this order
+
+    Both services are asked concurrently and share a deadline of timeout
+    seconds; whatever isn't answered by then is left out.
+    '''
+    deadline = time.monotonic() + timeout
+    executor = ThreadPoolExecutor(max_workers=len(PROBES))
+    try:
+        futures = [executor.submit(probe, email, timeout) for probe in PROBES]
+        wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    finally:
+        # Don't wait for late answers; the URL timeouts end them soon
+        executor.shutdown(wait=False)
+    photos = []
+    for future in futures:
+        if future.done() and not future.exception() and future.result():
+            photos.append(future.result())
+    return photos
@@ -13,7 +13,7 @@ from ivatar.settings import MIN_LENGTH_EMAIL, MAX_LENGTH_EMAIL
 from ivatar.settings import MIN_LENGTH_URL, MAX_LENGTH_URL
 from . models import UnconfirmedEmail, ConfirmedEmail, Photo
 from . models import UnconfirmedOpenId, ConfirmedOpenId
-from . models import UserPreference
+from . models import UserPreference, UserSummary
 
 
 MAX_NUM_UNCONFIRMED_EMAILS_DEFAULT = 5
@@ -42,7 +42,8 @@ class AddEmailForm(forms.Form):
         '''
         user = request.user
         # Enforce the maximum number of unconfirmed emails a user can have
-        num_unconfirmed = user.unconfirmedemail_set.count()
+        num_unconfirmed = UserSummary.for_user(
+            user, cached=False)['unconfirmed_emails']
 
         max_num_unconfirmed_emails = getattr(
             settings,
@@ -112,6 +113,8 @@ class UploadPhotoForm(forms.Form):
         photo.user = request.user
         photo.ip_address = get_client_ip(request)[0]
         photo.data = data.read()
+        # Drop the upload buffer, only the copy on the model is needed
+        data.close()
         photo.save()
         if not photo.pk:
             return None
@@ -3,29 +3,28 @@ Helper method to fetch Gravatar image
 '''
 from ssl import SSLError
 from urllib.request import urlopen, HTTPError, URLError
-import hashlib
 
+from .. digests import email_digests
 from .. settings import AVATAR_MAX_SIZE
 
 URL_TIMEOUT = 5  # in seconds
 
 
-def get_photo(email):
+def get_photo(email, timeout=URL_TIMEOUT):
     '''
     Fetch photo from Gravatar, given an email address
     '''
-    hash_object = hashlib.new('md5')
-    hash_object.update(email.lower().encode('utf-8'))
+    digest = email_digests(email)[0]
     thumbnail_url = 'https://secure.gravatar.com/avatar/' + \
-        hash_object.hexdigest() + '?s=%i&d=404' % AVATAR_MAX_SIZE
-    image_url = 'https://secure.gravatar.com/avatar/' + hash_object.hexdigest(
-        ) + '?s=512&d=404'
+        digest + '?s=%i&d=404' % AVATAR_MAX_SIZE
+    image_url = 'https://secure.gravatar.com/avatar/' + digest + \
+        '?s=512&d=404'
 
     # Will redirect to the public profile URL if it exists
-    service_url = 'http://www.gravatar.com/' + hash_object.hexdigest()
+    service_url = 'http://www.gravatar.com/' + digest
 
     try:
-        urlopen(image_url, timeout=URL_TIMEOUT)
+        urlopen(image_url, timeout=timeout)
     except HTTPError as exc:
         if exc.code != 404 and exc.code != 503:
             print(  # pragma: no cover
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:23
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def set_modified(apps, schema_editor):
+    '''
+    Existing photos have not been modified since they were added
+    '''
+    Photo = apps.get_model('ivataraccount', 'Photo')
+    Photo.objects.update(modified=F('add_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivataraccount', '0013_auto_20181203_1421'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(set_modified, migrations.RunPython.noop),
+    ]
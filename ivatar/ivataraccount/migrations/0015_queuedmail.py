@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivataraccount', '0014_photo_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('from_email', models.EmailField(max_length=254)),
+                ('recipient', models.EmailField(max_length=254)),
+                ('add_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('failed', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'queued mail',
+                'verbose_name_plural': 'queued mails',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='queuedmail',
+            index=models.Index(fields=['failed', 'next_attempt'], name='ivataraccou_failed_de130e_idx'),
+        ),
+    ]
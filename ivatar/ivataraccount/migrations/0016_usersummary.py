@@ -0,0 +1,57 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:37
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+SUMMARY_FIELDS = {
+    'Photo': 'photos',
+    'ConfirmedEmail': 'confirmed_emails',
+    'UnconfirmedEmail': 'unconfirmed_emails',
+    'ConfirmedOpenId': 'confirmed_openids',
+    'UnconfirmedOpenId': 'unconfirmed_openids',
+}
+
+
+def count_all(apps, schema_editor):
+    '''
+    Create the summaries of all existing users, one query per model
+    '''
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserSummary = apps.get_model('ivataraccount', 'UserSummary')
+    summaries = {
+        user_id: UserSummary(user_id=user_id)
+        for user_id in User.objects.values_list('pk', flat=True)}
+    for (model_name, field) in SUMMARY_FIELDS.items():
+        model = apps.get_model('ivataraccount', model_name)
+        for row in model.objects.values('user_id').annotate(count=Count('pk')):
+            setattr(summaries[row['user_id']], field, row['count'])
+    UserSummary.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ivataraccount', '0015_queuedmail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('photos', models.PositiveIntegerField(default=0)),
+                ('confirmed_emails', models.PositiveIntegerField(default=0)),
+                ('unconfirmed_emails', models.PositiveIntegerField(default=0)),
+                ('confirmed_openids', models.PositiveIntegerField(default=0)),
+                ('unconfirmed_openids', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'user summary',
+                'verbose_name_plural': 'user summaries',
+            },
+        ),
+        migrations.RunPython(count_all, migrations.RunPython.noop),
+    ]
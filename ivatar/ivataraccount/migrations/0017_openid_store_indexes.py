@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:39
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def prepare_rows(apps, schema_editor):
+    '''
+    Drop duplicate nonces, which would violate the new unique index, and
+    the existing associations, which were stored with their issue time as
+    lifetime; consumers simply associate again
+    '''
+    OpenIDNonce = apps.get_model('ivataraccount', 'OpenIDNonce')
+    OpenIDAssociation = apps.get_model('ivataraccount', 'OpenIDAssociation')
+    keep = OpenIDNonce.objects.values(
+        'server_url', 'timestamp', 'salt').annotate(
+            first=Min('pk')).values_list('first', flat=True)
+    OpenIDNonce.objects.exclude(pk__in=list(keep)).delete()
+    OpenIDAssociation.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivataraccount', '0016_usersummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openidassociation',
+            name='expires',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(prepare_rows, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='openidassociation',
+            name='handle',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='openidnonce',
+            name='timestamp',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='openidnonce',
+            unique_together={('server_url', 'timestamp', 'salt')},
+        ),
+    ]
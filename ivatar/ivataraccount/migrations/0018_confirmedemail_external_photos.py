@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ivataraccount', '0017_openid_store_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='confirmedemail',
+            name='external_photos',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='confirmedemail',
+            name='external_photos_pending',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+    ]
@@ -4,37 +4,50 @@ Our models for ivatar.ivataraccount
 
 import base64
 import hashlib
+import json
 import time
 from io import BytesIO
 from os import urandom
 from urllib.error import HTTPError, URLError
 from urllib.request import urlopen
-from urllib.parse import urlsplit, urlunsplit
 
 from PIL import Image
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db import models
+from django.core.cache import cache, caches
+from django.db import models, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
+from django.utils.module_loading import import_string
 from django.http import HttpResponseRedirect
 from django.urls import reverse_lazy, reverse
 from django.utils.translation import ugettext_lazy as _
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from openid.association import Association as OIDAssociation
 from openid.store import nonce as oidnonce
 from openid.store.interface import OpenIDStore
 
-from libravatar import libravatar_url
+from libravatar import BASE_URL as LIBRAVATAR_BASE_URL
 
+from ivatar.federation import federated_url
+from ivatar.digests import email_digests, normalize_openid, openid_digest
 from ivatar.settings import MAX_LENGTH_EMAIL, logger
 from ivatar.settings import MAX_PIXELS, AVATAR_MAX_SIZE, JPEG_QUALITY
 from ivatar.settings import MAX_LENGTH_URL
 from ivatar.settings import SECURE_BASE_URL, SITE_NAME, SERVER_EMAIL
+from ivatar.settings import USER_SUMMARY_TIMEOUT
+from ivatar.settings import OPENID_ASSOCIATION_CACHE_TIMEOUT
+from ivatar.settings import OPENID_STORE, OPENID_STORE_CACHE
 from .gravatar import get_photo as get_gravatar_photo
 
 
+def photo_etag(photo_id, modified):
+    '''
+    Helper method returning the ETag of a photo, without its data
+    '''
+    return '"%x-%x"' % (photo_id, int(modified.timestamp() * 1000000))
+
+
 def file_format(image_type):
     '''
     Helper method returning a 3 character long image type
@@ -116,6 +129,15 @@ class Photo(BaseAccountModel):
     data = models.BinaryField()
     format = models.CharField(max_length=3)
     access_count = models.BigIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(default=timezone.now, editable=False)
+
+    # The data object self.format was last detected from; as long as
+    # self.data is still the very same object, there's no need to decode
+    # it again with PIL on save()
+    _format_data = None
+    # The data object as loaded from the database, to bump self.modified
+    # only if the image actually changed
+    _db_data = None
 
     class Meta:  # pylint: disable=too-few-public-methods
         '''
@@ -124,6 +146,40 @@ class Photo(BaseAccountModel):
         verbose_name = _('photo')
         verbose_name_plural = _('photos')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        '''
+        Override from_db from parent, remembering the format of the
+        loaded data is known already
+        '''
+        instance = super().from_db(db, field_names, values)
+        # data may be deferred, don't trigger loading it
+        instance._format_data = instance.__dict__.get('data')  # pylint: disable=protected-access
+        instance._db_data = instance._format_data  # pylint: disable=protected-access
+        return instance
+
+    def set_image_data(self, data, img_format):
+        '''
+        Helper method to set data of which the format is already known
+        (eg. because we just encoded it), sparing the detection on save
+        '''
+        self.data = data
+        self.format = img_format
+        if img_format:
+            self._format_data = data
+
+    def data_changed(self, update_fields=None):
+        '''
+        Helper method telling if the format needs to be (re-)detected
+        on the next save
+        '''
+        if update_fields is not None and 'data' not in update_fields:
+            return False
+        # Deferred and never loaded - not going to be saved either
+        if 'data' not in self.__dict__:
+            return False
+        return not self.format or self.data is not self._format_data
+
     def import_image(self, service_name, email_address):
         '''
         Allow to import image from other (eg. Gravatar) service
@@ -136,7 +192,9 @@ class Photo(BaseAccountModel):
                 image_url = gravatar['image_url']
 
         if service_name == 'Libravatar':
-            image_url = libravatar_url(email_address, size=AVATAR_MAX_SIZE)
+            image_url = federated_url(
+                email_address, size=AVATAR_MAX_SIZE,
+                base_url=LIBRAVATAR_BASE_URL)
 
         if not image_url:
             return False  # pragma: no cover
@@ -161,11 +219,10 @@ class Photo(BaseAccountModel):
         except ValueError:  # pragma: no cover
             return False  # pragma: no cover
 
-        self.format = file_format(img.format)
-        if not self.format:
+        if not file_format(img.format):
             print('Unable to determine format: %s' % img)  # pragma: no cover
             return False  # pragma: no cover
-        self.data = data
+        self.set_image_data(data, file_format(img.format))
         super().save()
         return True
 
@@ -174,43 +231,59 @@ class Photo(BaseAccountModel):
         '''
         Override save from parent, taking care about the image
         '''
-        # Use PIL to read the file format
-        try:
-            img = Image.open(BytesIO(self.data))
-        # Testing? Ideas anyone?
-        except Exception as exc:  # pylint: disable=broad-except
-            # For debugging only
-            print('Exception caught: %s' % exc)
-            return False
-        self.format = file_format(img.format)
-        if not self.format:
-            print('Format not recognized')
-            return False
-        return super().save(force_insert, force_update, using, update_fields)
+        if self.data_changed(update_fields):
+            # Use PIL to read the file format
+            try:
+                img = Image.open(BytesIO(self.data))
+            # Testing? Ideas anyone?
+            except Exception as exc:  # pylint: disable=broad-except
+                # For debugging only
+                print('Exception caught: %s' % exc)
+                return False
+            self.format = file_format(img.format)
+            if not self.format:
+                print('Format not recognized')
+                return False
+            self._format_data = self.data
+        if (update_fields is None or 'data' in update_fields) and \
+                'data' in self.__dict__ and self.data is not self._db_data:
+            self.modified = timezone.now()
+            if update_fields is not None:
+                update_fields = list(update_fields) + ['modified']
+        result = super().save(force_insert, force_update, using, update_fields)
+        self._db_data = self.__dict__.get('data')
+        return result
+
+    @property
+    def etag(self):
+        '''
+        Entity tag of the image data
+        '''
+        return photo_etag(self.pk, self.modified)
 
     def perform_crop(self, request, dimensions, email, openid):
         '''
         Helper to crop the image
         '''
-        if request.user.photo_set.count() == 1:
+        if UserSummary.for_user(request.user, cached=False)['photos'] == 1:
             # This is the first photo, assign to all confirmed addresses
             for addr in request.user.confirmedemail_set.all():
                 addr.photo = self
-                addr.save()
+                addr.save(update_fields=['photo'])
 
             for addr in request.user.confirmedopenid_set.all():
                 addr.photo = self
-                addr.save()
+                addr.save(update_fields=['photo'])
 
         if email:
             # Explicitly asked
             email.photo = self
-            email.save()
+            email.save(update_fields=['photo'])
 
         if openid:
             # Explicitly asked
             openid.photo = self
-            openid.save()
+            openid.save(update_fields=['photo'])
 
         # Do the real work cropping
         img = Image.open(BytesIO(self.data))
@@ -254,9 +327,10 @@ class Photo(BaseAccountModel):
         cropped.save(data, pil_format(self.format), quality=JPEG_QUALITY)
         data.seek(0)
 
-        # Overwrite the existing image
-        self.data = data.read()
-        self.save()
+        # Overwrite the existing image - we just encoded it, so the
+        # format is known already
+        self.set_image_data(data.read(), self.format)
+        self.save(update_fields=['data', 'format'])
 
         return HttpResponseRedirect(reverse_lazy('profile'))
 
@@ -273,21 +347,18 @@ class ConfirmedEmailManager(models.Manager):
     @staticmethod
     def create_confirmed_email(user, email_address, is_logged_in):
         '''
-        Helper method to create confirmed email address
+        Helper method to create confirmed email address, returns its id
+
+        If the user is logged in, photos of the address on other services
+        are looked up in the background (see the discover_photos command)
         '''
         confirmed = ConfirmedEmail()
         confirmed.user = user
         confirmed.ip_address = '0.0.0.0'
         confirmed.email = email_address
+        confirmed.external_photos_pending = is_logged_in
         confirmed.save()
-
-        external_photos = []
-        if is_logged_in:
-            gravatar = get_gravatar_photo(confirmed.email)
-            if gravatar:
-                external_photos.append(gravatar)
-
-        return (confirmed.pk, external_photos)
+        return confirmed.pk
 
 
 class ConfirmedEmail(BaseAccountModel):
@@ -307,6 +378,10 @@ class ConfirmedEmail(BaseAccountModel):
     digest_sha256 = models.CharField(max_length=64)
     objects = ConfirmedEmailManager()
     access_count = models.BigIntegerField(default=0, editable=False)
+    # Photos found on other services (JSON), see external_photo_list
+    external_photos = models.TextField(blank=True, default='', editable=False)
+    external_photos_pending = models.BooleanField(
+        default=False, db_index=True, editable=False)
 
     class Meta:  # pylint: disable=too-few-public-methods
         '''
@@ -315,24 +390,43 @@ class ConfirmedEmail(BaseAccountModel):
         verbose_name = _('confirmed email')
         verbose_name_plural = _('confirmed emails')
 
+    @property
+    def external_photo_list(self):
+        '''
+        The photos found on other services, as returned by
+        discover_external_photos()
+        '''
+        return json.loads(self.external_photos) if self.external_photos else []
+
+    def set_external_photos(self, photos):
+        '''
+        Helper method to store the photos found on other services
+        '''
+        self.external_photos = json.dumps(photos) if photos else ''
+        self.external_photos_pending = False
+        self.save(update_fields=['external_photos', 'external_photos_pending'])
+
     def set_photo(self, photo):
         '''
         Helper method to set photo
         '''
         self.photo = photo
-        self.save()
+        self.save(update_fields=['photo'])
+
+    def set_digest(self):
+        '''
+        Helper method to set the digests, eg. before bulk_create()
+        '''
+        (self.digest, self.digest_sha256) = email_digests(self.email)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         '''
-        Override save from parent, add digest
+        Override save from parent, add digest unless only other fields
+        (eg. the photo or access_count) are saved
         '''
-        self.digest = hashlib.md5(
-            self.email.strip().lower().encode('utf-8')
-        ).hexdigest()
-        self.digest_sha256 = hashlib.sha256(
-            self.email.strip().lower().encode('utf-8')
-        ).hexdigest()
+        if update_fields is None or 'email' in update_fields:
+            self.set_digest()
         return super().save(force_insert, force_update, using, update_fields)
 
     def __str__(self):
@@ -382,15 +476,53 @@ class UnconfirmedEmail(BaseAccountModel):
         })
         # if settings.DEBUG:
         #    print('DEBUG: %s' % link)
-        send_mail(
-            email_subject, email_body, SERVER_EMAIL,
-            [self.email])
+        QueuedMail.enqueue(email_subject, email_body, [self.email])
         return True
 
     def __str__(self):
         return '%s (%i) from %s' % (self.email, self.pk, self.user)
 
 
+class QueuedMail(models.Model):
+    '''
+    Model holding outgoing mails, until the send_queued_mail command
+    sent them
+    '''
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.EmailField(max_length=MAX_LENGTH_EMAIL)
+    recipient = models.EmailField(max_length=MAX_LENGTH_EMAIL)
+    add_date = models.DateTimeField(default=timezone.now)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    failed = models.BooleanField(default=False)
+
+    class Meta:  # pylint: disable=too-few-public-methods
+        '''
+        Meta class
+        '''
+        verbose_name = _('queued mail')
+        verbose_name_plural = _('queued mails')
+        indexes = [
+            models.Index(fields=['failed', 'next_attempt']),
+        ]
+
+    @classmethod
+    def enqueue(cls, subject, body, recipients, from_email=SERVER_EMAIL):
+        '''
+        Queue a mail to each of the recipients, return immediately
+        '''
+        return cls.objects.bulk_create([
+            cls(subject=str(subject), body=body, from_email=from_email,
+                recipient=recipient)
+            for recipient in recipients])
+
+    def __str__(self):
+        return '%s to %s (%i attempts)' % (
+            self.subject, self.recipient, self.attempts)
+
+
 class UnconfirmedOpenId(BaseAccountModel):
     '''
     Model holding unconfirmed OpenIDs
@@ -436,38 +568,174 @@ class ConfirmedOpenId(BaseAccountModel):
         Helper method to save photo
         '''
         self.photo = photo
-        self.save()
+        self.save(update_fields=['photo'])
+
+    def set_digest(self):
+        '''
+        Helper method to normalize the OpenID and set the digest, eg.
+        before bulk_create()
+        '''
+        self.digest = openid_digest(self.openid)
+        self.openid = normalize_openid(self.openid)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        url = urlsplit(self.openid)
-        if url.username:  # pragma: no cover
-            password = url.password or ''
-            netloc = url.username + ':' + password + '@' + url.hostname
-        else:
-            netloc = url.hostname
-        lowercase_url = urlunsplit(
-            (url.scheme.lower(), netloc, url.path, url.query, url.fragment)
-        )
-        #if lowercase_url[-1] != '/':
-        #    lowercase_url += '/'
-        self.openid = lowercase_url
-        self.digest = hashlib.sha256(lowercase_url.encode('utf-8')).hexdigest()
+        '''
+        Override save from parent, add digest unless only other fields
+        are saved
+        '''
+        if update_fields is None or 'openid' in update_fields:
+            self.set_digest()
         return super().save(force_insert, force_update, using, update_fields)
 
     def __str__(self):
         return '%s (%i) (%s)' % (self.openid, self.pk, self.user)
 
 
+class UserSummary(models.Model):
+    '''
+    Model holding the number of photos, addresses and OpenIDs of a user
+
+    Kept up to date on every create and delete (see the signal handlers
+    below), so that rendering a page doesn't need to count rows. Read it
+    with for_user(), which is cached if USER_SUMMARY_TIMEOUT is set.
+    '''
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='summary',
+        on_delete=models.deletion.CASCADE,
+    )
+    photos = models.PositiveIntegerField(default=0)
+    confirmed_emails = models.PositiveIntegerField(default=0)
+    unconfirmed_emails = models.PositiveIntegerField(default=0)
+    confirmed_openids = models.PositiveIntegerField(default=0)
+    unconfirmed_openids = models.PositiveIntegerField(default=0)
+
+    class Meta:  # pylint: disable=too-few-public-methods
+        '''
+        Meta class
+        '''
+        verbose_name = _('user summary')
+        verbose_name_plural = _('user summaries')
+
+    @staticmethod
+    def cache_key(user_id):
+        '''
+        Helper method returning the cache key of the summary
+        '''
+        return 'summary:%i' % user_id
+
+    @classmethod
+    def for_user(cls, user, cached=True):
+        '''
+        Return the counts of the user as dict, counting them if there is
+        no summary yet
+
+        Checks enforcing limits pass cached=False, to get the current
+        counts from the database.
+        '''
+        key = cls.cache_key(user.pk)
+        use_cache = cached and USER_SUMMARY_TIMEOUT
+        summary = cache.get(key) if use_cache else None
+        if summary is None:
+            try:
+                row = cls.objects.get(user_id=user.pk)
+            except cls.DoesNotExist:  # pylint: disable=no-member
+                row = cls.recount(user.pk)
+            summary = {
+                field: getattr(row, field)
+                for field in SUMMARY_FIELDS.values()}
+            if use_cache:
+                cache.set(key, summary, USER_SUMMARY_TIMEOUT)
+        return summary
+
+    @classmethod
+    def recount(cls, user_id):
+        '''
+        Count everything from scratch, eg. after bulk_create()
+        '''
+        counts = {
+            field: model.objects.filter(user_id=user_id).count()
+            for (model, field) in SUMMARY_FIELDS.items()}
+        try:
+            with transaction.atomic():
+                (row, _) = cls.objects.update_or_create(
+                    user_id=user_id, defaults=counts)
+        except IntegrityError:
+            # Created concurrently
+            row = cls.objects.get(user_id=user_id)
+        cls.invalidate(user_id)
+        return row
+
+    @classmethod
+    def change(cls, user_id, field, delta):
+        '''
+        Atomically add delta to one of the counts
+        '''
+        # No summary yet (or the user is being deleted): counted on use
+        cls.objects.filter(user_id=user_id).update(
+            **{field: models.F(field) + delta})
+        cls.invalidate(user_id)
+
+    @classmethod
+    def invalidate(cls, user_id):
+        '''
+        Drop the cached summary, now and once the transaction committed
+        '''
+        key = cls.cache_key(user_id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def __str__(self):
+        return 'Summary of %s' % self.user_id
+
+
+SUMMARY_FIELDS = {
+    Photo: 'photos',
+    ConfirmedEmail: 'confirmed_emails',
+    UnconfirmedEmail: 'unconfirmed_emails',
+    ConfirmedOpenId: 'confirmed_openids',
+    UnconfirmedOpenId: 'unconfirmed_openids',
+}
+
+
+def count_created(sender, instance, created, raw=False, **kwargs):  # pylint: disable=unused-argument
+    '''
+    Signal handler counting new objects in the summary of their user
+    '''
+    if created and not raw:
+        UserSummary.change(instance.user_id, SUMMARY_FIELDS[sender], 1)
+
+
+def count_deleted(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    '''
+    Signal handler removing deleted objects from the summary of their user
+    '''
+    UserSummary.change(instance.user_id, SUMMARY_FIELDS[sender], -1)
+
+
+for summary_model in SUMMARY_FIELDS:
+    post_save.connect(count_created, sender=summary_model)
+    post_delete.connect(count_deleted, sender=summary_model)
+
+
 class OpenIDNonce(models.Model):
     '''
     Model holding OpenID Nonces
     See also: https://github.com/edx/django-openid-auth/
     '''
     server_url = models.CharField(max_length=255)
-    timestamp = models.IntegerField()
+    timestamp = models.IntegerField(db_index=True)
     salt = models.CharField(max_length=128)
 
+    class Meta:  # pylint: disable=too-few-public-methods
+        '''
+        Meta class
+        '''
+        # A nonce may only be used once; the database enforces it
+        unique_together = (('server_url', 'timestamp', 'salt'),)
+
     def __str__(self):
         return '%s (%i) (timestamp: %i)' % (
             self.server_url,
@@ -480,10 +748,12 @@ class OpenIDAssociation(models.Model):
     Model holding the relation/association about OpenIDs
     '''
     server_url = models.TextField(max_length=2047)
-    handle = models.CharField(max_length=255)
+    handle = models.CharField(max_length=255, db_index=True)
     secret = models.TextField(max_length=255)  # stored base64 encoded
     issued = models.IntegerField()
     lifetime = models.IntegerField()
+    # issued + lifetime, to expire associations with a single query
+    expires = models.IntegerField(db_index=True, default=0)
     assoc_type = models.TextField(max_length=64)
 
     def __str__(self):
@@ -498,105 +768,217 @@ class DjangoOpenIDStore(OpenIDStore):
     '''
     The Python openid library needs an OpenIDStore subclass to persist data
     related to OpenID authentications. This one uses our Django models.
+
+    The unexpired associations of a server are cached, so logins don't
+    need to query them every time; expired rows and nonces are removed
+    by the cleanup_openid command.
     '''
 
     @staticmethod
-    def storeAssociation(server_url, association):  # pragma: no cover
+    def _cache_key(server_url):
+        '''
+        Helper method returning the cache key of the associations of a
+        server (URLs may be too long or contain invalid characters)
+        '''
+        return 'openid_assoc:' + hashlib.sha256(
+            server_url.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _decode_secret(secret):
+        '''
+        Helper method decoding a stored secret; older rows hold the repr
+        of the base64 encoded bytes
+        '''
+        if secret.startswith("b'"):
+            secret = secret.split("b'")[1].split("'")[0].replace('\\n', '')
+        return base64.b64decode(secret)
+
+    def storeAssociation(self, server_url, association):
         '''
         Helper method to store associations
         '''
-        assoc = OpenIDAssociation(
+        OpenIDAssociation.objects.create(  # pylint: disable=no-member
             server_url=server_url,
             handle=association.handle,
-            secret=base64.encodebytes(association.secret),
+            secret=base64.b64encode(association.secret).decode('ascii'),
             issued=association.issued,
-            lifetime=association.issued,
+            lifetime=association.lifetime,
+            expires=association.issued + association.lifetime,
             assoc_type=association.assoc_type)
-        assoc.save()
+        cache.delete(self._cache_key(server_url))
 
-    def getAssociation(self, server_url, handle=None):  # pragma: no cover
+    def _associations(self, server_url):
         '''
-        Helper method to get associations
+        Helper method returning the unexpired associations of the
+        server, as (handle, secret, issued, lifetime, assoc_type) tuples,
+        cached if OPENID_ASSOCIATION_CACHE_TIMEOUT is set
         '''
-        assocs = []
-        if handle is not None:
-            assocs = OpenIDAssociation.objects.filter(  # pylint: disable=no-member
+        key = self._cache_key(server_url)
+        assocs = cache.get(key) if OPENID_ASSOCIATION_CACHE_TIMEOUT else None
+        if assocs is None:
+            assocs = list(OpenIDAssociation.objects.filter(  # pylint: disable=no-member
                 server_url=server_url,
-                handle=handle)
-        else:
-            assocs = OpenIDAssociation.objects.filter(  # pylint: disable=no-member
-                server_url=server_url)
-        if not assocs:
-            return None
-        associations = []
-        for assoc in assocs:
-            if isinstance(assoc.secret, str):
-                assoc.secret = assoc.secret.split("b'")[1].split("'")[0]
-                assoc.secret = bytes(assoc.secret, 'utf-8')
-            association = OIDAssociation(assoc.handle,
-                                         base64.decodebytes(assoc.secret),
-                                         assoc.issued, assoc.lifetime,
-                                         assoc.assoc_type)
-            expires = 0
-            try:
-                # pylint: disable=no-member
-                expires = association.getExpiresIn()
-            except AttributeError:
-                expires = association.expiresIn
-            if expires == 0:
-                self.removeAssociation(server_url, assoc.handle)
-            else:
-                associations.append((association.issued, association))
-        if not associations:
-            return None
-        return associations[-1][1]
-
-    @staticmethod
-    def removeAssociation(server_url, handle):  # pragma: no cover
+                expires__gt=int(time.time())).order_by('issued').values_list(
+                    'handle', 'secret', 'issued', 'lifetime', 'assoc_type'))
+            if OPENID_ASSOCIATION_CACHE_TIMEOUT:
+                cache.set(key, assocs, OPENID_ASSOCIATION_CACHE_TIMEOUT)
+        return assocs
+
+    def getAssociation(self, server_url, handle=None):
+        '''
+        Helper method to get associations, the most recently issued one
+        if there's no handle given
+        '''
+        now = time.time()
+        for (assoc_handle, secret, issued, lifetime, assoc_type) in reversed(
+                self._associations(server_url)):
+            if handle is not None and assoc_handle != handle:
+                continue
+            if issued + lifetime <= now:
+                continue
+            return OIDAssociation(
+                assoc_handle, self._decode_secret(secret), issued, lifetime,
+                assoc_type)
+        return None
+
+    def removeAssociation(self, server_url, handle):
         '''
         Helper method to remove associations
         '''
-        assocs = list(
-            OpenIDAssociation.objects.filter(  # pylint: disable=no-member
-                server_url=server_url, handle=handle))
-        assocs_exist = len(assocs) > 0
-        for assoc in assocs:
-            assoc.delete()
-        return assocs_exist
+        (deleted, _) = OpenIDAssociation.objects.filter(  # pylint: disable=no-member
+            server_url=server_url, handle=handle).delete()
+        cache.delete(self._cache_key(server_url))
+        return deleted > 0
 
     @staticmethod
-    def useNonce(server_url, timestamp, salt):  # pragma: no cover
+    def useNonce(server_url, timestamp, salt):
         '''
-        Helper method to 'use' nonces
+        Helper method to 'use' nonces: a single insert, which fails if
+        the nonce has been used before
         '''
         # Has nonce expired?
         if abs(timestamp - time.time()) > oidnonce.SKEW:
             return False
         try:
-            nonce = OpenIDNonce.objects.get(  # pylint: disable=no-member
-                server_url__exact=server_url,
-                timestamp__exact=timestamp,
-                salt__exact=salt)
-        except ObjectDoesNotExist:
-            nonce = OpenIDNonce.objects.create(  # pylint: disable=no-member
-                server_url=server_url, timestamp=timestamp, salt=salt)
-            return True
-        nonce.delete()
-        return False
+            with transaction.atomic():
+                OpenIDNonce.objects.create(  # pylint: disable=no-member
+                    server_url=server_url, timestamp=timestamp, salt=salt)
+        except IntegrityError:
+            return False
+        return True
 
     @staticmethod
-    def cleanupNonces():  # pragma: no cover
+    def cleanupNonces():
         '''
-        Helper method to cleanup nonces
+        Helper method to cleanup nonces, returns the number removed
         '''
         timestamp = int(time.time()) - oidnonce.SKEW
         # pylint: disable=no-member
-        OpenIDNonce.objects.filter(timestamp__lt=timestamp).delete()
+        return OpenIDNonce.objects.filter(timestamp__lt=timestamp).delete()[0]
 
     @staticmethod
-    def cleanupAssociations():  # pragma: no cover
+    def cleanupAssociations():
+        '''
+        Helper method to cleanup associations, returns the number removed
+        '''
+        # Cached lists skip expired associations by themselves
+        return OpenIDAssociation.objects.filter(  # pylint: disable=no-member
+            expires__lte=int(time.time())).delete()[0]
+
+
+class CacheOpenIDStore(OpenIDStore):
+    '''
+    OpenIDStore keeping associations and nonces in the cache (see
+    OPENID_STORE_CACHE) instead of the database
+
+    Both expire by themselves, using the TTLs of the cache, and a nonce
+    is used with a single atomic add(). With several application servers,
+    the cache needs to be shared (eg. memcached or redis).
+    '''
+    prefix = 'openid_store:'
+
+    def __init__(self, cache_alias=None):
+        self.cache = caches[cache_alias or OPENID_STORE_CACHE]
+
+    def _key(self, kind, *parts):
+        '''
+        Helper method returning a cache key, hashing the URLs, handles
+        and salts, which may be too long or contain invalid characters
+        '''
+        return self.prefix + kind + ':' + hashlib.sha256(
+            '\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def storeAssociation(self, server_url, association):
         '''
-        Helper method to cleanup associations
+        Helper method to store associations, until they expire
         '''
-        OpenIDAssociation.objects.extra(  # pylint: disable=no-member
-            where=['issued + lifetimeint < (%s)' % time.time()]).delete()
+        timeout = association.expiresIn
+        if timeout <= 0:
+            return
+        self.cache.set_many({
+            self._key('assoc', server_url, association.handle): (
+                association.handle, association.secret, association.issued,
+                association.lifetime, association.assoc_type),
+            # getAssociation() without handle returns the latest one
+            self._key('latest', server_url): association.handle,
+        }, timeout)
+
+    def getAssociation(self, server_url, handle=None):
+        '''
+        Helper method to get associations, the most recently stored one
+        if there's no handle given
+        '''
+        if handle is None:
+            handle = self.cache.get(self._key('latest', server_url))
+            if handle is None:
+                return None
+        assoc = self.cache.get(self._key('assoc', server_url, handle))
+        if assoc is None:
+            return None
+        association = OIDAssociation(*assoc)
+        return association if association.expiresIn > 0 else None
+
+    def removeAssociation(self, server_url, handle):
+        '''
+        Helper method to remove associations
+        '''
+        key = self._key('assoc', server_url, handle)
+        existed = self.cache.get(key) is not None
+        self.cache.delete(key)
+        if self.cache.get(self._key('latest', server_url)) == handle:
+            self.cache.delete(self._key('latest', server_url))
+        return existed
+
+    def useNonce(self, server_url, timestamp, salt):
+        '''
+        Helper method to 'use' nonces: add() fails if the nonce has been
+        used before
+        '''
+        now = time.time()
+        if abs(timestamp - now) > oidnonce.SKEW:
+            return False
+        # Has to be remembered as long as the timestamp is accepted
+        timeout = int(timestamp + oidnonce.SKEW - now) + 1
+        return self.cache.add(
+            self._key('nonce', server_url, timestamp, salt), True, timeout)
+
+    @staticmethod
+    def cleanupNonces():
+        '''
+        Nonces expire by themselves
+        '''
+        return 0
+
+    @staticmethod
+    def cleanupAssociations():
+        '''
+        Associations expire by themselves
+        '''
+        return 0
+
+
+def get_openid_store():
+    '''
+    Return an instance of the OpenIDStore configured in OPENID_STORE
+    '''
+    return import_string(OPENID_STORE)()
@@ -5,80 +5,78 @@ Reading libravatar export
 import binascii
 from io import BytesIO
 import gzip
-import xml.etree.ElementTree
 import base64
+from defusedxml.ElementTree import iterparse
 from PIL import Image
 
 
 SCHEMAROOT = 'https://www.libravatar.org/schemas/export/0.2'
 
 
-def read_gzdata(gzdata=None):
+def _tag(name):
     '''
-    Read gzipped data file
+    Helper method returning the qualified name of an export element
     '''
-    emails = []  # pylint: disable=invalid-name
-    openids = []   # pylint: disable=invalid-name
-    photos = []   # pylint: disable=invalid-name
-    username = None  # pylint: disable=invalid-name
-    password = None  # pylint: disable=invalid-name
+    return '{%s}%s' % (SCHEMAROOT, name)
 
-    if not gzdata:
-        return False
 
-    fh = gzip.open(BytesIO(gzdata), 'rb')  # pylint: disable=invalid-name
-    content = fh.read()
-    fh.close()
-    root = xml.etree.ElementTree.fromstring(content)
-    if not root.tag == '{%s}user' % SCHEMAROOT:
-        print('Unknown export format: %s' % root.tag)
-        exit(-1)
+def iter_export(fileobj):
+    '''
+    Parse a gzipped export file object incrementally
 
-    # Username
-    for item in root.findall('{%s}account' % SCHEMAROOT)[0].items():
-        if item[0] == 'username':
-            username = item[1]
-        if item[0] == 'password':
-            password = item[1]
+    Yields ('account', {'username': ..., 'password': ...}),
+    ('email', {'email': ..., 'photo_id': ...}),
+    ('openid', {'openid': ..., 'photo_id': ...}) and
+    ('photo', {'id': ..., 'format': ..., 'data': <bytes>}) tuples, in the
+    order of the export. Only a single element is held in memory at any
+    time, photos that cannot be decoded are skipped. Raises ValueError if
+    this isn't an export.
+    '''
+    parents = []
+    with gzip.open(fileobj, 'rb') as infile:
+        for (event, elem) in iterparse(infile, events=('start', 'end')):
+            if event == 'start':
+                if not parents and elem.tag != _tag('user'):
+                    raise ValueError('Unknown export format: %s' % elem.tag)
+                if elem.tag == _tag('account'):
+                    yield ('account', {
+                        'username': elem.get('username'),
+                        'password': elem.get('password'),
+                    })
+                parents.append(elem)
+                continue
 
-    # Emails
-    for email in root.findall('{%s}emails' % SCHEMAROOT)[0]:
-        if email.tag == '{%s}email' % SCHEMAROOT:
-            emails.append({'email': email.text, 'photo_id': email.attrib['photo_id']})
+            parents.pop()
+            if elem.tag == _tag('email'):
+                yield ('email', {
+                    'email': elem.text, 'photo_id': elem.get('photo_id')})
+            elif elem.tag == _tag('openid'):
+                yield ('openid', {
+                    'openid': elem.text, 'photo_id': elem.get('photo_id')})
+            elif elem.tag == _tag('photo'):
+                photo = _read_photo(elem)
+                if photo:
+                    yield ('photo', photo)
+            # Done with it - drop the element, including its (base64) text
+            if parents:
+                parents[-1].remove(elem)
 
-    # OpenIDs
-    for openid in root.findall('{%s}openids' % SCHEMAROOT)[0]:
-        if openid.tag == '{%s}openid' % SCHEMAROOT:
-            openids.append({'openid': openid.text, 'photo_id': openid.attrib['photo_id']})
-
-    # Photos
-    for photo in root.findall('{%s}photos' % SCHEMAROOT)[0]:
-        if photo.tag == '{%s}photo' % SCHEMAROOT:
-            try:
-                data = base64.decodebytes(bytes(photo.text, 'utf-8'))
-            except binascii.Error as exc:
-                print('Cannot decode photo; Encoding: %s, Format: %s, Id: %s: %s' % (
-                    photo.attrib['encoding'], photo.attrib['format'], photo.attrib['id'], exc))
-                continue
-            try:
-                Image.open(BytesIO(data))
-            except Exception as exc:  # pylint: disable=broad-except
-                print('Cannot decode photo; Encoding: %s, Format: %s, Id: %s: %s' % (
-                    photo.attrib['encoding'], photo.attrib['format'], photo.attrib['id'], exc))
-                continue
-            else:
-                # If it is a working image, we can use it
-                photo.text.replace('\n', '')
-                photos.append({
-                    'data': photo.text,
-                    'format': photo.attrib['format'],
-                    'id': photo.attrib['id'],
-                })
 
+def _read_photo(elem):
+    '''
+    Return the decoded photo of the element, None if it's unusable
+    '''
+    try:
+        data = base64.decodebytes(bytes(elem.text or '', 'utf-8'))
+        # Lazy, only parses the header
+        Image.open(BytesIO(data))
+    except (binascii.Error, OSError) as exc:
+        print('Cannot decode photo; Encoding: %s, Format: %s, Id: %s: %s' % (
+            elem.get('encoding'), elem.get('format'), elem.get('id'), exc))
+        return None
     return {
-        'emails': emails,
-        'openids': openids,
-        'photos': photos,
-        'username': username,
-        'password': password,
+        'data': data,
+        'format': elem.get('format'),
+        'id': elem.get('id'),
     }
+
@@ -0,0 +1,161 @@
+'''
+Test our OpenID store in ivatar.ivataraccount.models
+'''
+import os
+import time
+from io import StringIO
+from unittest import mock
+import django
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from openid.association import Association
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from ivatar.ivataraccount.models import DjangoOpenIDStore, CacheOpenIDStore
+from ivatar.ivataraccount.models import get_openid_store
+from ivatar.ivataraccount.models import OpenIDAssociation, OpenIDNonce
+# pylint: enable=wrong-import-position
+
+SERVER_URL = 'https://openid.example.org/server'
+
+
+class Tester(TestCase):
+    '''
+    Main test class
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.store = DjangoOpenIDStore()
+
+    def test_nonce(self):
+        '''
+        A nonce can only be used once, and only within the skew
+        '''
+        now = int(time.time())
+        self.assertTrue(self.store.useNonce(SERVER_URL, now, 'salt'))
+        self.assertFalse(self.store.useNonce(SERVER_URL, now, 'salt'))
+        self.assertFalse(self.store.useNonce(SERVER_URL, now, 'salt'))
+        self.assertTrue(self.store.useNonce(SERVER_URL, now, 'pepper'))
+        self.assertFalse(self.store.useNonce(SERVER_URL, now - 86400, 'old'))
+
+    def test_association(self):
+        '''
+        Store, look up (cached with a shared cache) and remove associations
+        '''
+        now = int(time.time())
+        older = Association('old', b'secret', now - 10, 3600, 'HMAC-SHA1')
+        newer = Association('new', b'\x00\xff', now, 3600, 'HMAC-SHA256')
+        self.store.storeAssociation(SERVER_URL, older)
+        self.store.storeAssociation(SERVER_URL, newer)
+        self.assertEqual(self.store.getAssociation(SERVER_URL), newer)
+        # Without a shared cache other processes must see removals at once
+        with self.assertNumQueries(1):
+            self.assertEqual(self.store.getAssociation(SERVER_URL, 'old'), older)
+        with mock.patch(
+                'ivatar.ivataraccount.models.OPENID_ASSOCIATION_CACHE_TIMEOUT',
+                300):
+            self.assertEqual(self.store.getAssociation(SERVER_URL), newer)
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    self.store.getAssociation(SERVER_URL, 'old'), older)
+            self.assertIsNone(self.store.getAssociation(SERVER_URL, 'unknown'))
+
+            self.assertTrue(self.store.removeAssociation(SERVER_URL, 'new'))
+            self.assertFalse(self.store.removeAssociation(SERVER_URL, 'new'))
+            self.assertEqual(self.store.getAssociation(SERVER_URL), older)
+
+    def test_legacy_secret(self):
+        '''
+        Secrets stored by the previous store are still readable
+        '''
+        now = int(time.time())
+        OpenIDAssociation.objects.create(
+            server_url=SERVER_URL, handle='legacy', secret="b'c2VjcmV0\\n'",
+            issued=now, lifetime=3600, expires=now + 3600,
+            assoc_type='HMAC-SHA1')
+        self.assertEqual(
+            self.store.getAssociation(SERVER_URL).secret, b'secret')
+
+    def test_cleanup(self):
+        '''
+        Expired nonces and associations are removed in bulk
+        '''
+        now = int(time.time())
+        self.store.storeAssociation(
+            SERVER_URL, Association('gone', b'x', now - 7200, 3600, 'HMAC-SHA1'))
+        self.store.storeAssociation(
+            SERVER_URL, Association('kept', b'x', now, 3600, 'HMAC-SHA1'))
+        self.assertEqual(self.store.getAssociation(SERVER_URL).handle, 'kept')
+        self.assertIsNone(self.store.getAssociation(SERVER_URL, 'gone'))
+        OpenIDNonce.objects.create(
+            server_url=SERVER_URL, timestamp=now - 86400, salt='old')
+        self.store.useNonce(SERVER_URL, now, 'new')
+
+        call_command('cleanup_openid', stdout=StringIO())
+        self.assertEqual(
+            list(OpenIDAssociation.objects.values_list('handle', flat=True)),
+            ['kept'])
+        self.assertEqual(
+            list(OpenIDNonce.objects.values_list('salt', flat=True)), ['new'])
+
+
+class CacheStoreTester(TestCase):
+    '''
+    Test the cache-backed store
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.store = CacheOpenIDStore()
+
+    def test_nonce(self):
+        '''
+        A nonce can only be used once, and only within the skew
+        '''
+        now = int(time.time())
+        with self.assertNumQueries(0):
+            self.assertTrue(self.store.useNonce(SERVER_URL, now, 'salt'))
+            self.assertFalse(self.store.useNonce(SERVER_URL, now, 'salt'))
+            self.assertTrue(self.store.useNonce(SERVER_URL, now, 'pepper'))
+            self.assertFalse(
+                self.store.useNonce(SERVER_URL, now - 86400, 'old'))
+
+    def test_association(self):
+        '''
+        Store, look up and remove associations
+        '''
+        now = int(time.time())
+        older = Association('old', b'secret', now - 10, 3600, 'HMAC-SHA1')
+        newer = Association('new', b'\x00\xff', now, 3600, 'HMAC-SHA256')
+        with self.assertNumQueries(0):
+            self.store.storeAssociation(SERVER_URL, older)
+            self.store.storeAssociation(SERVER_URL, newer)
+            self.assertEqual(self.store.getAssociation(SERVER_URL), newer)
+            self.assertEqual(
+                self.store.getAssociation(SERVER_URL, 'old'), older)
+            self.assertIsNone(self.store.getAssociation(SERVER_URL, 'unknown'))
+
+            self.assertTrue(self.store.removeAssociation(SERVER_URL, 'new'))
+            self.assertFalse(self.store.removeAssociation(SERVER_URL, 'new'))
+            self.assertIsNone(self.store.getAssociation(SERVER_URL))
+            self.assertEqual(
+                self.store.getAssociation(SERVER_URL, 'old'), older)
+
+        expired = Association('expired', b'x', now - 7200, 3600, 'HMAC-SHA1')
+        self.store.storeAssociation(SERVER_URL, expired)
+        self.assertIsNone(self.store.getAssociation(SERVER_URL, 'expired'))
+
+    def test_setting(self):
+        '''
+        The store is selected by OPENID_STORE
+        '''
+        with mock.patch(
+                'ivatar.ivataraccount.models.OPENID_STORE',
+                'ivatar.ivataraccount.models.CacheOpenIDStore'):
+            self.assertIsInstance(get_openid_store(), CacheOpenIDStore)
+
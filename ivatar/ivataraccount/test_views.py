@@ -4,15 +4,26 @@ Test our views in ivatar.ivataraccount.views and ivatar.views
 # pylint: disable=too-many-lines
 from urllib.parse import urlsplit
 from io import BytesIO
+import base64
+import gzip
 import io
 import os
+import time
+from unittest import mock
 import django
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.cache import cache, caches
 from django.test import TestCase
 from django.test import Client
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 import hashlib
+import json
 
 from libravatar import libravatar_url
 
@@ -24,7 +35,12 @@ django.setup()
 # pylint: disable=wrong-import-position
 from ivatar import settings
 from ivatar.ivataraccount.forms import MAX_NUM_UNCONFIRMED_EMAILS_DEFAULT
-from ivatar.ivataraccount.models import Photo, ConfirmedOpenId
+from ivatar.ivataraccount.models import Photo, ConfirmedOpenId, QueuedMail
+from ivatar.ivataraccount.models import UserSummary
+from ivatar.ivataraccount import external_photos
+from ivatar.management.commands.send_queued_mail import send_queued
+from ivatar.management.commands.discover_photos import discover_pending
+from ivatar.management.commands.import_libravatar import import_items
 from ivatar.utils import random_string
 # pylint: enable=wrong-import-position
 
@@ -52,6 +68,9 @@ class Tester(TestCase):  # pylint: disable=too-many-public-methods
         Prepare for tests.
         - Create user
         '''
+        # User IDs get reused, don't keep summaries (or tiles) of earlier tests
+        for alias in settings.CACHES:
+            caches[alias].clear()
         self.user = User.objects.create_user(
             username=self.username,
             password=self.password,
@@ -154,6 +173,49 @@ class Tester(TestCase):  # pylint: disable=too-many-public-methods
             str(list(response.context[0]['messages'])[0]),
             'Address added successfully', 'unable to add mail address?')
 
+    def test_queued_confirmation_mail(self):
+        '''
+        Confirmation mails are queued, sent in batches and retried
+        '''
+        self.login()
+        self.client.post(reverse('add_email'), {'email': self.email})
+        self.assertEqual(len(mail.outbox), 0, 'mail sent synchronously?')
+        self.assertEqual(QueuedMail.objects.count(), 1, 'mail not queued?')
+
+        with override_settings(
+                EMAIL_BACKEND='ivatar.ivataraccount.test_views.FailingBackend'):
+            self.assertEqual(send_queued(), (0, 1))
+        queued = QueuedMail.objects.get()
+        self.assertEqual(queued.attempts, 1)
+        self.assertIn('unavailable', queued.last_error)
+        self.assertEqual(send_queued(), (0, 0), 'retried before backoff?')
+
+        QueuedMail.objects.update(next_attempt=queued.add_date)
+        self.assertEqual(send_queued(), (1, 0))
+        self.assertEqual(QueuedMail.objects.count(), 0, 'sent mail kept?')
+        self.assertEqual(mail.outbox[0].to, [self.email])
+        self.assertIn(
+            self.user.unconfirmedemail_set.first().verification_key,
+            mail.outbox[0].body)
+
+    def test_queued_mail_unreachable(self):
+        '''
+        All mails of the batch are rescheduled if the server is unreachable
+        '''
+        self.login()
+        self.client.post(reverse('add_email'), {'email': self.email})
+        self.client.post(reverse('add_email'), {'email': 'x' + self.email})
+        self.assertEqual(QueuedMail.objects.count(), 2)
+
+        with override_settings(
+                EMAIL_BACKEND='ivatar.ivataraccount.test_views.UnreachableBackend'):
+            self.assertEqual(send_queued(), (0, 2))
+        for queued in QueuedMail.objects.all():
+            self.assertEqual(queued.attempts, 1)
+            self.assertIn('refused', queued.last_error)
+            self.assertGreater(queued.next_attempt, queued.add_date)
+        self.assertEqual(send_queued(), (0, 0), 'retried before backoff?')
+
     def test_confirm_email(self):
         '''
         Confirm unconfirmed email
@@ -358,11 +420,132 @@ class Tester(TestCase):  # pylint: disable=too-many-public-methods
             'Content type wrong!?')
 
         self.assertEqual(
-            response.content,
+            response.getvalue(),
             self.user.photo_set.first().data,
             'raw_image should return the same content as if we\
             read it directly from the DB')
 
+    def test_raw_image_conditional_range(self):
+        '''
+        test conditional and range requests of the raw image view
+        '''
+        self.test_upload_image()
+        photo = self.user.photo_set.first()
+        url = reverse('raw_image', args=[photo.id])
+        response = self.client.get(url)
+        self.assertEqual(response['ETag'], photo.etag)
+        self.assertEqual(int(response['Content-Length']), len(photo.data))
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=photo.etag)
+        self.assertEqual(response.status_code, 304, 'ETag not honoured?')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.getvalue(), photo.data[10:20])
+        self.assertEqual(
+            response['Content-Range'], 'bytes 10-19/%i' % len(photo.data))
+        response = self.client.get(url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(response.getvalue(), photo.data[-4:])
+        response = self.client.get(
+            url, HTTP_RANGE='bytes=%i-' % len(photo.data))
+        self.assertEqual(response.status_code, 416)
+        # Outdated If-Range: the whole image
+        response = self.client.get(
+            url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), photo.data)
+
+    def test_profile_queries(self):
+        '''
+        The number of queries of the profile page must not depend on the
+        number of photos and addresses
+        '''
+        self.test_confirm_email()
+        self.test_upload_image()
+        email = self.user.confirmedemail_set.first()
+        email.photo = self.user.photo_set.first()
+        email.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('profile'))
+        few = len(queries)
+
+        for _ in range(3):
+            self.test_upload_image(test_only_one=False)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(len(queries), few, 'queries per photo?')
+        self.assertFalse(
+            [query for query in queries if '"data"' in query['sql']],
+            'image data loaded?')
+        self.assertContains(response, reverse('thumbnail', args=[email.photo.pk]))
+
+    def test_user_summary(self):
+        '''
+        The summary follows creates and deletes, and spares the counts
+        on every page
+        '''
+        self.login()
+        self.assertEqual(UserSummary.for_user(self.user)['photos'], 0)
+        self.test_upload_image(test_only_one=False)
+        self.test_upload_image(test_only_one=False)
+        self.assertEqual(UserSummary.for_user(self.user)['photos'], 2)
+        self.user.photo_set.first().delete()
+        self.assertEqual(UserSummary.for_user(self.user)['photos'], 1)
+        self.client.post(reverse('add_email'), {'email': self.email})
+        self.assertEqual(
+            UserSummary.for_user(self.user)['unconfirmed_emails'], 1)
+
+        self.client.get(reverse('profile'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'))
+        self.assertFalse(
+            [query for query in queries if 'COUNT(' in query['sql']],
+            'still counting?')
+        self.assertEqual(response.context['user_summary']['photos'], 1)
+
+        UserSummary.objects.all().delete()
+        cache.clear()
+        self.assertEqual(
+            UserSummary.for_user(self.user),
+            {'photos': 1, 'confirmed_emails': 0, 'unconfirmed_emails': 1,
+             'confirmed_openids': 0, 'unconfirmed_openids': 0},
+            'missing summary not recounted?')
+
+        with mock.patch(
+                'ivatar.ivataraccount.models.USER_SUMMARY_TIMEOUT', 3600):
+            UserSummary.for_user(self.user)
+            UserSummary.objects.filter(user=self.user).update(photos=5)
+            self.assertEqual(UserSummary.for_user(self.user)['photos'], 1)
+            self.assertEqual(
+                UserSummary.for_user(self.user, cached=False)['photos'], 5,
+                'limits checked against a cached summary?')
+
+    def test_thumbnail(self):
+        '''
+        Test the thumbnails of the profile page
+        '''
+        self.test_upload_image()
+        photo = self.user.photo_set.first()
+        url = reverse('thumbnail', args=[photo.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, 'cannot fetch thumbnail?')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertLessEqual(
+            max(Image.open(BytesIO(response.content)).size),
+            settings.THUMBNAIL_SIZE)
+
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304, 'ETag not honoured?')
+
+        self.client.logout()
+        User.objects.create_user(username='other', password=self.password)
+        self.client.login(username='other', password=self.password)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404, 'thumbnail of others?')
+
     def test_delete_photo(self):
         '''
         test deleting the photo
@@ -544,6 +727,31 @@ class Tester(TestCase):  # pylint: disable=too-many-public-methods
             'Image too big',
             'Uploading too big image, should return error message!')
 
+    def test_upload_too_large_dimensions(self):  # pylint: disable=invalid-name
+        '''
+        Test uploading image with dimensions that are too big
+        '''
+        self.login()
+        url = reverse('upload_photo')
+        image = Image.new('L', (settings.MAX_PIXELS+1, 1))
+        data = BytesIO()
+        image.save(data, 'PNG')
+        data.seek(0)
+        data.name = 'too_wide.png'
+        response = self.client.post(url, {
+            'photo': data,
+            'not_porn': True,
+            'can_distribute': True,
+        }, follow=True)
+        self.assertEqual(
+            str(list(response.context[0]['messages'])[0]),
+            'Image dimensions are too big (max: %s x %s)' % (
+                settings.MAX_PIXELS, settings.MAX_PIXELS),
+            'Uploading too large image, should return error message!')
+        self.assertEqual(
+            self.user.photo_set.count(), 0,
+            'there must be no photo now!')
+
     def test_upload_invalid_image(self):
         '''
         Test invalid image data
@@ -741,6 +949,92 @@ class Tester(TestCase):  # pylint: disable=too-many-public-methods
             'Import photo with inexisting mail id,\
             does not return error message?')
 
+    def test_import_photo_of_other_user(self):  # pylint: disable=invalid-name
+        '''
+        The import page must not look up addresses of others
+        '''
+        other = User.objects.create_user(username='other', password='x')
+        email = other.confirmedemail_set.create(email='other@example.org')
+        self.login()
+        response = self.client.get(
+            reverse('import_photo', args=[email.pk]), follow=True)
+        self.assertEqual(
+            str(list(response.context[0]['messages'])[0]),
+            'Address does not exist')
+
+    def test_external_photo_discovery(self):
+        '''
+        Gravatar and Libravatar are probed concurrently, with a deadline
+        '''
+        def fast(email, timeout):  # pylint: disable=unused-argument
+            return {'service_name': 'Fast'}
+
+        def slow(email, timeout):  # pylint: disable=unused-argument
+            time.sleep(timeout * 3)
+            return {'service_name': 'Slow'}
+
+        def failing(email, timeout):
+            raise OSError('unreachable')
+
+        with mock.patch.object(
+                external_photos, 'PROBES', (slow, fast, failing)):
+            start = time.monotonic()
+            photos = external_photos.discover_external_photos(
+                self.email, timeout=0.2)
+        self.assertLess(time.monotonic() - start, 0.5, 'deadline ignored?')
+        self.assertEqual(photos, [{'service_name': 'Fast'}])
+
+    def test_background_photo_discovery(self):
+        '''
+        Confirming doesn't wait for other services, the photos found
+        in the background are offered on the profile page
+        '''
+        photo = {
+            'service_name': 'Gravatar', 'thumbnail_url': '/thumbnail',
+            'image_url': '/image', 'service_url': '/service',
+            'width': 80, 'height': 80}
+
+        def probe(email, timeout):  # pylint: disable=unused-argument
+            return photo
+
+        def unexpected(email, timeout):
+            raise AssertionError('probed while confirming?')
+
+        with mock.patch.object(external_photos, 'PROBES', (unexpected,)):
+            self.test_confirm_email()
+        email = self.user.confirmedemail_set.get()
+        self.assertTrue(email.external_photos_pending)
+
+        with mock.patch.object(external_photos, 'PROBES', (probe,)):
+            self.assertEqual(discover_pending(), 1)
+            self.assertEqual(discover_pending(), 0)
+        email.refresh_from_db()
+        self.assertFalse(email.external_photos_pending)
+        self.assertEqual(email.external_photo_list, [photo])
+
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, reverse('import_photo', args=[email.pk]))
+        with mock.patch.object(external_photos, 'PROBES', (unexpected,)):
+            response = self.client.get(
+                reverse('import_photo', args=[email.pk]))
+        self.assertEqual(response.context['photos'], [photo])
+
+    def test_claimed_openid_checked_once(self):
+        '''
+        The single OpenID of a user gets confirmed on the profile page,
+        checking it once per session
+        '''
+        self.user.useropenid_set.create(
+            claimed_id=self.openid, display_id=self.openid)
+        self.login()
+        self.client.get(reverse('profile'))
+        self.assertEqual(self.user.confirmedopenid_set.count(), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('profile'))
+        self.assertFalse(
+            [query for query in queries if 'useropenid' in query['sql']],
+            'checked again?')
+
     def test_import_nothing(self):
         '''
         Test if importing nothing causes the correct
@@ -1069,6 +1363,16 @@ class Tester(TestCase):  # pylint: disable=too-many-public-methods
             size,
             'Why is this not the correct size?')
 
+    def test_avatar_access_count(self):
+        '''
+        Every served avatar is counted, for the address and the photo
+        '''
+        self.test_avatar_url_mail()
+        self.test_avatar_url_mail(do_upload_and_confirm=False)
+        confirmed = self.user.confirmedemail_set.first()
+        self.assertEqual(confirmed.access_count, 2)
+        self.assertEqual(confirmed.photo.access_count, 2)
+
     def test_avatar_url_openid(self):
         '''
         Test fetching avatar via openid
@@ -1313,3 +1617,284 @@ class Tester(TestCase):  # pylint: disable=too-many-public-methods
         self.test_avatar_url_mail(do_upload_and_confirm=False, size=(20, 20))
         img = Image.open(BytesIO(self.user.photo_set.first().data))
         self.assertEqual(img.size, (20, 20), 'cropped to 20x20, but resulting image isn\'t 20x20!?')
+
+    def test_avatar_bulk(self):
+        '''
+        Test looking up many digests at once
+        '''
+        self.test_upload_image()
+        self.test_confirm_email()
+        confirmed = self.user.confirmedemail_set.first()
+        missing = hashlib.md5(b'missing@example.org').hexdigest()
+        response = self.client.post(
+            reverse('avatar_bulk'),
+            json.dumps({'digests': [
+                confirmed.digest, confirmed.digest_sha256.upper(), missing,
+                'invalid']}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200, 'bulk lookup failed?')
+        result = response.json()
+        photo = self.user.photo_set.first()
+        self.assertEqual(result[confirmed.digest]['etag'], photo.etag)
+        self.assertTrue(result[confirmed.digest_sha256.upper()]['exists'])
+        self.assertIn('last_modified', result[confirmed.digest])
+        self.assertEqual(result[missing], {'exists': False})
+        self.assertIn('error', result['invalid'])
+
+        # The avatar itself can be revalidated with these values
+        url = reverse('avatar_view', args=[confirmed.digest])
+        response = self.client.get(url)
+        self.assertEqual(response['ETag'], result[confirmed.digest]['etag'])
+        self.assertEqual(
+            response['Last-Modified'],
+            result[confirmed.digest]['last_modified'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=photo.etag)
+        self.assertEqual(response.status_code, 304, 'not revalidated?')
+        self.assertFalse(
+            [query for query in queries if '"data"' in query['sql']],
+            'image data loaded for a revalidation?')
+
+        # The ETag has to change if the image does
+        etag = photo.etag
+        self.client.post(
+            reverse('crop_photo', args=[photo.pk]),
+            {'x': 10, 'y': 10, 'w': 20, 'h': 20})
+        self.assertNotEqual(self.user.photo_set.first().etag, etag)
+
+    def test_check_domain_login(self):
+        '''
+        Only logged in users may have us probe the servers of a domain
+        '''
+        response = self.client.get(reverse('tools_check_domain'))
+        self.assertEqual(response.status_code, 302, 'anonymous may check?')
+        self.login()
+        response = self.client.get(reverse('tools_check_domain'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_batch_limits(self):
+        '''
+        Batch requests are checked and limited per client
+        '''
+        for size in (0, -80, settings.AVATAR_MAX_SIZE + 1):
+            response = self.client.post(
+                reverse('tools_batch'), json.dumps({'emails': [], 'size': size}),
+                content_type='application/json')
+            self.assertEqual(response.status_code, 400, 'size %i?' % size)
+            self.assertIn('size', response.json()['error'])
+
+        with mock.patch('ivatar.tools.views.BATCH_RATE_LIMIT', 4):
+            response = self.client.post(
+                reverse('tools_batch'), json.dumps({'emails': [], 'size': 80}),
+                content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'[]')
+            response = self.client.post(
+                reverse('tools_batch'), json.dumps({'emails': []}),
+                content_type='application/json')
+            self.assertEqual(response.status_code, 429, 'not rate limited?')
+
+    def test_sprite(self):
+        '''
+        Test fetching many avatars composited into one image
+        '''
+        self.test_upload_image()
+        self.test_confirm_email()
+        confirmed = self.user.confirmedemail_set.first()
+        missing = hashlib.md5(b'missing@example.org').hexdigest()
+        digests = '%s,%s,%s' % (confirmed.digest, missing, confirmed.digest)
+        response = self.client.get(
+            reverse('sprite'), {'digests': digests, 's': 32, 'cols': 2})
+        self.assertEqual(response.status_code, 200, 'unable to fetch sprite?')
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (64, 64))
+
+        response = self.client.get(
+            reverse('sprite'),
+            {'digests': digests, 's': 32, 'cols': 2, 'format': 'json'})
+        tiles = response.json()['tiles']
+        self.assertEqual(
+            [(tile['x'], tile['y'], tile['exists']) for tile in tiles],
+            [(0, 0, True), (32, 0, False), (0, 32, True)])
+
+        response = self.client.get(reverse('sprite'), {'digests': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(
+            reverse('sprite'), {'digests': ','.join([missing] * 100), 's': 512})
+        self.assertEqual(response.status_code, 400, 'sprite size not capped?')
+
+    def test_sprite_cmyk(self):
+        '''
+        Photos in modes PNG doesn't support (eg. CMYK JPEGs) are converted
+        '''
+        data = BytesIO()
+        Image.new('CMYK', (64, 64)).save(data, 'JPEG')
+        photo = Photo(user=self.user, ip_address='127.0.0.1')
+        photo.set_image_data(data.getvalue(), 'jpg')
+        photo.save()
+        confirmed = self.user.confirmedemail_set.create(
+            email='cmyk@example.org', photo=photo)
+        response = self.client.get(
+            reverse('sprite'), {'digests': confirmed.digest, 's': 32})
+        self.assertEqual(response.status_code, 200, 'CMYK photo breaks sprite?')
+
+        self.login()
+        response = self.client.get(reverse('thumbnail', args=[photo.pk]))
+        self.assertEqual(
+            response.status_code, 200, 'CMYK photo breaks thumbnail?')
+
+    def test_sprite_missing_tile(self):
+        '''
+        Photos gone since the lookup, or broken, get the default image
+        '''
+        self.test_upload_image()
+        self.test_confirm_email()
+        confirmed = self.user.confirmedemail_set.first()
+        with mock.patch('ivatar.views.render_tiles', return_value={}):
+            response = self.client.get(
+                reverse('sprite'), {'digests': confirmed.digest, 's': 32})
+        self.assertEqual(response.status_code, 200, 'deleted photo breaks sprite?')
+
+        Photo.objects.filter(pk=confirmed.photo_id).update(data=b'broken')
+        response = self.client.get(
+            reverse('sprite'), {'digests': confirmed.digest, 's': 32})
+        self.assertEqual(response.status_code, 200, 'broken photo breaks sprite?')
+        response = self.client.get(
+            reverse('thumbnail', args=[confirmed.photo_id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_upload_libravatar_export(self):
+        '''
+        Test uploading a libravatar export
+        '''
+        self.login()
+        with open(os.path.join(settings.STATIC_ROOT, 'img', 'deadbeef.png'),
+                  'rb') as photo:
+            photodata = base64.b64encode(photo.read()).decode('ascii')
+        export = BytesIO()
+        with gzip.open(export, 'wb') as outfile:
+            outfile.write((
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<user xmlns="https://www.libravatar.org/schemas/export/0.2">'
+                '<account username="%s" password="x"/>'
+                '<emails><email photo_id="1">%s</email></emails>'
+                '<openids/>'
+                '<photos><photo id="1" encoding="base64" format="png">%s'
+                '</photo><photo id="2" encoding="base64" format="png">broken'
+                '</photo></photos></user>' % (
+                    self.username, self.email, photodata)).encode('utf-8'))
+        export.seek(0)
+        export.name = 'export.xml.gz'
+        response = self.client.post(reverse('upload_export'), {
+            'export_file': export,
+            'not_porn': True,
+            'can_distribute': True,
+        })
+        self.assertEqual(response.status_code, 200, 'upload failed?')
+        self.assertEqual(response.context['emails'], [self.email])
+        self.assertEqual(
+            response.context['photos'], [{'id': '1', 'format': 'png'}])
+        token = response.context['token']
+
+        response = self.client.get(
+            reverse('staged_export_photo', args=[token, '1']))
+        self.assertEqual(response.status_code, 200, 'thumbnail not served?')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        response = self.client.get(
+            reverse('staged_export_photo', args=[token, '2']))
+        self.assertEqual(response.status_code, 404, 'broken photo staged?')
+
+        photos = self.user.photo_set.count()
+        response = self.client.post(reverse('upload_export', args=['save']), {
+            'token': token,
+            'photo_1': '1',
+        })
+        self.assertEqual(response.status_code, 302, 'import failed?')
+        self.assertEqual(self.user.photo_set.count(), photos + 1)
+        self.assertEqual(
+            self.user.photo_set.last().data, base64.b64decode(photodata))
+        response = self.client.get(
+            reverse('staged_export_photo', args=[token, '1']))
+        self.assertEqual(response.status_code, 404, 'staging not removed?')
+
+        response = self.client.post(reverse('upload_export'), {
+            'export_file': BytesIO(b'no export'),
+            'not_porn': True,
+            'can_distribute': True,
+        })
+        self.assertTrue(response.context['form'].errors)
+
+    def test_import_items_counts(self):
+        '''
+        Addresses already confirmed by someone else are counted as skipped
+        '''
+        self.user.confirmedemail_set.create(email='taken@example.org')
+        counts = dict.fromkeys(
+            ('users', 'photos', 'emails', 'openids', 'skipped'), 0)
+        import_items([
+            ('account', {'username': 'imported', 'password': 'x'}),
+            ('email', {'email': 'taken@example.org', 'photo_id': None}),
+            ('email', {'email': 'new@example.org', 'photo_id': None}),
+        ], counts)
+        self.assertEqual(counts['emails'], 1)
+        self.assertEqual(counts['skipped'], 1)
+
+    def test_import_items_again(self):
+        '''
+        Importing an export again doesn't duplicate anything, OpenIDs of
+        someone else aren't linked to the imported user
+        '''
+        self.user.confirmedopenid_set.create(openid='http://taken.example.org/')
+        with open(os.path.join(settings.STATIC_ROOT, 'img', 'deadbeef.png'),
+                  'rb') as photo:
+            photodata = photo.read()
+        items = [
+            ('account', {'username': 'imported', 'password': 'x'}),
+            ('photo', {'id': 1, 'data': photodata}),
+            ('email', {'email': 'new@example.org', 'photo_id': 1}),
+            ('openid', {'openid': 'http://taken.example.org/', 'photo_id': 1}),
+            ('openid', {'openid': 'HTTP://New.example.org/', 'photo_id': 1}),
+        ]
+        for _ in range(2):
+            counts = dict.fromkeys(
+                ('users', 'photos', 'emails', 'openids', 'skipped'), 0)
+            import_items(items, counts)
+        self.assertEqual(
+            (counts['photos'], counts['emails'], counts['openids']), (0, 0, 0))
+        self.assertEqual(counts['skipped'], 4)
+
+        imported = User.objects.get(username='imported')
+        self.assertEqual(imported.photo_set.count(), 1)
+        self.assertEqual(
+            imported.confirmedemail_set.get().photo, imported.photo_set.get())
+        self.assertEqual(
+            list(imported.useropenid_set.values_list('claimed_id', flat=True)),
+            ['http://new.example.org/'])
+
+
+class FailingBackend(BaseEmailBackend):
+    '''
+    Mail backend unable to send anything
+    '''
+    def send_messages(self, email_messages):
+        '''
+        Fail
+        '''
+        raise ConnectionError('mail server unavailable')
+
+
+class UnreachableBackend(BaseEmailBackend):
+    '''
+    Mail backend unable to connect
+    '''
+    def open(self):
+        '''
+        Fail
+        '''
+        raise ConnectionRefusedError('connection refused')
+
+    def send_messages(self, email_messages):
+        '''
+        Never reached
+        '''
+        raise AssertionError('sending without a connection')
@@ -0,0 +1,101 @@
+'''
+Upload handlers for photo uploads
+'''
+from io import BytesIO
+
+from PIL import Image
+
+from django.core.files.uploadhandler import FileUploadHandler
+from django.core.files.uploadhandler import StopFutureHandlers, StopUpload
+from django.core.files.uploadedfile import InMemoryUploadedFile
+
+from ivatar.settings import MAX_PHOTO_SIZE, MAX_PIXELS
+
+# Only try to read the image header from the first bytes of the upload;
+# if the dimensions are not known by then, Photo.save() has the last word
+HEADER_PARSE_LIMIT = 262144  # in bytes
+
+
+class PhotoUploadHandler(FileUploadHandler):
+    '''
+    Stream a photo upload into memory, aborting as soon as the upload
+    exceeds MAX_PHOTO_SIZE bytes or the image header announces more than
+    MAX_PIXELS in either dimension - without decoding the image
+    '''
+    ERROR_SIZE = 'size'
+    ERROR_DIMENSIONS = 'dimensions'
+
+    def __init__(self, request=None, max_size=MAX_PHOTO_SIZE,
+                 max_pixels=MAX_PIXELS):
+        super().__init__(request)
+        self.max_size = max_size
+        self.max_pixels = max_pixels
+        self.file = None
+        self.error = None
+        self.dimensions = None
+
+    def new_file(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        '''
+        Start buffering a new file; we are the only handler for it
+        '''
+        super().new_file(*args, **kwargs)
+        self.file = BytesIO()
+        self.dimensions = None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        '''
+        Add the chunk to our buffer, enforcing the limits on the way
+        '''
+        if start + len(raw_data) > self.max_size:
+            self._reject(self.ERROR_SIZE)
+        self.file.write(raw_data)
+        if self.dimensions is None and start < HEADER_PARSE_LIMIT:
+            self._check_dimensions()
+
+    def file_complete(self, file_size):
+        '''
+        Return the buffered file
+        '''
+        self.file.seek(0)
+        return InMemoryUploadedFile(
+            file=self.file,
+            field_name=self.field_name,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra)
+
+    def _check_dimensions(self):
+        '''
+        Try to read the image size from what we received so far. Image.open()
+        is lazy and only parses the header, so this never allocates pixel data
+        '''
+        position = self.file.tell()
+        self.file.seek(0)
+        try:
+            img = Image.open(self.file)
+            self.dimensions = img.size
+        except Image.DecompressionBombError:
+            self.dimensions = (self.max_pixels + 1, self.max_pixels + 1)
+        # Not enough data (yet) or no image at all - the latter is
+        # reported by Photo.save()
+        except Exception:  # pylint: disable=broad-except
+            pass
+        finally:
+            self.file.seek(position)
+
+        if self.dimensions and (
+                self.dimensions[0] > self.max_pixels or
+                self.dimensions[1] > self.max_pixels):
+            self._reject(self.ERROR_DIMENSIONS)
+
+    def _reject(self, error):
+        '''
+        Drop what we have buffered and stop reading the upload
+        '''
+        self.error = error
+        # Django closes the files of all handlers after StopUpload
+        self.file.close()
+        raise StopUpload(connection_reset=False)
@@ -21,7 +21,8 @@ from . views import UploadPhotoView, AssignPhotoOpenIDView
 from . views import AddOpenIDView, RedirectOpenIDView, ConfirmOpenIDView
 from . views import CropPhotoView
 from . views import UserPreferenceView, UploadLibravatarExportView
-from . views import ResendConfirmationMailView
+from . views import ResendConfirmationMailView, StagedExportPhotoView
+from . views import ThumbnailView
 from . views import IvatarLoginView
 
 # Define URL patterns, self documenting
@@ -109,11 +110,14 @@ urlpatterns = [  # pylint: disable=invalid-name
         r'delete_photo/(?P<pk>\d+)',
         DeletePhotoView.as_view(), name='delete_photo'),
     url(r'raw_image/(?P<pk>\d+)', RawImageView.as_view(), name='raw_image'),
+    url(r'thumbnail/(?P<pk>\d+)', ThumbnailView.as_view(), name='thumbnail'),
     url(r'crop_photo/(?P<pk>\d+)', CropPhotoView.as_view(), name='crop_photo'),
     url(r'pref/$', UserPreferenceView.as_view(), name='user_preference'),
     url(r'upload_export/$', UploadLibravatarExportView.as_view(), name='upload_export'),
     url(r'upload_export/(?P<save>save)$',
         UploadLibravatarExportView.as_view(), name='upload_export'),
+    url(r'upload_export/(?P<token>[\w-]+)/(?P<photo_id>[\w-]+)$',
+        StagedExportPhotoView.as_view(), name='staged_export_photo'),
     url(r'resend_confirmation_mail/(?P<email_id>\d+)',
         ResendConfirmationMailView.as_view(), name='resend_confirmation_mail'),
 ]
@@ -2,17 +2,17 @@
 View classes for ivatar/ivataraccount/
 '''
 from io import BytesIO
-from urllib.request import urlopen
-import base64
-import binascii
+import re
+from xml.etree.ElementTree import ParseError
 
 from PIL import Image
 
-from django.db.models import ProtectedError
+from django.db.models import ProtectedError, Exists, OuterRef
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
 from django.views.generic.edit import FormView, UpdateView
@@ -23,9 +23,12 @@ from django.contrib.auth.forms import UserCreationForm, SetPasswordForm
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.views import PasswordResetView as PasswordResetViewOriginal
 from django.utils.translation import ugettext_lazy as _
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseNotFound
+from django.http import StreamingHttpResponse
 from django.urls import reverse_lazy, reverse
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django_openid_auth.models import UserOpenID
 
 from openid import oidutil
@@ -33,17 +36,25 @@ from openid.consumer import consumer
 
 from ipware import get_client_ip
 
-from libravatar import libravatar_url
-from ivatar.settings import MAX_NUM_PHOTOS, MAX_PHOTO_SIZE, JPEG_QUALITY, AVATAR_MAX_SIZE
-from .gravatar import get_photo as get_gravatar_photo
+from ivatar.tiles import render_tiles
+from ivatar.settings import MAX_NUM_PHOTOS, MAX_PHOTO_SIZE
+from ivatar.settings import THUMBNAIL_SIZE, THUMBNAIL_MAX_AGE
+from ivatar.settings import MAX_PIXELS
+from .external_photos import discover_external_photos
 
 from .forms import AddEmailForm, UploadPhotoForm, AddOpenIDForm
 from .forms import UpdatePreferenceForm, UploadLibravatarExportForm
 from .models import UnconfirmedEmail, ConfirmedEmail, Photo
-from .models import UnconfirmedOpenId, ConfirmedOpenId, DjangoOpenIDStore
-from .models import UserPreference
+from .models import UnconfirmedOpenId, ConfirmedOpenId, get_openid_store
+from .models import UserPreference, UserSummary
 from .models import file_format
-from . read_libravatar_export import read_gzdata as libravatar_read_gzdata
+from . read_libravatar_export import iter_export as libravatar_iter_export
+from . upload_handlers import PhotoUploadHandler
+from . import export_staging
+
+CLAIMED_OPENID_CHECKED = 'claimed_openid_checked'
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+RAW_IMAGE_CHUNK_SIZE = 64 * 1024
 
 
 def openid_logging(message, level=0):
@@ -168,20 +179,20 @@ class ConfirmEmailView(SuccessMessageMixin, TemplateView):
 
         # TODO: Check for a reasonable expiration time in unconfirmed email
 
-        (confirmed_id,
-         external_photos) = ConfirmedEmail.objects.create_confirmed_email(
-             unconfirmed.user, unconfirmed.email,
-             not request.user.is_anonymous)
+        confirmed_id = ConfirmedEmail.objects.create_confirmed_email(
+            unconfirmed.user, unconfirmed.email,
+            not request.user.is_anonymous)
 
         unconfirmed.delete()
 
         # if there's a single image in this user's profile,
         # assign it to the new email
         confirmed = ConfirmedEmail.objects.get(id=confirmed_id)
-        if confirmed.user.photo_set.count() == 1:
+        if UserSummary.for_user(
+                confirmed.user, cached=False)['photos'] == 1:
             confirmed.set_photo(confirmed.user.photo_set.first())
-        kwargs['photos'] = external_photos
         kwargs['email_id'] = confirmed_id
+        kwargs['discovering'] = confirmed.external_photos_pending
         return super().get(request, *args, **kwargs)
 
 
@@ -242,7 +253,7 @@ class AssignPhotoEmailView(SuccessMessageMixin, TemplateView):
                 messages.error(request, _('Photo does not exist'))
                 return HttpResponseRedirect(reverse_lazy('profile'))
             email.photo = photo
-        email.save()
+        email.save(update_fields=['photo'])
 
         messages.success(request, _('Successfully changed photo'))
         return HttpResponseRedirect(reverse_lazy('profile'))
@@ -286,7 +297,7 @@ class AssignPhotoOpenIDView(SuccessMessageMixin, TemplateView):
             return HttpResponseRedirect(reverse_lazy('profile'))
 
         openid.photo = photo
-        openid.save()
+        openid.save(update_fields=['photo'])
 
         messages.success(request, _('Successfully changed photo'))
         return HttpResponseRedirect(reverse_lazy('profile'))
@@ -308,42 +319,23 @@ class ImportPhotoView(SuccessMessageMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['photos'] = []
-        addr = None
+        addr = kwargs.get('email_addr', None)
         if 'email_id' in kwargs:
             try:
-                addr = ConfirmedEmail.objects.get(pk=kwargs['email_id']).email
-            except ConfirmedEmail.ObjectDoesNotExist:  # pylint: disable=no-member
+                confirmed = ConfirmedEmail.objects.get(
+                    pk=kwargs['email_id'], user=self.request.user)
+            except ConfirmedEmail.DoesNotExist:  # pylint: disable=no-member
                 messages.error(
                     self.request,
                     _('Address does not exist'))
                 return context
+            addr = confirmed.email
+            # Found in the background after the confirmation already
+            context['photos'] = confirmed.external_photo_list
 
-        addr = kwargs.get('email_addr', None)
-
-        if addr:
-            gravatar = get_gravatar_photo(addr)
-            if gravatar:
-                context['photos'].append(gravatar)
-
-            libravatar_service_url = libravatar_url(
-                email=addr,
-                default=404,
-                size=AVATAR_MAX_SIZE,
-            )
-            if libravatar_service_url:
-                try:
-                    urlopen(libravatar_service_url)
-                except OSError as exc:
-                    print('Exception caught during photo import: {}'.format(exc))
-                else:
-                    context['photos'].append({
-                        'service_url': libravatar_service_url,
-                        'thumbnail_url': libravatar_service_url + '&s=80',
-                        'image_url': libravatar_service_url + '&s=512',
-                        'width': 80,
-                        'height': 80,
-                        'service_name': 'Libravatar',
-                    })
+        if addr and not context['photos']:
+            # Gravatar and Libravatar are asked at the same time
+            context['photos'] = discover_external_photos(addr)
 
         return context
 
@@ -400,19 +392,115 @@ class ImportPhotoView(SuccessMessageMixin, TemplateView):
         return HttpResponseRedirect(reverse_lazy('profile'))
 
 
+def parse_range(header, length):
+    '''
+    Helper method returning the (start, end) byte positions (both
+    inclusive) of a single range Range header, None if it should be
+    ignored; raises ValueError if it cannot be satisfied
+    '''
+    match = RANGE_RE.fullmatch(header.strip())
+    if not match:
+        return None
+    (start, end) = match.groups()
+    if not start:
+        if not end or int(end) == 0:
+            raise ValueError(header)
+        return (max(length - int(end), 0), length - 1)
+    if int(start) >= length or (end and int(end) < int(start)):
+        raise ValueError(header)
+    return (int(start), min(int(end), length - 1) if end else length - 1)
+
+
 @method_decorator(login_required, name='dispatch')
 class RawImageView(DetailView):
     '''
     View to return (binary) raw image data, for use in <img/>-tags
+
+    Supports conditional and (single) range requests; the image data is
+    only fetched if it is actually sent, and then streamed from memory
+    without copying it as a whole.
     '''
     model = Photo
 
     def get(self, request, *args, **kwargs):
-        photo = self.model.objects.get(pk=kwargs['pk'])  # pylint: disable=no-member
-        if not photo.user.id == request.user.id:
+        photo = self.model.objects.filter(pk=kwargs['pk']).only(  # pylint: disable=no-member
+            'user_id', 'format', 'modified').first()
+        if not photo or photo.user_id != request.user.id:
             return HttpResponseRedirect(reverse_lazy('home'))
-        return HttpResponse(
-            BytesIO(photo.data), content_type='image/%s' % photo.format)
+
+        last_modified = photo.modified.timestamp()
+        response = get_conditional_response(
+            request, etag=photo.etag, last_modified=last_modified)
+        if response is None:
+            data = memoryview(self.model.objects.filter(pk=photo.pk).values_list(  # pylint: disable=no-member
+                'data', flat=True).get())
+            response = self.data_response(request, data, photo)
+        response['ETag'] = photo.etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        # The crop and profile pages reload the originals a lot; they may
+        # be kept, but need to be revalidated, as the URL doesn't change
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @staticmethod
+    def data_response(request, data, photo):
+        '''
+        Return the streamed data, or the requested range of it
+        '''
+        length = len(data)
+        status = 200
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and request.META.get(
+                'HTTP_IF_RANGE', photo.etag) == photo.etag:
+            try:
+                byte_range = parse_range(request.META['HTTP_RANGE'], length)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%i' % length
+                return response
+        if byte_range:
+            status = 206
+            data = data[byte_range[0]:byte_range[1] + 1]
+        response = StreamingHttpResponse(
+            (bytes(data[pos:pos + RAW_IMAGE_CHUNK_SIZE])
+             for pos in range(0, len(data), RAW_IMAGE_CHUNK_SIZE)),
+            status=status, content_type='image/%s' % photo.format)
+        response['Content-Length'] = len(data)
+        if byte_range:
+            response['Content-Range'] = 'bytes %i-%i/%i' % (
+                byte_range + (length,))
+        return response
+
+
+@method_decorator(login_required, name='dispatch')
+class ThumbnailView(View):
+    '''
+    View to return a small thumbnail of a photo, for the profile page
+    '''
+
+    def get(self, request, *args, **kwargs):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Handle get - return the (cached) thumbnail
+        '''
+        try:
+            photo = Photo.objects.only('modified').get(  # pylint: disable=no-member
+                pk=kwargs['pk'], user=request.user)
+        except Photo.DoesNotExist:  # pylint: disable=no-member
+            return HttpResponseNotFound()
+        etag = '"%s-%i"' % (photo.etag.strip('"'), THUMBNAIL_SIZE)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=photo.modified.timestamp())
+        if response is None:
+            tiles = render_tiles({(photo.pk, photo.modified)}, THUMBNAIL_SIZE)
+            if photo.pk not in tiles:
+                return HttpResponseNotFound()
+            response = HttpResponse(tiles[photo.pk], content_type='image/png')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(photo.modified.timestamp())
+        # The profile page links to it with ?v=<modification time>
+        patch_cache_control(response, private=True, max_age=THUMBNAIL_MAX_AGE)
+        return response
 
 
 @method_decorator(login_required, name='dispatch')
@@ -440,6 +528,7 @@ class DeletePhotoView(SuccessMessageMixin, View):
 
 
 @method_decorator(login_required, name='dispatch')
+@method_decorator(csrf_exempt, name='dispatch')
 class UploadPhotoView(SuccessMessageMixin, FormView):
     '''
     View class responsible for photo upload
@@ -451,12 +540,35 @@ class UploadPhotoView(SuccessMessageMixin, FormView):
     success_url = reverse_lazy('profile')
 
     def post(self, request, *args, **kwargs):
-        num_photos = request.user.photo_set.count()
+        num_photos = UserSummary.for_user(
+            request.user, cached=False)['photos']
         if num_photos >= MAX_NUM_PHOTOS:
             messages.error(
                 request,
                 _('Maximum number of photos (%i) reached' % MAX_NUM_PHOTOS))
             return HttpResponseRedirect(reverse_lazy('profile'))
+        # The upload handler must be in place before anything (including
+        # the CSRF check) reads the request body, hence csrf_exempt on
+        # dispatch and the explicit csrf_protect on _post()
+        upload_handler = PhotoUploadHandler(request)
+        request.upload_handlers.insert(0, upload_handler)
+        return self._post(request, upload_handler, *args, **kwargs)
+
+    @method_decorator(csrf_protect)
+    def _post(self, request, upload_handler, *args, **kwargs):
+        '''
+        Handle the (already limited) upload
+        '''
+        request.FILES  # pylint: disable=pointless-statement
+        if upload_handler.error == PhotoUploadHandler.ERROR_SIZE:
+            messages.error(request, _('Image too big'))
+            return HttpResponseRedirect(reverse_lazy('profile'))
+        if upload_handler.error == PhotoUploadHandler.ERROR_DIMENSIONS:
+            messages.error(
+                request,
+                _('Image dimensions are too big (max: %s x %s)') %
+                (MAX_PIXELS, MAX_PIXELS))
+            return HttpResponseRedirect(reverse_lazy('profile'))
         return super().post(request, *args, **kwargs)
 
     def form_valid(self, form):
@@ -569,7 +681,7 @@ class RedirectOpenIDView(View):
         session = {'id': request.session.session_key}
 
         oidutil.log = openid_logging
-        openid_consumer = consumer.Consumer(session, DjangoOpenIDStore())
+        openid_consumer = consumer.Consumer(session, get_openid_store())
 
         try:
             auth_request = openid_consumer.begin(user_url)
@@ -608,7 +720,7 @@ class ConfirmOpenIDView(View):  # pragma: no cover
         session = {'id': self.request.session.session_key}
         current_url = self.request.build_absolute_uri('/')[:-1] + \
             self.request.path
-        openid_consumer = consumer.Consumer(session, DjangoOpenIDStore())
+        openid_consumer = consumer.Consumer(session, get_openid_store())
         info = openid_consumer.complete(data, current_url)
         if info.status == consumer.FAILURE:
             messages.error(
@@ -642,7 +754,8 @@ class ConfirmOpenIDView(View):  # pragma: no cover
 
         # If there is a single image in this user's profile
         # assign it to the new id
-        if self.request.user.photo_set.count() == 1:
+        if UserSummary.for_user(
+                self.request.user, cached=False)['photos'] == 1:
             confirmed.set_photo(self.request.user.photo_set.first())
 
         # Also allow user to login using this OpenID (if not already taken)
@@ -763,6 +876,13 @@ class UploadLibravatarExportView(SuccessMessageMixin, FormView):
         '''
         if 'save' in kwargs:  # pylint: disable=too-many-nested-blocks
             if kwargs['save'] == 'save':
+                token = request.POST.get('token')
+                try:
+                    export_staging.load(token, request.user)
+                except KeyError:
+                    messages.error(
+                        request, _('Export expired, please upload it again'))
+                    return HttpResponseRedirect(reverse_lazy('upload_export'))
                 for arg in request.POST:
                     if arg.startswith('email_'):
                         email = request.POST[arg]
@@ -787,40 +907,64 @@ class UploadLibravatarExportView(SuccessMessageMixin, FormView):
                                 print('Exception during adding mail address (%s): %s'
                                       % (email, exc))
 
-                    if arg.startswith('photo'):
+                    if arg.startswith('photo_'):
                         try:
-                            data = base64.decodebytes(bytes(request.POST[arg], 'utf-8'))
-                        except binascii.Error as exc:
-                            print('Cannot decode photo: %s' % exc)
+                            data = export_staging.read_photo(
+                                token, request.user, request.POST[arg])
+                        except (KeyError, OSError):
+                            print('Staged photo not found: %s' % request.POST[arg])
                             continue
-                        try:
-                            pilobj = Image.open(BytesIO(data))
-                            out = BytesIO()
-                            pilobj.save(out, pilobj.format, quality=JPEG_QUALITY)
-                            out.seek(0)
-                            photo = Photo()
-                            photo.user = request.user
-                            photo.ip_address = get_client_ip(request)[0]
-                            photo.format = file_format(pilobj.format)
-                            photo.data = out.read()
-                            photo.save()
-                        except Exception as exc:  # pylint: disable=broad-except
-                            print('Exception during save: %s' % exc)
+                        # Stored as uploaded, no need to re-encode
+                        img_format = file_format(Image.open(BytesIO(data)).format)
+                        if not img_format:
                             continue
+                        photo = Photo()
+                        photo.user = request.user
+                        photo.ip_address = get_client_ip(request)[0]
+                        photo.set_image_data(data, img_format)
+                        photo.save()
 
+                export_staging.discard(token)
                 return HttpResponseRedirect(reverse_lazy('profile'))
         return super().post(request, args, kwargs)
 
     def form_valid(self, form):
-        data = self.request.FILES['export_file']
-        items = libravatar_read_gzdata(data.read())
-        # DEBUG print(items)
+        try:
+            (token, manifest) = export_staging.stage(
+                self.request.user,
+                libravatar_iter_export(self.request.FILES['export_file']))
+        except (ValueError, OSError, EOFError, ParseError) as exc:
+            form.add_error('export_file', _('Unable to read export: %s') % exc)
+            return self.form_invalid(form)
         return render(self.request, 'choose_libravatar_export.html', {
-            'emails': items['emails'],
-            'photos': items['photos'],
+            'token': token,
+            'emails': manifest['emails'],
+            'photos': manifest['photos'],
         })
 
 
+@method_decorator(login_required, name='dispatch')
+class StagedExportPhotoView(View):
+    '''
+    View to return a thumbnail of a photo of an uploaded export
+    '''
+
+    def get(self, request, *args, **kwargs):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Handle get - return the thumbnail
+        '''
+        try:
+            data = export_staging.read_photo(
+                kwargs['token'], request.user, kwargs['photo_id'])
+            img = Image.open(BytesIO(data))
+            img.thumbnail((100, 100), Image.ANTIALIAS)
+            out = BytesIO()
+            img.save(out, 'PNG')
+        except (KeyError, OSError):
+            return HttpResponseNotFound()
+        return HttpResponse(out.getvalue(), content_type='image/png')
+
+
 @method_decorator(login_required, name='dispatch')
 class ResendConfirmationMailView(View):
     '''
@@ -879,22 +1023,46 @@ class ProfileView(TemplateView):
         self._confirm_claimed_openid()
         return super().get(self, request, args, kwargs)
 
+    def get_context_data(self, **kwargs):
+        '''
+        Fetch everything the page shows in one query per list, without
+        any image data
+        '''
+        context = super().get_context_data(**kwargs)
+        user = self.request.user
+        context['emails'] = list(user.confirmedemail_set.select_related(
+            'photo').defer('photo__data'))
+        context['openids'] = list(user.confirmedopenid_set.select_related(
+            'photo').defer('photo__data'))
+        context['unconfirmed_emails'] = list(user.unconfirmedemail_set.all())
+        context['unconfirmed_openids'] = list(
+            user.unconfirmedopenid_set.all())
+        context['photos'] = list(user.photo_set.defer('data'))
+        return context
+
     def _confirm_claimed_openid(self):
-        openids = self.request.user.useropenid_set.all()
+        # Done once per session, the result doesn't change in between
+        if self.request.session.get(CLAIMED_OPENID_CHECKED):
+            return
+        # A single query telling whether there's only one OpenID, and if
+        # it is (un)confirmed already; two rows are enough to tell
+        openids = list(self.request.user.useropenid_set.annotate(
+            confirmed=Exists(ConfirmedOpenId.objects.filter(
+                openid=OuterRef('claimed_id'))),
+            unconfirmed=Exists(UnconfirmedOpenId.objects.filter(
+                openid=OuterRef('claimed_id'))),
+        ).values_list('claimed_id', 'confirmed', 'unconfirmed')[:2])
         # If there is only one OpenID, we eventually need to add it to the user account
-        if openids.count() == 1:
-            # Already confirmed, skip
-            if ConfirmedOpenId.objects.filter(openid=openids.first().claimed_id).count() > 0:  # pylint: disable=no-member
-                return
-            # For whatever reason, this is in unconfirmed state, skip
-            if UnconfirmedOpenId.objects.filter(openid=openids.first().claimed_id).count() > 0:  # pylint: disable=no-member
-                return
-            print('need to confirm: %s' % openids.first())
+        # (unless it's confirmed or, for whatever reason, unconfirmed already)
+        if len(openids) == 1 and not openids[0][1] and not openids[0][2]:
+            print('need to confirm: %s' % openids[0][0])
             confirmed = ConfirmedOpenId()
             confirmed.user = self.request.user
             confirmed.ip_address = get_client_ip(self.request)[0]
-            confirmed.openid = openids.first().claimed_id
+            confirmed.openid = openids[0][0]
             confirmed.save()
+        self.request.session[CLAIMED_OPENID_CHECKED] = True
+
 
 class PasswordResetView(PasswordResetViewOriginal):
     '''
@@ -911,7 +1079,7 @@ class PasswordResetView(PasswordResetViewOriginal):
             try:
                 confirmed_email = ConfirmedEmail.objects.get(email=request.POST['email'])
                 confirmed_email.user.email = confirmed_email.email
-                confirmed_email.user.save()
+                confirmed_email.user.save(update_fields=['email'])
             except Exception as exc:
                 pass
         return super().post(self, request, args, kwargs)
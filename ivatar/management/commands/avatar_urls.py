@@ -0,0 +1,55 @@
+'''
+Compute digests and avatar URLs of many addresses
+
+Reads one e-mail address or OpenID per line (from the given files or
+stdin) and writes one JSON object per line, as it goes:
+
+  ./manage.py avatar_urls --size 80 --default mm < addresses.txt
+'''
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from ivatar.tools.batch import avatar_urls
+
+
+def read_addresses(files):
+    '''
+    Yield (kind, address) for every non-empty line of the files
+    '''
+    for infile in files:
+        for line in infile:
+            address = line.strip()
+            if address:
+                yield ('openid' if '://' in address else 'email', address)
+
+
+class Command(BaseCommand):
+    '''
+    avatar_urls command
+    '''
+    help = 'Compute digests and avatar URLs of e-mail addresses and OpenIDs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*',
+            help='Files with one address per line (default: stdin)')
+        parser.add_argument(
+            '--size', type=int,
+            help='Avatar size to put into the URLs')
+        parser.add_argument(
+            '--default',
+            help='Default image (d=) to put into the URLs')
+
+    def handle(self, *args, **options):
+        files = [open(name) for name in options['files']] or [sys.stdin]
+        try:
+            for entry in avatar_urls(
+                    read_addresses(files), options['size'],
+                    options['default']):
+                self.stdout.write(json.dumps(entry))
+        finally:
+            for infile in files:
+                if infile is not sys.stdin:
+                    infile.close()
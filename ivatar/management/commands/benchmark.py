@@ -0,0 +1,366 @@
+'''
+Benchmark the avatar serving path
+
+The benchmark runs against a throw-away test database on the configured
+database backend and a local stub Gravatar server, so results are
+reproducible and no request leaves the machine. Results are written as
+JSON, so they can be kept and compared between releases. Every scenario
+is measured "cold", with all caches cleared before each request, and
+"warm", with the caches kept between requests. Cold and warm results
+depend on the cache backends (see cache_setup()), which are recorded too:
+
+  ./manage.py benchmark --output before.json
+  ./manage.py benchmark --baseline before.json --max-regression 10
+'''
+import hashlib
+import itertools
+import json
+import math
+import platform
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlsplit, parse_qs
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from PIL import Image
+
+from ivatar.settings import IVATAR_VERSION
+from ivatar.ivataraccount.models import Photo, ConfirmedEmail
+
+DEFAULT_SIZES = '32,80,128,512'
+DEFAULT_STYLES = '404,mm,identicon,retro,monsterid,robohash'
+BENCHMARK_EMAIL = 'benchmark@example.org'
+MISSING_EMAIL = 'missing@example.org'
+CACHE_MODES = ('cold', 'warm')
+
+
+def percentile(values, percent):
+    '''
+    Nearest-rank percentile of an already sorted list
+    '''
+    if not values:
+        return None
+    rank = max(math.ceil(percent / 100.0 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def cache_setup():
+    '''
+    Describe the backend and size limit of every configured cache
+
+    With memcached, the limits only apply to the in-process tiers; the
+    shared entries of all purposes compete for the memory of the servers.
+    '''
+    setup = {}
+    for (alias, config) in settings.CACHES.items():
+        description = config['BACKEND'].rsplit('.', 1)[-1]
+        location = config.get('LOCATION', '')
+        max_entries = config.get('OPTIONS', {}).get('MAX_ENTRIES')
+        if 'Memcached' in description:
+            if not isinstance(location, str):
+                location = ','.join(location)
+            description += ' on %s, shared memory' % location
+        elif max_entries:
+            description += ', max %i entries' % max_entries
+        if location in settings.CACHES and location != alias:
+            description += ', in front of %s' % location
+        setup[alias] = description
+    return setup
+
+
+def clear_caches():
+    '''
+    Empty all configured caches
+    '''
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+class StubGravatarHandler(BaseHTTPRequestHandler):
+    '''
+    Answer every request with a PNG of the requested size, like Gravatar
+    '''
+    images = {}
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''
+        Handle get - return image
+        '''
+        query = parse_qs(urlsplit(self.path).query)
+        size = int(query.get('s', ['80'])[0])
+        if size not in self.images:
+            data = BytesIO()
+            Image.new('RGB', (size, size), (0, 128, 255)).save(data, 'PNG')
+            self.images[size] = data.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(self.images[size])))
+        self.end_headers()
+        self.wfile.write(self.images[size])
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''
+        Keep the benchmark output clean
+        '''
+
+
+class Command(BaseCommand):
+    '''
+    Benchmark command
+    '''
+    help = 'Measure requests/s and latency of the avatar serving path'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=100,
+            help='Number of timed requests per scenario and size')
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='Number of untimed requests per scenario and size')
+        parser.add_argument(
+            '--sizes', default=DEFAULT_SIZES,
+            help='Comma separated list of avatar sizes')
+        parser.add_argument(
+            '--styles', default=DEFAULT_STYLES,
+            help='Comma separated list of default= styles')
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            help='Only run the given scenario (may be repeated)')
+        parser.add_argument(
+            '--cache', choices=CACHE_MODES + ('both',), default='both',
+            help='Measure with caches cleared before every request (cold), '
+            'kept between requests (warm) or both')
+        parser.add_argument(
+            '--output',
+            help='Write the JSON results to this file instead of stdout')
+        parser.add_argument(
+            '--baseline',
+            help='JSON results of an earlier run to compare against')
+        parser.add_argument(
+            '--max-regression', type=float, default=10.0,
+            help='Fail if the median latency grew more than this (in %%)')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        styles = [style for style in options['styles'].split(',') if style]
+
+        stub = HTTPServer(('127.0.0.1', 0), StubGravatarHandler)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        stub_url = 'http://127.0.0.1:%i/avatar/' % stub.server_port
+
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            digests = self.create_fixture()
+            with mock.patch('ivatar.views.GRAVATAR_URL', stub_url):
+                results = self.run_scenarios(
+                    self.scenarios(digests, sizes, styles),
+                    options['scenarios'], options['iterations'],
+                    options['warmup'],
+                    CACHE_MODES if options['cache'] == 'both'
+                    else (options['cache'],))
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+            stub.shutdown()
+
+        report = {
+            'meta': {
+                'ivatar_version': IVATAR_VERSION,
+                'django_version': django.get_version(),
+                'python_version': platform.python_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'caches': cache_setup(),
+                'date': timezone.now().isoformat(),
+            },
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as outfile:
+                json.dump(report, outfile, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        if options['verbosity'] > 0:
+            self.print_summary(report)
+
+        if options['baseline']:
+            self.compare(report, options['baseline'],
+                         options['max_regression'])
+
+    @staticmethod
+    def create_fixture():
+        '''
+        Create a user with a confirmed email address and a photo
+        '''
+        user = User.objects.create_user(username='benchmark')
+        data = BytesIO()
+        Image.new('RGB', (512, 512), (255, 128, 0)).save(data, 'JPEG')
+        photo = Photo(user=user, ip_address='127.0.0.1')
+        photo.set_image_data(data.getvalue(), 'jpg')
+        photo.save()
+        confirmed = ConfirmedEmail(
+            user=user, ip_address='127.0.0.1', email=BENCHMARK_EMAIL,
+            photo=photo)
+        confirmed.save()
+        return {
+            'md5': confirmed.digest,
+            'sha256': confirmed.digest_sha256,
+            'missing': hashlib.md5(MISSING_EMAIL.encode('utf-8')).hexdigest(),
+        }
+
+    @staticmethod
+    def scenarios(digests, sizes, styles):
+        '''
+        Yield (scenario, size, url) of everything we measure
+        '''
+        for size in sizes:
+            yield ('avatar_md5', size,
+                   '/avatar/%s?s=%i' % (digests['md5'], size))
+            yield ('avatar_sha256', size,
+                   '/avatar/%s?s=%i' % (digests['sha256'], size))
+            yield ('miss', size, '/avatar/%s?s=%i&gravatarproxy=n' % (
+                digests['missing'], size))
+            for style in styles:
+                yield ('default_%s' % style, size,
+                       '/avatar/%s?s=%i&d=%s&gravatarproxy=n' % (
+                           digests['missing'], size, style))
+            yield ('gravatarproxy', size,
+                   '/gravatarproxy/%s?s=%i' % (digests['missing'], size))
+            yield ('sprite', size, '/sprite/?s=%i&digests=%s' % (
+                size, ','.join(digests.values())))
+
+    @staticmethod
+    def run_scenarios(scenarios, only, iterations, warmup, cache_modes):
+        '''
+        Time every scenario and return the statistics
+
+        Every scenario is run once per cache mode: "cold" clears all
+        caches before every request, "warm" only before the warmup.
+        '''
+        client = Client()
+        results = []
+        for ((scenario, size, url), cache_mode) in itertools.product(
+                scenarios, cache_modes):
+            if only and scenario not in only:
+                continue
+            errors = 0
+            error = None
+            timings = []
+            clear_caches()
+            for iteration in range(warmup + iterations):
+                if cache_mode == 'cold':
+                    clear_caches()
+                start = time.perf_counter()
+                try:
+                    response = client.get(url)
+                    if response.status_code >= 400 and 'd=404' not in url:
+                        raise ValueError('HTTP %i' % response.status_code)
+                except Exception as exc:  # pylint: disable=broad-except
+                    errors += 1
+                    error = str(exc)
+                    continue
+                finally:
+                    elapsed = time.perf_counter() - start
+                if iteration >= warmup:
+                    timings.append(elapsed)
+            timings.sort()
+            total = sum(timings)
+            result = {
+                'scenario': scenario,
+                'size': size,
+                'cache': cache_mode,
+                'url': url,
+                'requests': len(timings),
+                'errors': errors,
+                'rps': len(timings) / total if total else None,
+            }
+            for (key, value) in (
+                    ('min_ms', timings[0] if timings else None),
+                    ('mean_ms', total / len(timings) if timings else None),
+                    ('p50_ms', percentile(timings, 50)),
+                    ('p90_ms', percentile(timings, 90)),
+                    ('p99_ms', percentile(timings, 99)),
+                    ('max_ms', timings[-1] if timings else None)):
+                result[key] = value * 1000 if value is not None else None
+            if error:
+                result['error'] = error
+            results.append(result)
+        return results
+
+    def print_summary(self, report):
+        '''
+        Human readable summary on stderr
+        '''
+        for (alias, description) in sorted(report['meta']['caches'].items()):
+            self.stderr.write('cache %-14s %s' % (alias, description))
+        results = report['results']
+        self.stderr.write('%-20s %5s %5s %10s %9s %9s %9s %7s' % (
+            'scenario', 'size', 'cache', 'req/s', 'p50 ms', 'p90 ms',
+            'p99 ms', 'errors'))
+        for result in results:
+            if not result['requests']:
+                self.stderr.write('%-20s %5i %5s %s' % (
+                    result['scenario'], result['size'], result['cache'],
+                    result.get('error', 'no successful requests')))
+                continue
+            self.stderr.write('%-20s %5i %5s %10.1f %9.2f %9.2f %9.2f %7i' % (
+                result['scenario'], result['size'], result['cache'],
+                result['rps'],
+                result['p50_ms'], result['p90_ms'], result['p99_ms'],
+                result['errors']))
+
+    def compare(self, report, baseline_file, max_regression):
+        '''
+        Compare median latencies against an earlier run
+        '''
+        with open(baseline_file) as infile:
+            baseline_report = json.load(infile)
+        if baseline_report['meta'].get(
+                'caches', report['meta']['caches']) != report['meta']['caches']:
+            self.stderr.write(
+                'Warning: the baseline was measured with other caches, '
+                'results are not comparable')
+        baseline = {
+            # Results from before the cache modes were all warm
+            (result['scenario'], result['size'],
+             result.get('cache', 'warm')): result
+            for result in baseline_report['results']}
+
+        regressions = []
+        for result in report['results']:
+            old = baseline.get(
+                (result['scenario'], result['size'], result['cache']))
+            if not old or not old['p50_ms'] or not result['p50_ms']:
+                continue
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+            if change > max_regression:
+                regressions.append(
+                    '%s (s=%i, %s): p50 %.2f ms -> %.2f ms (+%.1f%%)' % (
+                    result['scenario'], result['size'], result['cache'],
+                    old['p50_ms'],
+                    result['p50_ms'], change))
+        if regressions:
+            raise CommandError(
+                'Regressions above %.1f%%:\n%s' % (
+                    max_regression, '\n'.join(regressions)))
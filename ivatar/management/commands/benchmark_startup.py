@@ -0,0 +1,111 @@
+'''
+Benchmark the startup of an application process
+
+Every run starts a fresh Python process loading everything a worker
+loads before its first request (settings, models and URLs, hence the
+views), and measures its wall time and peak memory (RSS). The "lazy"
+mode is what workers do now; "preloaded" also imports the default avatar
+generators, like the workers did before they were loaded lazily, and
+like PRELOAD_GENERATORS does:
+
+  ./manage.py benchmark_startup --runs 10 --output startup.json
+'''
+import json
+import platform
+import subprocess
+import sys
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ivatar.settings import BASE_DIR, IVATAR_VERSION
+from .benchmark import percentile
+
+MODES = ('lazy', 'preloaded')
+
+WORKER_SCRIPT = '''
+import json, os, resource, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ivatar.settings')
+import django
+django.setup()
+import ivatar.urls
+if sys.argv[1] == 'preloaded':
+    from ivatar.generators import preload
+    preload()
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+'''
+
+
+class Command(BaseCommand):
+    '''
+    Startup benchmark command
+    '''
+    help = 'Measure boot time and memory of application processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs', type=int, default=10,
+            help='Number of processes started per mode')
+        parser.add_argument(
+            '--output',
+            help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        results = [
+            self.run_mode(mode, options['runs']) for mode in MODES]
+        report = {
+            'meta': {
+                'ivatar_version': IVATAR_VERSION,
+                'django_version': django.get_version(),
+                'python_version': platform.python_version(),
+                'runs': options['runs'],
+                'date': timezone.now().isoformat(),
+            },
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as outfile:
+                json.dump(report, outfile, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        if options['verbosity'] > 0:
+            self.stderr.write('%-10s %9s %9s %12s' % (
+                'mode', 'p50 ms', 'max ms', 'max RSS KiB'))
+            for result in results:
+                self.stderr.write('%-10s %9.1f %9.1f %12i' % (
+                    result['mode'], result['p50_ms'], result['max_ms'],
+                    result['maxrss_kb']))
+
+    @staticmethod
+    def run_mode(mode, runs):
+        '''
+        Start runs processes in the given mode and return the statistics
+        '''
+        timings = []
+        rss = []
+        for _ in range(runs):
+            process = subprocess.run(
+                [sys.executable, '-c', WORKER_SCRIPT, mode], cwd=BASE_DIR,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True)
+            if process.returncode:
+                raise CommandError(
+                    'Process (%s) failed:\n%s' % (mode, process.stderr))
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            timings.append(result['seconds'])
+            rss.append(result['maxrss_kb'])
+        timings.sort()
+        return {
+            'mode': mode,
+            'runs': runs,
+            'p50_ms': percentile(timings, 50) * 1000,
+            'max_ms': timings[-1] * 1000,
+            'maxrss_kb': max(rss),
+        }
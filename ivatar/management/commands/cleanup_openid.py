@@ -0,0 +1,25 @@
+'''
+Remove expired OpenID nonces and associations
+
+Logins only ever look at unexpired rows, so this merely keeps the
+tables small. Run it regularly, eg. hourly from cron:
+
+  ./manage.py cleanup_openid
+'''
+from django.core.management.base import BaseCommand
+
+from ivatar.ivataraccount.models import DjangoOpenIDStore
+
+
+class Command(BaseCommand):
+    '''
+    cleanup_openid command
+    '''
+    help = 'Remove expired OpenID nonces and associations'
+
+    def handle(self, *args, **options):
+        store = DjangoOpenIDStore()
+        nonces = store.cleanupNonces()
+        associations = store.cleanupAssociations()
+        self.stdout.write('%i nonces and %i associations removed' % (
+            nonces, associations))
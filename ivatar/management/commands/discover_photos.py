@@ -0,0 +1,63 @@
+'''
+Look up photos of newly confirmed addresses on other services
+
+Confirming an address doesn't wait for Gravatar and Libravatar anymore;
+the addresses are marked instead and this command looks them up, storing
+the results on the address for the profile page. Run it from cron, or
+keep it running:
+
+  ./manage.py discover_photos --loop
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ivatar.ivataraccount.external_photos import discover_external_photos
+from ivatar.ivataraccount.models import ConfirmedEmail
+from ivatar.settings import PHOTO_DISCOVERY_BATCH_SIZE
+
+WORKERS = 8
+
+
+def discover_pending(batch_size=PHOTO_DISCOVERY_BATCH_SIZE, workers=WORKERS):
+    '''
+    Look up the photos of a batch of marked addresses, return the number
+    of addresses done
+    '''
+    emails = list(ConfirmedEmail.objects.filter(
+        external_photos_pending=True).order_by('pk')[:batch_size])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (email, photos) in zip(emails, executor.map(
+                discover_external_photos, [email.email for email in emails])):
+            email.set_external_photos(photos)
+    return len(emails)
+
+
+class Command(BaseCommand):
+    '''
+    discover_photos command
+    '''
+    help = 'Look up photos of newly confirmed addresses on other services'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, waiting for new addresses')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to wait when there is nothing to do (default: 5)')
+        parser.add_argument(
+            '--workers', type=int, default=WORKERS,
+            help='Addresses to look up at the same time (default: %i)' %
+            WORKERS)
+
+    def handle(self, *args, **options):
+        while True:
+            done = discover_pending(workers=options['workers'])
+            if done:
+                self.stdout.write('%i addresses looked up' % done)
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,225 @@
+'''
+Import Libravatar user exports (*.xml.gz) in bulk
+
+Files are imported in parallel by a pool of worker processes, every user
+in a transaction of its own. Imported files are recorded in a checkpoint
+file, so an interrupted or partly failed run can simply be restarted;
+exports imported but not yet recorded are imported again, without
+duplicating anything:
+
+  ./manage.py import_libravatar /path/to/exports --processes 8
+'''
+import hashlib
+import os
+import time
+from io import BytesIO
+from multiprocessing import Pool
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django_openid_auth.models import UserOpenID
+from PIL import Image
+
+from ivatar.ivataraccount.models import ConfirmedEmail, ConfirmedOpenId
+from ivatar.ivataraccount.models import Photo, UserSummary, file_format
+from ivatar.ivataraccount.read_libravatar_export import iter_export
+from ivatar.digests import batch_email_digests, batch_openid_digests
+from ivatar.digests import normalize_openid
+
+CHECKPOINT_FILE = '.import_libravatar.checkpoint'
+COUNTERS = ('users', 'photos', 'emails', 'openids', 'skipped')
+
+
+def _init_worker():
+    '''
+    Make sure the worker doesn't share the database connection of its parent
+    '''
+    django.setup()
+    connections.close_all()
+
+
+def import_export(filename):
+    '''
+    Import a single export file, return (filename, counts, error)
+    '''
+    counts = dict.fromkeys(COUNTERS, 0)
+    try:
+        with open(filename, 'rb') as infile, transaction.atomic():
+            import_items(iter_export(infile), counts)
+    except Exception as exc:  # pylint: disable=broad-except
+        return (filename, counts, str(exc))
+    return (filename, counts, None)
+
+
+def import_items(items, counts):
+    '''
+    Import the items of an export, as yielded by iter_export()
+
+    Photos are saved as they are read, addresses and OpenIDs (which
+    refer to the photos) are collected and inserted at the end. Photos
+    the user already has (same data) are reused, so importing an export
+    again is harmless.
+    '''
+    user = None
+    existing_photos = {}
+    saved_photos = {}
+    emails = []
+    openids = []
+    for (kind, item) in items:
+        if kind == 'account':
+            (user, created) = User.objects.get_or_create(
+                username=item['username'])
+            if not created:
+                existing_photos = {
+                    hashlib.sha256(photo.data).digest(): photo
+                    for photo in user.photo_set.all()}
+            user.password = item['password']
+            user.save(update_fields=['password'])
+            counts['users'] += 1
+        elif user is None:
+            raise ValueError('no user found')
+        elif kind == 'photo':
+            # Only parses the header, iter_export() checked the image already
+            img_format = file_format(Image.open(BytesIO(item['data'])).format)
+            if not img_format:
+                continue
+            photo = existing_photos.get(hashlib.sha256(item['data']).digest())
+            if photo:
+                saved_photos[item['id']] = photo
+                counts['skipped'] += 1
+                continue
+            photo = Photo(user=user, ip_address='0.0.0.0')
+            photo.set_image_data(item['data'], img_format)
+            photo.save()
+            saved_photos[item['id']] = photo
+            counts['photos'] += 1
+        elif kind == 'email':
+            emails.append(item)
+        elif kind == 'openid':
+            openids.append(item)
+    if user is None:
+        raise ValueError('no user found')
+
+    # bulk_create() bypasses save(), hence the explicit digests
+    digests = batch_email_digests(item['email'] for item in emails)
+    confirmed_emails = []
+    for item in emails:
+        email = ConfirmedEmail(
+            user=user, email=item['email'],
+            photo=saved_photos.get(item['photo_id']))
+        (email.digest, email.digest_sha256) = digests[item['email']]
+        confirmed_emails.append(email)
+    counts['emails'] += _insert_new(
+        ConfirmedEmail, user, confirmed_emails, counts)
+
+    digests = batch_openid_digests(item['openid'] for item in openids)
+    confirmed_openids = []
+    for item in openids:
+        openid = ConfirmedOpenId(
+            user=user, openid=normalize_openid(item['openid']),
+            digest=digests[item['openid']],
+            photo=saved_photos.get(item['photo_id']))
+        confirmed_openids.append(openid)
+    counts['openids'] += _insert_new(
+        ConfirmedOpenId, user, confirmed_openids, counts)
+    # Only for the OpenIDs the user has now, not those of someone else
+    UserOpenID.objects.bulk_create([
+        UserOpenID(user=user, claimed_id=openid, display_id=openid)
+        for openid in ConfirmedOpenId.objects.filter(
+            user=user, openid__in=[
+                openid.openid for openid in confirmed_openids]
+        ).values_list('openid', flat=True)], ignore_conflicts=True)
+    # bulk_create() doesn't send the signals maintaining the summary
+    UserSummary.recount(user.pk)
+
+
+def _insert_new(model, user, objs, counts):
+    '''
+    Insert the objects of the user, return how many were inserted
+
+    bulk_create(ignore_conflicts=True) skips rows conflicting with
+    existing ones (eg. addresses of another user) without telling, so
+    the rows of the user are counted before and after; the difference is
+    added to counts['skipped'].
+    '''
+    before = model.objects.filter(user=user).count()
+    model.objects.bulk_create(objs, ignore_conflicts=True)
+    inserted = model.objects.filter(user=user).count() - before
+    counts['skipped'] += len(objs) - inserted
+    return inserted
+
+
+class Command(BaseCommand):
+    '''
+    import_libravatar command
+    '''
+    help = 'Import a directory of Libravatar user exports'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Directory containing the *.xml.gz exports')
+        parser.add_argument(
+            '--processes', type=int,
+            help='Number of worker processes (default: number of CPUs, '
+            '1 with SQLite)')
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording the imported exports (default: %s in '
+            'the export directory)' % CHECKPOINT_FILE)
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore the checkpoint file and import everything again')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isdir(path):
+            raise CommandError('%s is not a directory' % path)
+        checkpoint = options['checkpoint'] or os.path.join(
+            path, CHECKPOINT_FILE)
+        processes = options['processes']
+        if not processes:
+            processes = 1 if connection.vendor == 'sqlite' else os.cpu_count()
+
+        done = set()
+        if os.path.isfile(checkpoint) and not options['restart']:
+            with open(checkpoint) as infile:
+                done = {line.strip() for line in infile}
+        todo = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.endswith('.xml.gz') and name not in done)
+        self.stdout.write('%i exports to import, %i already imported' % (
+            len(todo), len(done)))
+
+        totals = dict.fromkeys(COUNTERS, 0)
+        failed = 0
+        start = time.time()
+        # The workers must not inherit our database connection
+        connections.close_all()
+        with Pool(processes, initializer=_init_worker) as pool, \
+                open(checkpoint, 'w' if options['restart'] else 'a') as outfile:
+            for (index, (filename, counts, error)) in enumerate(
+                    pool.imap_unordered(import_export, todo), 1):
+                if error:
+                    failed += 1
+                    self.stderr.write('%s: %s' % (filename, error))
+                else:
+                    outfile.write(os.path.basename(filename) + '\n')
+                    outfile.flush()
+                    for key in COUNTERS:
+                        totals[key] += counts[key]
+                if index % 100 == 0 or index == len(todo):
+                    self.report(index, len(todo), totals, start)
+
+        self.stdout.write('Done: %s, %i failed (rerun to retry them)' % (
+            ', '.join('%i %s' % (totals[key], key) for key in COUNTERS),
+            failed))
+
+    def report(self, index, total, totals, start):
+        '''
+        Print progress and throughput
+        '''
+        elapsed = max(time.time() - start, 0.001)
+        self.stdout.write('%i/%i exports, %.1f exports/s, %.1f photos/s' % (
+            index, total, index / elapsed, totals['photos'] / elapsed))
@@ -0,0 +1,115 @@
+'''
+Send the mails queued by the web application
+
+Mails are sent in batches over a single connection to the mail backend.
+A mail that cannot be sent, or all mails of the batch if the connection
+cannot be opened, is retried with exponential backoff and given up after
+MAIL_QUEUE_MAX_ATTEMPTS. Run it from cron, or keep it
+running:
+
+  ./manage.py send_queued_mail --loop
+'''
+import time
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ivatar.ivataraccount.models import QueuedMail
+from ivatar.settings import MAIL_QUEUE_BATCH_SIZE, MAIL_QUEUE_MAX_ATTEMPTS
+from ivatar.settings import MAIL_QUEUE_RETRY_DELAY
+
+
+def retry_delay(attempts):
+    '''
+    Return the delay before the next attempt, after the given number of
+    failed attempts
+    '''
+    return timedelta(seconds=MAIL_QUEUE_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def reschedule(mail, error, now):
+    '''
+    Record a failed attempt to send the mail
+    '''
+    mail.attempts += 1
+    mail.last_error = str(error)
+    mail.failed = mail.attempts >= MAIL_QUEUE_MAX_ATTEMPTS
+    mail.next_attempt = now + retry_delay(mail.attempts)
+    mail.save()
+
+
+def send_queued(batch_size=MAIL_QUEUE_BATCH_SIZE):
+    '''
+    Send a batch of due mails, return the number of (sent, failed) mails
+    '''
+    sent = failed = 0
+    now = timezone.now()
+    with transaction.atomic():
+        mails = QueuedMail.objects.filter(
+            failed=False, next_attempt__lte=now).order_by('next_attempt')
+        # Lets several workers share the queue, where supported
+        if connection.features.has_select_for_update_skip_locked:
+            mails = mails.select_for_update(skip_locked=True)
+        mails = list(mails[:batch_size])
+        if not mails:
+            return (0, 0)
+
+        mail_connection = get_connection()
+        try:
+            mail_connection.open()
+        except Exception as exc:  # pylint: disable=broad-except
+            # eg. the mail server is down or refuses our login
+            for mail in mails:
+                reschedule(mail, exc, now)
+            return (0, len(mails))
+
+        done = []
+        try:
+            for mail in mails:
+                try:
+                    EmailMessage(
+                        mail.subject, mail.body, mail.from_email,
+                        [mail.recipient],
+                        connection=mail_connection).send()
+                except Exception as exc:  # pylint: disable=broad-except
+                    failed += 1
+                    reschedule(mail, exc, now)
+                else:
+                    sent += 1
+                    done.append(mail.pk)
+        finally:
+            mail_connection.close()
+        QueuedMail.objects.filter(pk__in=done).delete()
+    return (sent, failed)
+
+
+class Command(BaseCommand):
+    '''
+    send_queued_mail command
+    '''
+    help = 'Send queued mails'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, waiting for new mails')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to wait when the queue is empty (default: 5)')
+        parser.add_argument(
+            '--batch-size', type=int, default=MAIL_QUEUE_BATCH_SIZE,
+            help='Mails to send per connection (default: %i)' %
+            MAIL_QUEUE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        while True:
+            (sent, failed) = send_queued(options['batch_size'])
+            if sent or failed:
+                self.stdout.write('%i mails sent, %i failed' % (sent, failed))
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,94 @@
+'''
+Metrics of ivatar, exported in the Prometheus text format on /metrics
+
+Pre-forked WSGI servers need to set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by all workers, see INSTALL.md.
+'''
+import os
+
+from prometheus_client import Counter, Histogram
+from prometheus_client import CollectorRegistry, REGISTRY
+from prometheus_client import multiprocess
+
+# Sizes are bucketed, to keep the number of label values small
+SIZE_CLASSES = (16, 32, 48, 64, 80, 96, 128, 256, 512)
+
+AVATAR_REQUESTS = Counter(
+    'ivatar_avatar_requests_total',
+    'Avatar requests by outcome and default style',
+    ['outcome', 'style'])
+GRAVATARPROXY_REQUESTS = Counter(
+    'ivatar_gravatarproxy_requests_total',
+    'Gravatar proxy requests by outcome',
+    ['outcome'])
+CACHE_REQUESTS = Counter(
+    'ivatar_cache_requests_total',
+    'Cache lookups by cache and result (hit or miss)',
+    ['cache', 'result'])
+UPSTREAM_DURATION = Histogram(
+    'ivatar_upstream_request_duration_seconds',
+    'Duration of requests to upstream services',
+    ['upstream'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+UPSTREAM_ERRORS = Counter(
+    'ivatar_upstream_errors_total',
+    'Failed requests to upstream services, by HTTP status or error kind',
+    ['upstream', 'code'])
+RENDER_DURATION = Histogram(
+    'ivatar_render_duration_seconds',
+    'Time to decode, resize and encode a photo, by requested size',
+    ['size'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+STAGE_DURATION = Histogram(
+    'ivatar_stage_duration_seconds',
+    'Duration of the stages timed by ivatar.timing',
+    ['view', 'stage'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+DB_QUERIES = Histogram(
+    'ivatar_db_queries_per_request',
+    'Number of database queries per request, by view',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+
+
+def size_class(size):
+    '''
+    Return the label value for the given avatar size
+    '''
+    for bound in SIZE_CLASSES:
+        if size <= bound:
+            return str(bound)
+    return '+Inf'
+
+
+def count_cache(cache, hit):
+    '''
+    Count a cache lookup
+    '''
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def get_registry():
+    '''
+    Return the registry to export - in multi process mode the metrics of
+    all workers are aggregated from PROMETHEUS_MULTIPROC_DIR
+    '''
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ or \
+            'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+class QueryCounter:  # pylint: disable=too-few-public-methods
+    '''
+    Database execute wrapper counting the queries
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
@@ -1,8 +1,14 @@
 """
 Middleware classes
 """
+from contextlib import ExitStack
+
+from django.db import connections
 from django.utils.deprecation import MiddlewareMixin
 
+from ivatar.metrics import DB_QUERIES, QueryCounter
+
+
 class MultipleProxyMiddleware(MiddlewareMixin):  # pylint: disable=too-few-public-methods
     """
     Middleware to rewrite proxy headers for deployments
@@ -16,3 +22,26 @@ class MultipleProxyMiddleware(MiddlewareMixin):  # pylint: disable=too-few-publi
         """
         if 'HTTP_X_FORWARDED_SERVER' in request.META:
             request.META['HTTP_X_FORWARDED_HOST'] = request.META['HTTP_X_FORWARDED_SERVER']
+
+
+class MetricsMiddleware:  # pylint: disable=too-few-public-methods
+    """
+    Middleware recording the number of database queries per request
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        # Count the queries on the read replicas as well
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(counter))
+            response = self.get_response(request)
+        if request.resolver_match and request.resolver_match.url_name:
+            view = request.resolver_match.url_name
+        else:
+            view = 'unknown'
+        DB_QUERIES.labels(view).observe(counter.count)
+        return response
@@ -0,0 +1,69 @@
+'''
+Unit tests for the two-tier cache backend
+'''
+import unittest
+
+import os
+import django
+from django.core.cache import caches
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from ivatar.cache import TieredCache, CacheProxy
+# pylint: enable=wrong-import-position
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test the local tier in front of the shared cache
+    '''
+
+    def setUp(self):
+        self.shared = caches['default']
+        self.shared.clear()
+        self.cache = TieredCache('default', {
+            'OPTIONS': {'MAX_ENTRIES': 10, 'LOCAL_TIMEOUT': 30}})
+        self.cache.local.clear()
+
+    def test_write_through(self):
+        '''
+        Writes go to both tiers
+        '''
+        self.cache.set('key', 'value')
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.shared.get('key'), 'value')
+        self.assertEqual(self.cache.local.get('key'), 'value')
+        self.assertEqual(self.shared.get_many(['a', 'b']), {'a': 1, 'b': 2})
+
+        self.cache.delete('key')
+        self.assertIsNone(self.shared.get('key'))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_local_first(self):
+        '''
+        Reads are served locally, misses are filled from the shared tier
+        '''
+        self.shared.set_many({'a': 1, 'b': 2})
+        self.cache.local.set('a', 'local')
+        self.assertEqual(self.cache.get('a'), 'local')
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c']), {'a': 'local', 'b': 2})
+        self.assertEqual(self.cache.local.get('b'), 2)
+        self.assertEqual(self.cache.get('c', 'default'), 'default')
+
+    def test_add(self):
+        '''
+        add() only succeeds if the shared tier has no value yet
+        '''
+        self.shared.set('key', 'other')
+        self.assertFalse(self.cache.add('key', 'value'))
+        self.assertTrue(self.cache.add('new', 'value'))
+        self.assertEqual(self.cache.local.get('new'), 'value')
+
+    def test_proxy(self):
+        '''
+        The proxy uses the cache of its alias
+        '''
+        CacheProxy('default').set('key', 'value')
+        self.assertEqual(self.shared.get('key'), 'value')
@@ -0,0 +1,79 @@
+'''
+Unit tests for the read replica routing
+'''
+import unittest
+from unittest import mock
+
+import os
+import django
+from django.http import HttpResponse
+from django.test import RequestFactory
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from ivatar import db_router
+from ivatar.ivataraccount.models import Photo
+# pylint: enable=wrong-import-position
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test the router and the pinning to the primary
+    '''
+
+    def setUp(self):
+        patcher = mock.patch.object(db_router, 'REPLICAS', ['replica0'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = db_router.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_primary_by_default(self):
+        '''
+        Outside of replica_reads() everything uses the primary
+        '''
+        self.assertEqual(self.router.db_for_read(Photo), 'default')
+        self.assertEqual(self.router.db_for_write(Photo), 'default')
+
+    def test_replica_reads(self):
+        '''
+        Inside replica_reads() only the reads use the replica
+        '''
+        with db_router.replica_reads(self.factory.get('/avatar/')):
+            self.assertEqual(self.router.db_for_read(Photo), 'replica0')
+            self.assertEqual(self.router.db_for_write(
+                Photo, instance=Photo()), 'default')
+        self.assertEqual(self.router.db_for_read(Photo), 'default')
+
+    def test_without_replicas(self):
+        '''
+        Without replicas, replica_reads() reads from the primary
+        '''
+        with mock.patch.object(db_router, 'REPLICAS', []):
+            with db_router.replica_reads():
+                self.assertEqual(self.router.db_for_read(Photo), 'default')
+
+    def test_pinning(self):
+        '''
+        Unsafe requests pin the client to the primary
+        '''
+        middleware = db_router.ReplicaPinningMiddleware(
+            lambda request: HttpResponse())
+        response = middleware(self.factory.get('/accounts/profile/'))
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)
+        response = middleware(self.factory.post('/accounts/upload_photo/'))
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+
+        request = self.factory.get('/avatar/')
+        request.COOKIES[db_router.PIN_COOKIE] = '1'
+        with db_router.replica_reads(request):
+            self.assertEqual(self.router.db_for_read(Photo), 'default')
+
+    def test_migrate(self):
+        '''
+        Only the primary gets migrated
+        '''
+        self.assertTrue(self.router.allow_migrate('default', 'ivataraccount'))
+        self.assertFalse(
+            self.router.allow_migrate('replica0', 'ivataraccount'))
@@ -0,0 +1,80 @@
+'''
+Unit tests for the identity digests
+'''
+import unittest
+
+import os
+import django
+from libravatar import parse_user_identity
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from ivatar import digests
+# pylint: enable=wrong-import-position
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test the normalisation and digests
+    '''
+
+    def test_email(self):
+        '''
+        Addresses are stripped and lower cased before hashing
+        '''
+        (md5, sha256) = digests.email_digests(' User@Example.ORG ')
+        self.assertEqual(md5, '572c3489ea700045927076136a969e27')
+        self.assertEqual(
+            sha256,
+            'd159ef624ed86697b4f1f3ff086aacddfdfd42d463a8003694f775e1e2d95e2c')
+        self.assertEqual(
+            digests.email_digests('user@example.org'), (md5, sha256))
+
+    def test_openid(self):
+        '''
+        Scheme and host name are lower cased, the path is kept
+        '''
+        self.assertEqual(
+            digests.normalize_openid('HTTPS://User:Pw@Example.ORG/Me'),
+            'https://User:Pw@example.org/Me')
+        self.assertEqual(
+            digests.openid_digest('HTTPS://Example.ORG/Me'),
+            digests.openid_digest('https://example.org/Me'))
+
+    def test_same_as_libravatar(self):
+        '''
+        user_identity() matches libravatar.parse_user_identity()
+        '''
+        for (email, openid) in (
+                (' User@Example.ORG', None),
+                (None, 'HTTP://Example.ORG/user/'),
+                (None, 'https://user:pw@Example.ORG/'),
+                (None, None)):
+            self.assertEqual(
+                digests.user_identity(email, openid),
+                parse_user_identity(email, openid))
+
+    def test_batch(self):
+        '''
+        The batch helpers match the single ones, keyed by the given value
+        '''
+        emails = [' User@Example.ORG', 'user@example.org', 'other@example.org']
+        self.assertEqual(
+            digests.batch_email_digests(emails),
+            {email: digests.email_digests(email) for email in emails})
+        openids = ['HTTP://Example.ORG/me', 'http://example.org/me']
+        self.assertEqual(
+            digests.batch_openid_digests(iter(openids)),
+            {openid: digests.openid_digest(openid) for openid in openids})
+        self.assertEqual(digests.batch_email_digests([]), {})
+
+    def test_split_digests(self):
+        '''
+        Digests are sorted by length, lower cased, invalid ones dropped
+        '''
+        md5 = digests.email_digests('user@example.org')[0]
+        sha256 = digests.openid_digest('http://example.org/me')
+        self.assertEqual(
+            digests.split_digests([md5.upper(), sha256, 'invalid', md5]),
+            ({md5}, {sha256}))
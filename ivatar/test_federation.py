@@ -0,0 +1,232 @@
+'''
+Unit tests for the federated avatar lookup
+'''
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import os
+import django
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from django.core.cache.backends.locmem import LocMemCache
+import DNS
+from ivatar import federation
+from ivatar.federation import SRVRecord
+# pylint: enable=wrong-import-position
+
+
+class FakeQuery:
+    '''
+    Stand-in for query_srv(), counting the lookups
+    '''
+
+    def __init__(self, result):
+        self.result = result
+        self.names = []
+
+    def __call__(self, name):
+        self.names.append(name)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Answer like an avatar server, or redirect /redirect to a private address
+    '''
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''
+        Handle get - return an empty image or a redirect
+        '''
+        if self.path.startswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', 'http://169.254.169.254/')
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        '''
+        Keep the test output clean
+        '''
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test server selection and caching
+    '''
+
+    def setUp(self):
+        self.now = 1000.0
+        self.shared_cache = LocMemCache('federation-test', {})
+        self.shared_cache.clear()
+
+    def resolver(self, query):
+        '''
+        Return a resolver using the given query function and a fake clock
+        '''
+        return federation.FederationResolver(
+            query=query, shared_cache=self.shared_cache,
+            clock=lambda: self.now)
+
+    def test_select_priority(self):
+        '''
+        The lowest priority wins, default ports are dropped
+        '''
+        records = [
+            SRVRecord(10, 0, 80, 'backup.example.org.'),
+            SRVRecord(0, 0, 80, 'avatars.example.org.'),
+        ]
+        for _ in range(10):
+            self.assertEqual(
+                federation.select_server(records, False),
+                'avatars.example.org')
+
+    def test_select_weight_and_port(self):
+        '''
+        Zero weight servers lose against weighted ones, other ports stay
+        '''
+        records = [
+            SRVRecord(0, 0, 443, 'never.example.org.'),
+            SRVRecord(0, 5, 8443, 'avatars.example.org.'),
+        ]
+        for _ in range(10):
+            self.assertEqual(
+                federation.select_server(records, True),
+                'avatars.example.org:8443')
+
+    def test_select_unavailable(self):
+        '''
+        No records or a "." target mean no delegation
+        '''
+        self.assertIsNone(federation.select_server([], False))
+        self.assertIsNone(federation.select_server(
+            [SRVRecord(0, 0, 80, '.')], False))
+
+    def test_positive_caching(self):
+        '''
+        Records are cached until their TTL expires
+        '''
+        query = FakeQuery(([SRVRecord(0, 0, 80, 'avatars.example.org')], 60))
+        resolver = self.resolver(query)
+        self.assertEqual(
+            resolver.server('Example.org'), 'avatars.example.org')
+        self.assertEqual(
+            resolver.server('example.org'), 'avatars.example.org')
+        self.assertEqual(query.names, ['_avatars._tcp.example.org'])
+
+        # Another process only sees the shared cache
+        other = self.resolver(query)
+        self.assertEqual(other.server('example.org'), 'avatars.example.org')
+        self.assertEqual(len(query.names), 1)
+
+        self.now += 61
+        resolver.server('example.org')
+        self.assertEqual(len(query.names), 2)
+
+    def test_negative_caching(self):
+        '''
+        Missing records and failed lookups are cached as well
+        '''
+        query = FakeQuery(([], None))
+        resolver = self.resolver(query)
+        self.assertIsNone(resolver.server('example.org', https=True))
+        self.assertIsNone(resolver.server('example.org', https=True))
+        self.assertEqual(query.names, ['_avatars-sec._tcp.example.org'])
+
+        query = FakeQuery(DNS.DNSError('timeout'))
+        resolver = self.resolver(query)
+        self.assertIsNone(resolver.server('example.com'))
+        self.assertIsNone(resolver.server('example.com'))
+        self.assertEqual(len(query.names), 1)
+
+        self.now += federation.FEDERATION_NEGATIVE_TTL + 1
+        resolver.server('example.com')
+        self.assertEqual(len(query.names), 2)
+
+    def test_check_domain(self):
+        '''
+        Every target is probed, in parallel, at the checked address
+        '''
+        def query(name):
+            if name.startswith('_avatars-sec'):
+                return ([], None)
+            return ([
+                SRVRecord(0, 1, 80, 'avatars.example.org.'),
+                SRVRecord(0, 1, 8080, 'backup.example.org.'),
+                SRVRecord(10, 0, 80, '.'),
+            ], 3600)
+
+        # Both probes must be running at the same time to get past this
+        barrier = threading.Barrier(2, timeout=10)
+        probed = []
+
+        def probe(url, address):
+            barrier.wait()
+            probed.append((url, address))
+            return (200, None, 1.0)
+
+        services = federation.check_domain(
+            'Example.org.', query=query, probe=probe,
+            resolve=lambda host, port: '192.0.2.1')
+
+        self.assertEqual(
+            [service['name'] for service in services],
+            ['_avatars._tcp.example.org', '_avatars-sec._tcp.example.org'])
+        self.assertEqual(services[1]['records'], [])
+        records = services[0]['records']
+        self.assertEqual([record['status'] for record in records[:2]],
+                         [200, 200])
+        self.assertIsNone(records[2]['url'])
+        self.assertEqual(
+            sorted(probed), sorted(
+                (record['url'], '192.0.2.1') for record in records[:2]))
+
+    def test_probe_server(self):
+        '''
+        Probes connect to the given address and don't follow redirects
+        '''
+        stub = HTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+
+        # The host name doesn't resolve, only the address is used
+        url = 'http://avatars.invalid:%i/avatar/%s?s=80' % (
+            stub.server_port, '0' * 32)
+        (status, error, latency) = federation.probe_server(url, '127.0.0.1')
+        self.assertEqual((status, error), (200, None))
+        self.assertGreater(latency, 0)
+
+        url = 'http://avatars.invalid:%i/redirect?s=80' % stub.server_port
+        (status, error, _) = federation.probe_server(url, '127.0.0.1')
+        self.assertEqual(status, 302)
+        self.assertIn('169.254.169.254', error)
+        self.assertIn('not followed', error)
+
+    def test_check_domain_private(self):
+        '''
+        Targets with private, loopback or link-local addresses aren't probed
+        '''
+        probed = []
+
+        def query(name):  # pylint: disable=unused-argument
+            return ([SRVRecord(0, 1, 22, '127.0.0.1.')], 3600)
+
+        services = federation.check_domain(
+            'example.org', query=query,
+            probe=lambda url, address: probed.append(url))
+        self.assertEqual(probed, [])
+        self.assertIn('public', services[0]['records'][0]['error'])
+
+        for address in ('127.0.0.1', '10.1.2.3', '192.168.0.1',
+                        '169.254.169.254', '::1', 'fe80::1', '0.0.0.0'):
+            self.assertIsNone(federation.public_address(address, 80), address)
+        self.assertEqual(federation.public_address('8.8.8.8', 80), '8.8.8.8')
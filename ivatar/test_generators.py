@@ -0,0 +1,52 @@
+'''
+Unit tests for the lazily loaded avatar generators
+'''
+import unittest
+from unittest import mock
+
+import os
+import django
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from ivatar import generators
+# pylint: enable=wrong-import-position
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test the generator registry
+    '''
+
+    def setUp(self):
+        generators.get_generator.cache_clear()
+        self.addCleanup(generators.get_generator.cache_clear)
+
+    def test_imported_once(self):
+        '''
+        Generators are imported on first use only
+        '''
+        with mock.patch.object(
+                generators, 'import_string', return_value=len) as importer:
+            self.assertIs(generators.get_generator('robohash'), len)
+            self.assertIs(generators.get_generator('robohash'), len)
+        importer.assert_called_once_with('robohash.Robohash')
+
+    def test_preload(self):
+        '''
+        preload() imports all generators
+        '''
+        with mock.patch.object(
+                generators, 'import_string', return_value=len) as importer:
+            generators.preload()
+        self.assertEqual(
+            sorted(call[0][0] for call in importer.call_args_list),
+            sorted(generators.GENERATORS.values()))
+
+    def test_unknown(self):
+        '''
+        Unknown generators aren't looked up
+        '''
+        with self.assertRaises(KeyError):
+            generators.get_generator('unknown')
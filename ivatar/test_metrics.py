@@ -0,0 +1,62 @@
+'''
+Unit tests for the metrics
+'''
+import unittest
+
+import os
+import django
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from prometheus_client import generate_latest
+from ivatar import metrics
+from ivatar.middleware import MetricsMiddleware
+# pylint: enable=wrong-import-position
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test metric helpers and the query counting middleware
+    '''
+
+    def test_size_class(self):
+        '''
+        Sizes are mapped to a small set of label values
+        '''
+        self.assertEqual(metrics.size_class(1), '16')
+        self.assertEqual(metrics.size_class(80), '80')
+        self.assertEqual(metrics.size_class(81), '96')
+        self.assertEqual(metrics.size_class(512), '512')
+        self.assertEqual(metrics.size_class(513), '+Inf')
+
+    def test_count_cache(self):
+        '''
+        Cache lookups show up in the exported metrics
+        '''
+        metrics.count_cache('test', True)
+        metrics.count_cache('test', False)
+        output = generate_latest(metrics.get_registry()).decode('utf-8')
+        self.assertIn(
+            'ivatar_cache_requests_total{cache="test",result="hit"}', output)
+        self.assertIn(
+            'ivatar_cache_requests_total{cache="test",result="miss"}', output)
+
+    def test_middleware_counts_queries(self):
+        '''
+        The middleware counts the queries done while handling the request
+        '''
+        def get_response(request):  # pylint: disable=unused-argument
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        before = metrics.DB_QUERIES.labels('unknown')._sum.get()  # pylint: disable=protected-access
+        MetricsMiddleware(get_response)(request)
+        after = metrics.DB_QUERIES.labels('unknown')._sum.get()  # pylint: disable=protected-access
+        self.assertEqual(after - before, 1)
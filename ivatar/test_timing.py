@@ -0,0 +1,71 @@
+'''
+Unit tests for the stage timing
+'''
+import unittest
+
+import os
+import django
+from django.http import HttpResponse
+from django.test import RequestFactory
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from ivatar import timing
+# pylint: enable=wrong-import-position
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test timers and histograms
+    '''
+
+    def setUp(self):
+        timing.HISTOGRAMS.clear()
+
+    def test_null_timer(self):
+        '''
+        Disabled timing must neither record nor add headers
+        '''
+        response = HttpResponse()
+        with timing.NULL_TIMER.stage('lookup'):
+            pass
+        timing.NULL_TIMER.finish(response)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(timing.HISTOGRAMS.as_dict(), {})
+
+    def test_stage_timer(self):
+        '''
+        Stages are recorded in the histograms and the Server-Timing header
+        '''
+        request = RequestFactory().get('/', HTTP_X_IVATAR_TIMING='1')
+        timer = timing.StageTimer(
+            'AvatarImageView',
+            server_timing=timing.TIMING_HEADER in request.META)
+        with timer.stage('lookup'):
+            pass
+        with timer.stage('encode'):
+            pass
+        response = timer.finish(HttpResponse())
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^lookup;dur=[0-9.]+, encode;dur=[0-9.]+, total;dur=[0-9.]+$')
+        histograms = timing.HISTOGRAMS.as_dict()['AvatarImageView']
+        self.assertEqual(
+            sorted(histograms.keys()), ['encode', 'lookup', 'total'])
+        self.assertEqual(histograms['lookup']['count'], 1)
+        self.assertEqual(histograms['lookup']['buckets']['+Inf'], 1)
+
+    def test_histogram_buckets(self):
+        '''
+        Bucket counts are cumulative
+        '''
+        histogram = timing.Histogram()
+        for duration in (0.5, 3, 3, 10000):
+            histogram.observe(duration)
+        data = histogram.as_dict()
+        self.assertEqual(data['buckets']['1'], 1)
+        self.assertEqual(data['buckets']['5'], 3)
+        self.assertEqual(data['buckets']['5000'], 3)
+        self.assertEqual(data['buckets']['+Inf'], 4)
+        self.assertEqual(data['count'], 4)
@@ -0,0 +1,65 @@
+'''
+Rendering of small photo tiles, for /sprite/ and the profile thumbnails
+'''
+from io import BytesIO
+from os import path
+
+from django.core.cache import caches
+from PIL import Image
+
+from ivatar.settings import TILE_CACHE_TIMEOUT, logger
+from ivatar.metrics import count_cache
+from ivatar.ivataraccount.models import Photo, photo_etag
+
+
+def render_tiles(photos, size):
+    '''
+    Return {photo id: PNG data} of the (photo id, modified) pairs
+
+    Rendered tiles are cached, keyed by their ETag, so they never need
+    to be invalidated; the image data is only fetched for misses. Photos
+    deleted in the meantime, or which can't be decoded, are left out.
+    '''
+    keys = {
+        photo_id: 'tile:%s:%i' % (
+            photo_etag(photo_id, modified).strip('"'), size)
+        for (photo_id, modified) in photos}
+    cached = caches['renders'].get_many(keys.values())
+    tiles = {}
+    for (photo_id, key) in keys.items():
+        count_cache('tile', key in cached)
+        if key in cached:
+            tiles[photo_id] = cached[key]
+
+    rendered = {}
+    for photo in Photo.objects.filter(
+            pk__in=[key for key in keys if key not in tiles]).only(
+                'data', 'format'):
+        try:
+            img = Image.open(BytesIO(photo.data))
+            img.thumbnail((size, size), Image.ANTIALIAS)
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            logger.warning('Cannot render photo %i: %s', photo.pk, exc)
+            continue
+        if img.mode not in ('RGB', 'RGBA'):
+            # eg. CMYK JPEGs, which can't be saved as PNG
+            img = img.convert('RGBA')
+        data = BytesIO()
+        img.save(data, 'PNG')
+        tiles[photo.pk] = rendered[keys[photo.pk]] = data.getvalue()
+    if rendered:
+        caches['renders'].set_many(rendered, TILE_CACHE_TIMEOUT)
+    return tiles
+
+
+def nobody_tile(size):
+    '''
+    Return the default image in the given size
+    '''
+    static_img = path.join('static', 'img', 'nobody', '%s%s' % (str(size), '.png'))
+    if not path.isfile(static_img):
+        # We trust this exists!!!
+        static_img = path.join('static', 'img', 'nobody', '512.png')
+    img = Image.open(static_img)
+    img.thumbnail((size, size), Image.ANTIALIAS)
+    return img
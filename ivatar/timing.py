@@ -0,0 +1,207 @@
+'''
+Per-stage timing of the avatar views
+
+Views using StageTimingMixin get a timer in self.timer and wrap the
+interesting parts in "with self.timer.stage('name'):". With STAGE_TIMING
+disabled the timer is a shared no-op object, so the only cost left is a
+method call per stage. Enabled, the durations are aggregated into
+in-process histograms and, if the client sends a "X-Ivatar-Timing"
+header, returned in a Server-Timing response header. They are exported
+on /metrics as well.
+'''
+import threading
+import time
+
+from ivatar.settings import STAGE_TIMING
+from ivatar.metrics import STAGE_DURATION
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+TIMING_HEADER = 'HTTP_X_IVATAR_TIMING'
+
+
+class Histogram:
+    '''
+    Cumulative histogram of durations (in milliseconds)
+    '''
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, duration):
+        '''
+        Add a single duration
+        '''
+        for (index, bound) in enumerate(BUCKETS):
+            if duration <= bound:
+                break
+        else:
+            index = len(BUCKETS)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += duration
+
+    def as_dict(self):
+        '''
+        Return the histogram with cumulative bucket counts
+        '''
+        buckets = {}
+        cumulative = 0
+        for (bound, count) in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+class HistogramRegistry:
+    '''
+    Histograms per (view, stage), shared by all threads of this process
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, view, durations):
+        '''
+        Add the stage durations of a single request
+        '''
+        with self._lock:
+            for (stage, duration) in durations:
+                key = (view, stage)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram()
+                self._histograms[key].observe(duration)
+
+    def as_dict(self):
+        '''
+        Return all histograms, keyed by view and stage
+        '''
+        with self._lock:
+            result = {}
+            for ((view, stage), histogram) in sorted(self._histograms.items()):
+                result.setdefault(view, {})[stage] = histogram.as_dict()
+            return result
+
+    def clear(self):
+        '''
+        Forget everything recorded so far
+        '''
+        with self._lock:
+            self._histograms.clear()
+
+
+HISTOGRAMS = HistogramRegistry()
+
+
+class _NullStage:  # pylint: disable=too-few-public-methods
+    '''
+    Context manager doing nothing at all
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTimer:
+    '''
+    Timer used when stage timing is disabled
+    '''
+    _stage = _NullStage()
+
+    def stage(self, name):  # pylint: disable=unused-argument
+        '''
+        Nothing to time
+        '''
+        return self._stage
+
+    def finish(self, response):  # pylint: disable=unused-argument,no-self-use
+        '''
+        Nothing to record
+        '''
+        return response
+
+
+NULL_TIMER = NullTimer()
+
+
+class _Stage:  # pylint: disable=too-few-public-methods
+    '''
+    Context manager timing a single stage
+    '''
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.durations.append(
+            (self.name, (time.perf_counter() - self.start) * 1000))
+        return False
+
+
+class StageTimer:
+    '''
+    Timer collecting the stage durations of a single request
+    '''
+
+    def __init__(self, view, server_timing=False):
+        self.view = view
+        self.server_timing = server_timing
+        self.durations = []
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        '''
+        Return a context manager timing the named stage
+        '''
+        return _Stage(self, name)
+
+    def finish(self, response):
+        '''
+        Record the durations and add the Server-Timing header if asked for
+        '''
+        self.durations.append(
+            ('total', (time.perf_counter() - self.start) * 1000))
+        HISTOGRAMS.observe(self.view, self.durations)
+        for (stage, duration) in self.durations:
+            STAGE_DURATION.labels(self.view, stage).observe(duration / 1000)
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join(
+                '%s;dur=%.2f' % (stage, duration)
+                for (stage, duration) in self.durations)
+        return response
+
+
+def get_timer(request, view):
+    '''
+    Return the timer to use for this request
+    '''
+    if not STAGE_TIMING:
+        return NULL_TIMER
+    return StageTimer(view, server_timing=TIMING_HEADER in request.META)
+
+
+class StageTimingMixin:  # pylint: disable=too-few-public-methods
+    '''
+    Mixin providing self.timer to views
+    '''
+    timer = NULL_TIMER
+
+    def dispatch(self, request, *args, **kwargs):
+        '''
+        Time the whole request and record the stages
+        '''
+        self.timer = get_timer(request, self.__class__.__name__)
+        response = super().dispatch(request, *args, **kwargs)
+        return self.timer.finish(response)
@@ -0,0 +1,154 @@
+'''
+Batch computation of avatar digests and URLs
+'''
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+
+from libravatar import parse_options
+
+from ivatar.digests import batch_email_digests, batch_openid_digests
+from ivatar.digests import email_domain, openid_domain
+from ivatar.federation import RESOLVER
+from ivatar.settings import BASE_URL, SECURE_BASE_URL, BATCH_RESOLVE_WORKERS
+
+# Addresses whose domains are resolved together
+CHUNK_SIZE = 1000
+
+
+def base_urls(domain):
+    '''
+    Return the (http, https) base URLs for avatars of the domain
+    '''
+    result = []
+    for (https, scheme, default) in (
+            (False, 'http', BASE_URL), (True, 'https', SECURE_BASE_URL)):
+        server = RESOLVER.server(domain, https) if domain else None
+        result.append('%s://%s/avatar/' % (scheme, server) if server
+                      else default)
+    return tuple(result)
+
+
+def resolve_domains(domains, timeout=None):
+    '''
+    Return {domain: (http, https) base URLs} of the domains
+
+    The domains are resolved concurrently by BATCH_RESOLVE_WORKERS
+    threads. Those not resolved within timeout seconds (if given) are
+    left out.
+    '''
+    domains = list(domains)
+    if not domains:
+        return {}
+    executor = ThreadPoolExecutor(
+        max_workers=min(BATCH_RESOLVE_WORKERS, len(domains)))
+    futures = {}
+    try:
+        futures = {
+            executor.submit(base_urls, domain): domain for domain in domains}
+        wait(futures, timeout=timeout)
+    finally:
+        for future in futures:
+            future.cancel()
+        # Don't wait for late answers; the DNS timeout ends them soon
+        executor.shutdown(wait=False)
+    return {
+        domain: future.result() for (future, domain) in futures.items()
+        if future.done() and not future.cancelled()
+        and not future.exception()}
+
+
+def avatar_urls(addresses, size=None, default=None, timeout=None,
+                max_domains=None, clock=time.monotonic):
+    '''
+    Yield a dict with digests and URLs for each (kind, address) pair
+
+    kind is either 'email' or 'openid'. The addresses are handled in
+    chunks of CHUNK_SIZE, the distinct new domains of a chunk are
+    resolved concurrently and only once per call, so all addresses of a
+    domain share the same server even if the domain lists several.
+
+    With a timeout, the lookups stop after that many seconds in total,
+    and with max_domains, after that many domains; the addresses of the
+    domains not resolved get our URLs and "unresolved": true.
+    '''
+    query_string = parse_options(default, size)
+    deadline = clock() + timeout if timeout is not None else None
+    domains = {}
+    unresolved = set()
+    addresses = iter(addresses)
+    while True:
+        chunk = list(islice(addresses, CHUNK_SIZE))
+        if not chunk:
+            return
+        entries = _entries(chunk)
+        # In the order of appearance, for max_domains
+        new = list(dict.fromkeys(
+            entry['domain'] for entry in entries if 'domain' in entry
+            and entry['domain'] not in domains
+            and entry['domain'] not in unresolved))
+        if max_domains is not None:
+            allowed = max(max_domains - len(domains) - len(unresolved), 0)
+            unresolved.update(new[allowed:])
+            new = new[:allowed]
+        if deadline is None:
+            domains.update(resolve_domains(new))
+        elif deadline > clock():
+            domains.update(resolve_domains(new, deadline - clock()))
+        unresolved.update(domain for domain in new if domain not in domains)
+
+        for entry in entries:
+            if 'error' in entry:
+                yield entry
+                continue
+            domain = entry.pop('domain')
+            digest = entry.pop('digest')
+            if domain in domains:
+                urls = domains[domain]
+            else:
+                urls = (BASE_URL, SECURE_BASE_URL)
+                entry['unresolved'] = True
+            entry['url'] = urls[0] + digest + query_string
+            entry['url_secure'] = urls[1] + digest + query_string
+            yield entry
+
+
+def _entries(chunk):
+    '''
+    Return the entries of the (kind, address) pairs, with their digests,
+    plus the digest used in the URLs and the domain
+    '''
+    entries = []
+    for (kind, address) in chunk:
+        entry = {kind: address}
+        if not isinstance(address, str) or not address.strip() or \
+                (kind == 'email' and '@' not in address):
+            entry['error'] = 'invalid %s' % kind
+        entries.append(entry)
+    valid = [entry for entry in entries if 'error' not in entry]
+    emails = batch_email_digests(
+        entry['email'] for entry in valid if 'email' in entry)
+    openids = batch_openid_digests(
+        entry['openid'] for entry in valid if 'openid' in entry)
+
+    for entry in valid:
+        if 'email' in entry:
+            (entry['md5'], entry['sha256']) = emails[entry['email']]
+            entry['digest'] = entry['md5']
+            entry['domain'] = email_domain(entry['email'])
+        else:
+            entry['sha256'] = entry['digest'] = openids[entry['openid']]
+            entry['domain'] = openid_domain(entry['openid'])
+    return entries
+
+
+def stream_json(entries):
+    '''
+    Yield the entries as a JSON array, piece by piece
+    '''
+    separator = '[\n'
+    for entry in entries:
+        yield separator + json.dumps(entry)
+        separator = ',\n'
+    yield '[]' if separator == '[\n' else '\n]'
@@ -1,7 +1,10 @@
 '''
 Classes for our ivatar.tools.forms
 '''
+import re
+
 from django import forms
+from django.core.validators import URLValidator
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 
@@ -9,21 +12,30 @@ from ivatar.settings import AVATAR_MAX_SIZE
 from ivatar.settings import MIN_LENGTH_URL, MAX_LENGTH_URL
 from ivatar.settings import MIN_LENGTH_EMAIL, MAX_LENGTH_EMAIL
 
+MAX_LENGTH_DOMAIN = 253
+
 
 class CheckDomainForm(forms.Form):
     '''
     Form handling domain check
     '''
-    can_distribute = forms.TextInput(
-        attrs={
-            'label': _('Domain'),
-            'required': True,
-            'error_messages': {
-                'required':
-                _('Cannot check without a domain name.')
-            }
-        }
-    )
+    domain = forms.CharField(
+        label=_('Domain'),
+        required=True,
+        max_length=MAX_LENGTH_DOMAIN,
+        error_messages={
+            'required':
+            _('Cannot check without a domain name.')
+        })
+
+    def clean_domain(self):
+        '''
+        Return the domain in lower case, if it looks like one
+        '''
+        domain = self.cleaned_data['domain'].strip().lower().rstrip('.')
+        if not re.fullmatch(URLValidator.host_re, domain):
+            raise ValidationError(_('Invalid domain name'))
+        return domain
 
 
 class CheckForm(forms.Form):
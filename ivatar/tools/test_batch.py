@@ -0,0 +1,135 @@
+'''
+Unit tests for the batch URL computation
+'''
+import json
+import threading
+import unittest
+from unittest import mock
+
+import os
+import django
+os.environ['DJANGO_SETTINGS_MODULE'] = 'ivatar.settings'
+django.setup()
+
+# pylint: disable=wrong-import-position
+from django.core.cache import cache
+from ivatar.federation import RESOLVER, SRVRecord
+from ivatar.settings import BASE_URL, SECURE_BASE_URL
+from ivatar.tools.batch import avatar_urls, stream_json
+# pylint: enable=wrong-import-position
+
+
+class TestCase(unittest.TestCase):
+    '''
+    Test digests, URLs and the JSON streaming
+    '''
+
+    def setUp(self):
+        RESOLVER.clear()
+        cache.clear()
+        self.names = []
+
+        def query(name):
+            self.names.append(name)
+            if name.endswith('.delegated.org'):
+                return ([SRVRecord(0, 0, 8080, 'avatars.delegated.org.')], 60)
+            return ([], None)
+        patcher = mock.patch.object(RESOLVER, 'query', query)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(RESOLVER.clear)
+
+    def test_avatar_urls(self):
+        '''
+        Digests match the ones of the models, delegation is honoured
+        '''
+        entries = list(avatar_urls([
+            ('email', ' User@Example.org '),
+            ('email', 'other@example.org'),
+            ('email', 'someone@delegated.org'),
+            ('openid', 'http://Example.org/user/'),
+            ('email', 'not an address'),
+            ('openid', 42),
+        ], size=80, default='mm'))
+
+        self.assertEqual(
+            entries[0]['md5'], '572c3489ea700045927076136a969e27')
+        self.assertEqual(
+            entries[0]['url'],
+            BASE_URL + '572c3489ea700045927076136a969e27?d=mm&s=80')
+        self.assertEqual(
+            entries[0]['url_secure'],
+            SECURE_BASE_URL + '572c3489ea700045927076136a969e27?d=mm&s=80')
+        self.assertEqual(len(entries[0]['sha256']), 64)
+        self.assertEqual(
+            entries[2]['url'],
+            'http://avatars.delegated.org:8080/avatar/%s?d=mm&s=80' %
+            entries[2]['md5'])
+        self.assertNotIn('md5', entries[3])
+        self.assertEqual(entries[3]['sha256'], entries[3]['url'][-74:-10])
+        self.assertEqual(entries[4]['error'], 'invalid email')
+        self.assertEqual(entries[5]['error'], 'invalid openid')
+        # Every domain is resolved once per scheme
+        self.assertEqual(len(self.names), 4)
+
+    def test_resolve_concurrently(self):
+        '''
+        Domains are resolved in parallel
+        '''
+        # All lookups must be running at the same time to get past this
+        barrier = threading.Barrier(4, timeout=10)
+
+        def query(name):  # pylint: disable=unused-argument
+            barrier.wait()
+            return ([], None)
+
+        addresses = [
+            ('email', 'user@%i.example.org' % index) for index in range(4)]
+        with mock.patch.object(RESOLVER, 'query', query):
+            entries = list(avatar_urls(addresses, timeout=60))
+        self.assertFalse([entry for entry in entries if 'unresolved' in entry])
+
+    def test_resolve_deadline(self):
+        '''
+        Domains are not resolved beyond the timeout
+        '''
+        now = [0]
+
+        def query(name):
+            self.names.append(name)
+            # As if the lookups took all the time
+            now[0] = 100
+            return ([], None)
+
+        addresses = [('email', 'user@first.org'), ('email', 'user@second.org')]
+        with mock.patch('ivatar.tools.batch.CHUNK_SIZE', 1), \
+                mock.patch.object(RESOLVER, 'query', query):
+            entries = list(avatar_urls(
+                addresses, timeout=10, clock=lambda: now[0]))
+        self.assertNotIn('unresolved', entries[0])
+        self.assertTrue(entries[1]['unresolved'])
+        self.assertEqual(entries[1]['url'][:len(BASE_URL)], BASE_URL)
+        self.assertEqual(
+            sorted(self.names),
+            ['_avatars-sec._tcp.first.org', '_avatars._tcp.first.org'])
+
+    def test_max_domains(self):
+        '''
+        Only max_domains distinct domains are resolved per call
+        '''
+        entries = list(avatar_urls([
+            ('email', 'a@one.org'), ('email', 'b@two.org'),
+            ('email', 'c@one.org'), ('email', 'd@three.org'),
+        ], max_domains=2))
+        self.assertEqual(
+            ['unresolved' in entry for entry in entries],
+            [False, False, False, True])
+        self.assertEqual(len(self.names), 4)
+
+    def test_stream_json(self):
+        '''
+        The streamed pieces form a valid JSON array
+        '''
+        self.assertEqual(json.loads(''.join(stream_json([]))), [])
+        entries = [{'email': 'a@b.c'}, {'email': 'd@e.f'}]
+        self.assertEqual(json.loads(''.join(stream_json(entries))), entries)
@@ -3,9 +3,10 @@ ivatar/tools URL configuration
 '''
 
 from django.conf.urls import url
-from . views import CheckView, CheckDomainView
+from . views import CheckView, CheckDomainView, BatchView
 
 urlpatterns = [  # pylint: disable=invalid-name
     url('check/', CheckView.as_view(), name='tools_check'),
     url('check_domain/', CheckDomainView.as_view(), name='tools_check_domain'),
+    url('batch/', BatchView.as_view(), name='tools_batch'),
 ]
@@ -1,25 +1,50 @@
 '''
 View classes for ivatar/tools/
 '''
+import json
+
+from django.contrib.auth.decorators import login_required
+from django.views.generic.base import View
 from django.views.generic.edit import FormView
 from django.urls import reverse_lazy as reverse
 from django.shortcuts import render
+from django.core.cache import caches
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 
-from libravatar import libravatar_url, parse_user_identity
-from libravatar import SECURE_BASE_URL as LIBRAVATAR_SECURE_BASE_URL
-from libravatar import BASE_URL as LIBRAVATAR_BASE_URL
-import hashlib
+from ipware import get_client_ip
 
 from .forms import CheckDomainForm, CheckForm
-from ivatar.settings import SECURE_BASE_URL, BASE_URL
+from ivatar.digests import email_digests, openid_digest
+from ivatar.federation import federated_url, check_domain
+from ivatar.settings import AVATAR_MAX_SIZE
+from ivatar.settings import BATCH_MAX_ADDRESSES, BATCH_RESOLVE_TIMEOUT
+from ivatar.settings import BATCH_MAX_DOMAINS
+from ivatar.settings import BATCH_RATE_LIMIT, BATCH_RATE_PERIOD
+from .batch import avatar_urls, stream_json
 
 
+@method_decorator(login_required, name='dispatch')
 class CheckDomainView(FormView):
     '''
     View class for checking a domain
+
+    Only for logged in users, as it makes us connect to the servers the
+    domain names.
     '''
     template_name = 'check_domain.html'
     form_class = CheckDomainForm
+    success_url = reverse('tools_check_domain')
+
+    def form_valid(self, form):
+        super().form_valid(form)
+        domain = form.cleaned_data['domain']
+        return render(self.request, self.template_name, {
+            'form': form,
+            'domain': domain,
+            'services': check_domain(domain),
+        })
 
 
 class CheckView(FormView):
@@ -48,45 +73,31 @@ class CheckView(FormView):
             default_url = None
 
         if form.cleaned_data['mail']:
-            mailurl = libravatar_url(
+            mailurl = federated_url(
               email=form.cleaned_data['mail'],
               size=form.cleaned_data['size'],
               default=default_url)
-            mailurl = mailurl.replace(LIBRAVATAR_BASE_URL, BASE_URL)
-            mailurl_secure = libravatar_url(
+            mailurl_secure = federated_url(
               email=form.cleaned_data['mail'],
               size=form.cleaned_data['size'],
               https=True,
               default=default_url)
-            mailurl_secure = mailurl_secure.replace(
-              LIBRAVATAR_SECURE_BASE_URL,
-              SECURE_BASE_URL)
-            mail_hash = parse_user_identity(
-              email=form.cleaned_data['mail'],
-              openid=None)[0]
-            hash_obj = hashlib.new('sha256')
-            hash_obj.update(form.cleaned_data['mail'].encode('utf-8'))
-            mail_hash256 = hash_obj.hexdigest()
+            (mail_hash, mail_hash256) = email_digests(
+              form.cleaned_data['mail'])
             size = form.cleaned_data['size']
         if form.cleaned_data['openid']:
             if form.cleaned_data['openid'][-1] != '/':
                 form.cleaned_data['openid'] += '/'
-            openidurl = libravatar_url(
+            openidurl = federated_url(
               openid=form.cleaned_data['openid'],
               size=form.cleaned_data['size'],
               default=default_url)
-            openidurl = openidurl.replace(LIBRAVATAR_BASE_URL, BASE_URL)
-            openidurl_secure = libravatar_url(
+            openidurl_secure = federated_url(
               openid=form.cleaned_data['openid'],
               size=form.cleaned_data['size'],
               https=True,
               default=default_url)
-            openidurl_secure = openidurl_secure.replace(
-              LIBRAVATAR_SECURE_BASE_URL,
-              SECURE_BASE_URL)
-            openid_hash = parse_user_identity(
-              openid=form.cleaned_data['openid'],
-              email=None)[0]
+            openid_hash = openid_digest(form.cleaned_data['openid'])
             size = form.cleaned_data['size']
 
         return render(self.request, self.template_name, {
@@ -100,3 +111,68 @@ class CheckView(FormView):
             'openid_hash': openid_hash,
             'size': size,
         })
+
+
+def rate_limited(request):
+    '''
+    Count the request of the client, tell whether it's over the limit
+    '''
+    key = 'batch:%s' % get_client_ip(request)[0]
+    cache = caches['default']
+    cache.add(key, 0, BATCH_RATE_PERIOD)
+    try:
+        return cache.incr(key) > BATCH_RATE_LIMIT
+    except ValueError:
+        # Expired in the meantime
+        return False
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchView(View):
+    '''
+    Compute digests and avatar URLs of many addresses at once
+
+    Expects a JSON object with "emails" and/or "openids" lists and the
+    optional "size" and "default" parameters, answers with a JSON array
+    containing one object per address, in the same order. Delegations
+    not resolved within BATCH_RESOLVE_TIMEOUT, or beyond BATCH_MAX_DOMAINS
+    domains, are flagged "unresolved". Every client may send
+    BATCH_RATE_LIMIT requests per BATCH_RATE_PERIOD seconds.
+    '''
+
+    def post(self, request, *args, **kwargs):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Handle post - stream the results
+        '''
+        if rate_limited(request):
+            return JsonResponse({
+                'error': 'Too many requests, try again later',
+            }, status=429)
+
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+            emails = data.get('emails', [])
+            openids = data.get('openids', [])
+            if not isinstance(emails, list) or not isinstance(openids, list):
+                raise ValueError('emails and openids must be lists')
+            size = data.get('size')
+            if size is not None:
+                size = int(size)
+                if not 1 <= size <= AVATAR_MAX_SIZE:
+                    raise ValueError(
+                        'size must be between 1 and %i' % AVATAR_MAX_SIZE)
+        except (ValueError, TypeError, AttributeError) as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+
+        if len(emails) + len(openids) > BATCH_MAX_ADDRESSES:
+            return JsonResponse({
+                'error': 'Too many addresses (max: %i)' % BATCH_MAX_ADDRESSES,
+            }, status=400)
+
+        addresses = [('email', email) for email in emails]
+        addresses += [('openid', openid) for openid in openids]
+        return StreamingHttpResponse(
+            stream_json(avatar_urls(
+                addresses, size, data.get('default'),
+                timeout=BATCH_RESOLVE_TIMEOUT, max_domains=BATCH_MAX_DOMAINS)),
+            content_type='application/json')
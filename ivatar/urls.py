@@ -7,7 +7,8 @@ from django.conf.urls import url
 from django.conf.urls.static import static
 from django.views.generic import TemplateView, RedirectView
 from ivatar import settings
-from . views import AvatarImageView, GravatarProxyView
+from . views import AvatarImageView, GravatarProxyView, StageTimingView
+from . views import MetricsView, AvatarBulkView, SpriteView
 
 urlpatterns = [  # pylint: disable=invalid-name
     path('admin/', admin.site.urls),
@@ -30,6 +31,10 @@ urlpatterns = [  # pylint: disable=invalid-name
     url(
         r'gravatarproxy/(?P<digest>\w*)',
         GravatarProxyView.as_view(), name='gravatarproxy'),
+    path('avatars/', AvatarBulkView.as_view(), name='avatar_bulk'),
+    path('sprite/', SpriteView.as_view(), name='sprite'),
+    path('stage_timing/', StageTimingView.as_view(), name='stage_timing'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     url('description/', TemplateView.as_view(template_name='description.html'), name='description'),
     # The following two are TODO TODO TODO TODO TODO
     url('run_your_own/', TemplateView.as_view(template_name='run_your_own.html'), name='run_your_own'),
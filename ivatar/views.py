@@ -4,26 +4,49 @@ views under /
 from io import BytesIO
 from os import path
 import hashlib
+import json
+import math
+import time
 from urllib.request import urlopen
 from urllib.error import HTTPError, URLError
 from ssl import SSLError
 from django.views.generic.base import TemplateView, View
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotFound
+from django.http import JsonResponse, HttpResponseForbidden
+from django.http import HttpResponseBadRequest
+from django.core.cache import caches
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import F, Q
 from django.utils.translation import ugettext_lazy as _
 from django.urls import reverse_lazy
 
 from PIL import Image
-
-from monsterid.id import build_monster as BuildMonster
-from pydenticon import Generator as IdenticonGenerator
-from robohash import Robohash
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from ipware import get_client_ip
 
 from ivatar.settings import AVATAR_MAX_SIZE, JPEG_QUALITY, DEFAULT_AVATAR_SIZE
-from . ivataraccount.models import ConfirmedEmail, ConfirmedOpenId
-from . ivataraccount.models import pil_format, file_format
+from ivatar.settings import METRICS_ALLOWED_IPS, BULK_MAX_DIGESTS
+from ivatar.settings import SPRITE_MAX_TILES, SPRITE_COLUMNS
+from ivatar.settings import SPRITE_MAX_PIXELS
+from ivatar.settings import GRAVATAR_PROXY_CACHE_TIMEOUT
+from . timing import StageTimingMixin, HISTOGRAMS
+from . db_router import ReplicaReadMixin
+from . digests import DIGEST_RE, split_digests
+from . generators import get_generator
+from . tiles import render_tiles, nobody_tile
+from . metrics import AVATAR_REQUESTS, GRAVATARPROXY_REQUESTS
+from . metrics import UPSTREAM_DURATION, UPSTREAM_ERRORS, RENDER_DURATION
+from . metrics import size_class, get_registry, count_cache
+from . ivataraccount.models import ConfirmedEmail, ConfirmedOpenId, Photo
+from . ivataraccount.models import pil_format, file_format, photo_etag
 
 URL_TIMEOUT = 5  # in seconds
+GRAVATAR_URL = 'https://secure.gravatar.com/avatar/'
 
 
 def get_size(request, size=DEFAULT_AVATAR_SIZE):
@@ -50,7 +73,7 @@ def get_size(request, size=DEFAULT_AVATAR_SIZE):
     return size
 
 
-class AvatarImageView(TemplateView):
+class AvatarImageView(ReplicaReadMixin, StageTimingMixin, TemplateView):
     '''
     View to return (binary) image, based on OpenID/Email (both by digest)
     '''
@@ -89,45 +112,58 @@ class AvatarImageView(TemplateView):
             if request.GET['gravatarproxy'] == 'n':
                 gravatarproxy = False
 
-        try:
-            obj = model.objects.get(digest=kwargs['digest'])
-        except ObjectDoesNotExist:
+        with self.timer.stage('lookup'):
             try:
-                obj = model.objects.get(digest_sha256=kwargs['digest'])
+                obj = model.objects.get(digest=kwargs['digest'])
             except ObjectDoesNotExist:
-                model = ConfirmedOpenId
                 try:
-                    obj = model.objects.get(digest=kwargs['digest'])
-                except:
-                    pass
-
+                    obj = model.objects.get(digest_sha256=kwargs['digest'])
+                except ObjectDoesNotExist:
+                    model = ConfirmedOpenId
+                    try:
+                        obj = model.objects.get(digest=kwargs['digest'])
+                    except:
+                        pass
+
+        photo = None
+        if obj and obj.photo_id:
+            # Without the blob, it's only loaded if the image is rendered
+            with self.timer.stage('fetch'):
+                photo = Photo.objects.defer('data').filter(
+                    pk=obj.photo_id).first()
 
         # If that mail/openid doesn't exist, or has no photo linked to it
-        if not obj or not obj.photo or forcedefault:
-            gravatar_url = 'https://secure.gravatar.com/avatar/' + kwargs['digest'] \
+        if not photo or forcedefault:
+            gravatar_url = GRAVATAR_URL + kwargs['digest'] \
                 + '?s=%i' % size
 
             # If we have redirection to Gravatar enabled, this overrides all
             # default= settings, except forcedefault!
             if gravatarredirect and not forcedefault:
+                AVATAR_REQUESTS.labels('gravatarredirect', '').inc()
                 return HttpResponseRedirect(gravatar_url)
 
             # Request to proxy Gravatar image - only if not forcedefault
             if gravatarproxy and not forcedefault:
                 url = reverse_lazy('gravatarproxy', args=[kwargs['digest']]) \
                     + '?s=%i' % size
+                AVATAR_REQUESTS.labels('gravatarproxy', '').inc()
                 return HttpResponseRedirect(url)
 
             # Return the default URL, as specified, or 404 Not Found, if default=404
             if default:
                 if str(default) == str(404):
+                    AVATAR_REQUESTS.labels('notfound', '').inc()
                     return HttpResponseNotFound(_('<h1>Image not found</h1>'))
 
                 if str(default) == 'monsterid':
-                    monsterdata = BuildMonster(seed=kwargs['digest'], size=(size, size))
-                    data = BytesIO()
-                    monsterdata.save(data, 'PNG', quality=JPEG_QUALITY)
-                    data.seek(0)
+                    with self.timer.stage('monsterid'):
+                        monsterdata = get_generator('monsterid')(
+                            seed=kwargs['digest'], size=(size, size))
+                        data = BytesIO()
+                        monsterdata.save(data, 'PNG', quality=JPEG_QUALITY)
+                        data.seek(0)
+                    AVATAR_REQUESTS.labels('default', 'monsterid').inc()
                     return HttpResponse(
                         data,
                         content_type='image/png')
@@ -136,11 +172,13 @@ class AvatarImageView(TemplateView):
                     roboset = 'any'
                     if request.GET.get('robohash'):
                         roboset = request.GET.get('robohash')
-                    robohash = Robohash(kwargs['digest'])
-                    robohash.assemble(roboset=roboset, sizex=size, sizey=size)
-                    data = BytesIO()
-                    robohash.img.save(data, format='png')
-                    data.seek(0)
+                    with self.timer.stage('robohash'):
+                        robohash = get_generator('robohash')(kwargs['digest'])
+                        robohash.assemble(roboset=roboset, sizex=size, sizey=size)
+                        data = BytesIO()
+                        robohash.img.save(data, format='png')
+                        data.seek(0)
+                    AVATAR_REQUESTS.labels('default', 'robohash').inc()
                     return HttpResponse(
                         data,
                         content_type='image/png')
@@ -161,12 +199,14 @@ class AvatarImageView(TemplateView):
                     # Since padding is _added_ around the generated image, we
                     # need to reduce the image size by padding*2 (left/right, top/bottom)
                     size = size - 2*padwidth
-                    generator = IdenticonGenerator(
-                        10, 10, digest=hashlib.sha1,
-                        foreground=foreground, background=background)
-                    data = generator.generate(
-                        kwargs['digest'], size, size,
-                        output_format='png', padding=padding, inverted=False)
+                    with self.timer.stage('identicon'):
+                        generator = get_generator('identicon')(
+                            10, 10, digest=hashlib.sha1,
+                            foreground=foreground, background=background)
+                        data = generator.generate(
+                            kwargs['digest'], size, size,
+                            output_format='png', padding=padding, inverted=False)
+                    AVATAR_REQUESTS.labels('default', str(default)).inc()
                     return HttpResponse(
                         data,
                         content_type='image/png')
@@ -178,7 +218,9 @@ class AvatarImageView(TemplateView):
                         # We trust this exists!!!
                         static_img = path.join('static', 'img', 'mm', '512.png')
                     # We trust static/ is mapped to /static/
+                    AVATAR_REQUESTS.labels('default', str(default)).inc()
                     return HttpResponseRedirect('/' + static_img)
+                AVATAR_REQUESTS.labels('default', 'url').inc()
                 return HttpResponseRedirect(default)
 
             static_img = path.join('static', 'img', 'nobody', '%s%s' % (str(size), '.png'))
@@ -186,28 +228,52 @@ class AvatarImageView(TemplateView):
                 # We trust this exists!!!
                 static_img = path.join('static', 'img', 'nobody', '512.png')
             # We trust static/ is mapped to /static/
+            AVATAR_REQUESTS.labels('default', 'nobody').inc()
             return HttpResponseRedirect('/' + static_img)
 
-        imgformat = obj.photo.format
-        photodata = Image.open(BytesIO(obj.photo.data))
-
-        photodata.thumbnail((size, size), Image.ANTIALIAS)
-        data = BytesIO()
-        photodata.save(data, pil_format(imgformat), quality=JPEG_QUALITY)
-        data.seek(0)
-        obj.photo.access_count += 1
-        obj.photo.save()
-        obj.access_count += 1
-        obj.save()
-        return HttpResponse(
-            data,
-            content_type='image/%s' % imgformat)
-
-class GravatarProxyView(View):
+        # Same validators as returned by /avatars/, clients can revalidate
+        etag = photo.etag
+        last_modified = photo.modified.timestamp()
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            imgformat = photo.format
+            render_start = time.perf_counter()
+            with self.timer.stage('decode'):
+                photodata = Image.open(BytesIO(photo.data))
+                photodata.load()
+
+            with self.timer.stage('resize'):
+                photodata.thumbnail((size, size), Image.ANTIALIAS)
+            with self.timer.stage('encode'):
+                data = BytesIO()
+                photodata.save(
+                    data, pil_format(imgformat), quality=JPEG_QUALITY)
+                data.seek(0)
+            RENDER_DURATION.labels(size_class(size)).observe(
+                time.perf_counter() - render_start)
+            response = HttpResponse(
+                data,
+                content_type='image/%s' % imgformat)
+        AVATAR_REQUESTS.labels('photo', '').inc()
+        with self.timer.stage('count'):
+            # Increment in the (primary) database, obj may be read from a
+            # lagging replica and other requests count concurrently
+            Photo.objects.filter(pk=photo.pk).update(
+                access_count=F('access_count') + 1)
+            type(obj).objects.filter(pk=obj.pk).update(
+                access_count=F('access_count') + 1)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+class GravatarProxyView(StageTimingMixin, View):
     '''
     Proxy request to Gravatar and return the image from there
+
+    The answers (the image, or that Gravatar only has its default image)
+    are cached for GRAVATAR_PROXY_CACHE_TIMEOUT seconds in the proxy cache.
     '''
-    # TODO: Do cache images!! Memcached?
 
     def get(self, request, *args, **kwargs):  # pylint: disable=too-many-branches,too-many-statements,too-many-locals,no-self-use,unused-argument
         '''
@@ -222,51 +288,258 @@ class GravatarProxyView(View):
         size = get_size(request)
         gravatarimagedata = None
 
+        proxy_cache = caches['proxy']
+        cache_key = 'gravatar:%s:%i' % (kwargs['digest'], size)
+        cached = proxy_cache.get(cache_key)
+        count_cache('gravatarproxy', cached is not None)
+        if cached == 'default':
+            GRAVATARPROXY_REQUESTS.labels('default').inc()
+            return redir_default()
+        if cached:
+            GRAVATARPROXY_REQUESTS.labels('image').inc()
+            return HttpResponse(cached[0], content_type=cached[1])
+
         # This part is special/hackish
         # Check if the image returned by Gravatar is their default image, if so,
         # redirect to our default instead.
-        gravatar_test_url = 'https://secure.gravatar.com/avatar/' + kwargs['digest'] \
+        gravatar_test_url = GRAVATAR_URL + kwargs['digest'] \
             + '?s=%i' % 50
         try:
-            testdata = urlopen(gravatar_test_url, timeout=URL_TIMEOUT)
-            data = BytesIO(testdata.read())
+            with self.timer.stage('upstream_test'), \
+                    UPSTREAM_DURATION.labels('gravatar').time():
+                testdata = urlopen(gravatar_test_url, timeout=URL_TIMEOUT)
+                data = BytesIO(testdata.read())
             if hashlib.md5(data.read()).hexdigest() == '71bc262d627971d13fe6f3180b93062a':
+                proxy_cache.set(
+                    cache_key, 'default', GRAVATAR_PROXY_CACHE_TIMEOUT)
+                GRAVATARPROXY_REQUESTS.labels('default').inc()
                 return redir_default()
         except Exception as exc:
+            UPSTREAM_ERRORS.labels('gravatar', getattr(exc, 'code', 'error')).inc()
             print('Gravatar test url fetch failed: %s' % exc)
 
-        gravatar_url = 'https://secure.gravatar.com/avatar/' + kwargs['digest'] \
+        gravatar_url = GRAVATAR_URL + kwargs['digest'] \
             + '?s=%i' % size
 
         try:
-            gravatarimagedata = urlopen(gravatar_url, timeout=URL_TIMEOUT)
+            with self.timer.stage('upstream'):
+                upstream_start = time.perf_counter()
+                gravatarimagedata = urlopen(gravatar_url, timeout=URL_TIMEOUT)
         except HTTPError as exc:
+            UPSTREAM_ERRORS.labels('gravatar', exc.code).inc()
+            GRAVATARPROXY_REQUESTS.labels('error').inc()
             if exc.code != 404 and exc.code != 503:
                 print(
                     'Gravatar fetch failed with an unexpected %s HTTP error' %
                     exc.code)
             return redir_default()
         except URLError as exc:
+            UPSTREAM_ERRORS.labels('gravatar', 'url').inc()
+            GRAVATARPROXY_REQUESTS.labels('error').inc()
             print(
                 'Gravatar fetch failed with URL error: %s' %
                 exc.reason)
             return redir_default()
         except SSLError as exc:
+            UPSTREAM_ERRORS.labels('gravatar', 'ssl').inc()
+            GRAVATARPROXY_REQUESTS.labels('error').inc()
             print(
                 'Gravatar fetch failed with SSL error: %s' %
                 exc.reason)
             return redir_default()
         try:
-            data = BytesIO(gravatarimagedata.read())
-            img = Image.open(data)
-            data.seek(0)
-            return HttpResponse(
-                data.read(),
-                content_type='image/%s' % file_format(img.format))
+            with self.timer.stage('upstream_read'):
+                data = BytesIO(gravatarimagedata.read())
+            UPSTREAM_DURATION.labels('gravatar').observe(
+                time.perf_counter() - upstream_start)
+            with self.timer.stage('sniff'):
+                img = Image.open(data)
+            content_type = 'image/%s' % file_format(img.format)
+            proxy_cache.set(
+                cache_key, (data.getvalue(), content_type),
+                GRAVATAR_PROXY_CACHE_TIMEOUT)
+            GRAVATARPROXY_REQUESTS.labels('image').inc()
+            return HttpResponse(data.getvalue(), content_type=content_type)
 
         except ValueError as exc:
+            UPSTREAM_ERRORS.labels('gravatar', 'image').inc()
+            GRAVATARPROXY_REQUESTS.labels('error').inc()
             print('Value error: %s' % exc)
             return redir_default()
 
         # We shouldn't reach this point... But make sure we do something
         return redir_default()
+
+
+def lookup_photos(digests):
+    '''
+    Return {digest (in lower case): (photo id, modified)} for the given
+    digests that have a photo
+
+    Uses one query per model instead of one per digest, and doesn't load
+    any image data. Mail addresses take precedence, as in AvatarImageView.
+    '''
+    (md5s, sha256s) = split_digests(digests)
+
+    photos = {}
+    if sha256s:
+        for (digest, photo_id, modified) in ConfirmedOpenId.objects.filter(
+                digest__in=sha256s, photo__isnull=False).values_list(
+                    'digest', 'photo_id', 'photo__modified'):
+            photos[digest] = (photo_id, modified)
+    if md5s or sha256s:
+        for (digest, digest_sha256, photo_id, modified) in \
+                ConfirmedEmail.objects.filter(
+                    Q(digest__in=md5s) | Q(digest_sha256__in=sha256s),
+                    photo__isnull=False).values_list(
+                        'digest', 'digest_sha256', 'photo_id',
+                        'photo__modified'):
+            photos[digest] = photos[digest_sha256] = (photo_id, modified)
+    return photos
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AvatarBulkView(ReplicaReadMixin, View):
+    '''
+    Tell which of many digests have a photo, without fetching any image
+
+    Expects a JSON object with a "digests" list of MD5 and/or SHA256
+    digests, answers with a JSON object keyed by digest.
+    '''
+
+    def post(self, request, *args, **kwargs):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Handle post - look up all digests at once
+        '''
+        try:
+            digests = json.loads(request.body.decode('utf-8'))['digests']
+            if not isinstance(digests, list):
+                raise ValueError('digests must be a list')
+        except (ValueError, TypeError, KeyError) as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        if len(digests) > BULK_MAX_DIGESTS:
+            return JsonResponse({
+                'error': 'Too many digests (max: %i)' % BULK_MAX_DIGESTS,
+            }, status=400)
+
+        result = {}
+        for digest in digests:
+            if not isinstance(digest, str) or \
+                    not DIGEST_RE.fullmatch(digest.lower()):
+                result[str(digest)] = {'error': 'invalid digest'}
+            else:
+                result[digest] = {'exists': False}
+        photos = lookup_photos(
+            digest.lower() for (digest, entry) in result.items()
+            if 'error' not in entry)
+
+        for (digest, entry) in result.items():
+            if 'error' in entry or digest.lower() not in photos:
+                continue
+            (photo_id, modified) = photos[digest.lower()]
+            entry.update({
+                'exists': True,
+                'etag': photo_etag(photo_id, modified),
+                'last_modified': http_date(modified.timestamp()),
+            })
+        return JsonResponse(result)
+
+
+class SpriteView(ReplicaReadMixin, StageTimingMixin, View):
+    '''
+    Return the avatars of many digests composited into a single image
+
+    Takes ?digests=<digest>,<digest>,... and the usual size argument. The
+    tiles are laid out in rows of "cols" tiles, in the given order; with
+    format=json their offsets are returned instead, for use as a CSS
+    sprite. Digests without a photo get the "nobody" image.
+    '''
+
+    def get(self, request, *args, **kwargs):  # pylint: disable=unused-argument
+        '''
+        Override get from parent class
+        '''
+        digests = [
+            digest.lower()
+            for digest in request.GET.get('digests', '').split(',') if digest]
+        if not digests or len(digests) > SPRITE_MAX_TILES or not all(
+                DIGEST_RE.fullmatch(digest) for digest in digests):
+            return HttpResponseBadRequest(
+                _('Between 1 and %i valid digests required') %
+                SPRITE_MAX_TILES)
+        size = get_size(request)
+        try:
+            columns = int(request.GET.get('cols', SPRITE_COLUMNS))
+        except ValueError:
+            columns = SPRITE_COLUMNS
+        columns = max(1, min(columns, len(digests)))
+        rows = math.ceil(len(digests) / columns)
+        if columns * rows * size * size > SPRITE_MAX_PIXELS:
+            return HttpResponseBadRequest(
+                _('Sprite too large, request fewer or smaller tiles'))
+
+        with self.timer.stage('lookup'):
+            photos = lookup_photos(digests)
+
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'size': size,
+                'width': columns * size,
+                'height': rows * size,
+                'tiles': [{
+                    'digest': digest,
+                    'x': (index % columns) * size,
+                    'y': (index // columns) * size,
+                    'exists': digest in photos,
+                } for (index, digest) in enumerate(digests)],
+            })
+
+        with self.timer.stage('render'):
+            tiles = render_tiles(set(photos.values()), size)
+        with self.timer.stage('encode'):
+            sprite = Image.new('RGBA', (columns * size, rows * size))
+            nobody = None
+            for (index, digest) in enumerate(digests):
+                # Photos may be gone since the lookup, or broken
+                tile = tiles.get(photos.get(digest, (None,))[0])
+                if tile:
+                    tile = Image.open(BytesIO(tile))
+                else:
+                    if not nobody:
+                        nobody = nobody_tile(size)
+                    tile = nobody
+                sprite.paste(tile, (
+                    (index % columns) * size + (size - tile.size[0]) // 2,
+                    (index // columns) * size + (size - tile.size[1]) // 2))
+            data = BytesIO()
+            sprite.save(data, 'PNG')
+        return HttpResponse(data.getvalue(), content_type='image/png')
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class StageTimingView(View):
+    '''
+    Return the stage timing histograms of this process (see ivatar/timing.py)
+    '''
+
+    def get(self, request, *args, **kwargs):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Override get from parent class
+        '''
+        return JsonResponse(HISTOGRAMS.as_dict())
+
+
+class MetricsView(View):
+    '''
+    Export the metrics in the Prometheus text format (see ivatar/metrics.py)
+    '''
+
+    def get(self, request, *args, **kwargs):  # pylint: disable=no-self-use,unused-argument
+        '''
+        Override get from parent class
+        '''
+        if get_client_ip(request)[0] not in METRICS_ALLOWED_IPS:
+            return HttpResponseForbidden()
+        return HttpResponse(
+            generate_latest(get_registry()),
+            content_type=CONTENT_TYPE_LATEST)
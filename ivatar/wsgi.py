@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ivatar.settings")
 
 application = get_wsgi_application()  # pylint: disable=invalid-name
+
+# pylint: disable=wrong-import-position
+from ivatar.settings import PRELOAD_GENERATORS  # noqa
+if PRELOAD_GENERATORS:
+    from ivatar.generators import preload  # noqa
+    preload()